@@ -0,0 +1,90 @@
+"""Random access into the members of a zip archive on disk, without reading it all."""
+import mmap
+import os
+import pathlib
+import struct
+import zipfile
+import zlib
+
+# the fixed part of a local file header, the name and extra field follow it
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+class MappedArchive:
+    """A zip archive that is memory mapped, with an index of the member offsets.
+
+    Only the central directory is read when the archive is opened. Reading a member
+    decompresses the bytes of that member from the mapped file, so the memory used does
+    not depend on the size of the archive. Supports the part of the ZipFile interface
+    used here (read, namelist, filename), members can be read from several threads.
+    """
+
+    def __init__(self, path):
+        self.filename = str(pathlib.Path(path))
+        # an empty file can not be mapped (for example an interrupted download)
+        if not os.path.getsize(self.filename):
+            raise zipfile.BadZipFile(f"{self.filename} is empty")
+        with zipfile.ZipFile(self.filename) as zf:
+            # name -> (local header offset, compressed size, size, compression, crc32)
+            self.members = {
+                info.filename: (
+                    info.header_offset,
+                    info.compress_size,
+                    info.file_size,
+                    info.compress_type,
+                    info.CRC,
+                )
+                for info in zf.infolist()
+            }
+        with open(self.filename, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __getstate__(self):
+        # the map can not be pickled, open the archive again in the other process
+        return {"filename": self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state["filename"])
+
+    def close(self):
+        self.mmap.close()
+
+    def namelist(self):
+        return list(self.members)
+
+    def data_offset(self, name):
+        """the offset of the (compressed) data of a member"""
+        offset = self.members[name][0]
+        header = LOCAL_HEADER.unpack_from(self.mmap, offset)
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"bad local file header for {name}")
+        name_length, extra_length = header[-2:]
+        return offset + LOCAL_HEADER.size + name_length + extra_length
+
+    def read(self, name):
+        """the bytes of a member, the crc32 is checked"""
+        if name not in self.members:
+            raise KeyError(f"there is no item named {name!r} in the archive")
+        _, compress_size, file_size, compress_type, crc = self.members[name]
+        if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            # other compressions (bzip2, lzma) are read with zipfile
+            with zipfile.ZipFile(self.filename) as zf:
+                return zf.read(name)
+        start = self.data_offset(name)
+        data = self.mmap[start : start + compress_size]
+        if compress_type == zipfile.ZIP_DEFLATED:
+            # raw deflate stream, without zlib header
+            data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(data, file_size)
+        if zlib.crc32(data) != crc:
+            raise zipfile.BadZipFile(f"bad crc32 for {name}")
+        return data
@@ -0,0 +1,220 @@
+"""Resampling (bootstrap and Monte-Carlo) uncertainty of the model parameters."""
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+import scipy.signal
+
+import slr.models
+
+METHODS = ["block", "residual", "monte_carlo"]
+# quantities from which the surge was subtracted (see slr.psmsl.merge_surge)
+SURGE_CORRECTED = ["height - surge", "height - surge anomaly"]
+
+
+def _prepare(df, design, quantity, with_ar):
+    """fit the original model on the rows without missing values.
+    All rows are kept, so resampled residuals keep the time steps (and gaps) of the series."""
+    X, names = design(df)
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(df[quantity], dtype="float64")
+    valid = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+    fit = slr.models.fit_batch(y[valid][np.newaxis], X[valid], with_ar=with_ar)
+    params = fit.params.to_numpy()[0]
+    rho = fit.rho.iloc[0] if with_ar else 0.0
+    # the (unwhitened) residuals, these still have the AR(1) structure, nan in the gaps
+    resid = y - X @ params
+    station = {
+        "y": y,
+        "X": X,
+        "valid": valid,
+        "names": names,
+        "params": params,
+        "rho": rho,
+        "resid": resid,
+        "surge_corrected": quantity in SURGE_CORRECTED,
+    }
+    if "u" in df and "v" in df:
+        station["u"] = np.asarray(df["u"], dtype="float64")
+        station["v"] = np.asarray(df["v"], dtype="float64")
+    return station
+
+
+def _block_resample(resid, n_replicates, block_length, rng):
+    """moving block bootstrap of the residuals, blocks keep the autocorrelation.
+    The blocks are taken from all time steps, missing residuals stay missing."""
+    n = len(resid)
+    block_length = min(block_length, n)
+    n_blocks = -(-n // block_length)
+    starts = rng.integers(0, n - block_length + 1, size=(n_replicates, n_blocks))
+    index = starts[:, :, np.newaxis] + np.arange(block_length)
+    index = index.reshape(n_replicates, -1)[:, :n]
+    return resid[index]
+
+
+def _residual_resample(resid, rho, n_replicates, rng):
+    """resample the AR(1) innovations and filter them back into residuals"""
+    # only the innovations of consecutive time steps, not across the gaps
+    innovations = resid[1:] - rho * resid[:-1]
+    innovations = innovations[~np.isnan(innovations)]
+    innovations = innovations - innovations.mean()
+    draws = rng.choice(innovations, size=(n_replicates, len(resid)))
+    # start each replicate in a resampled residual
+    draws[:, 0] = rng.choice(resid[~np.isnan(resid)], size=n_replicates)
+    # u[t] = rho * u[t - 1] + e[t]
+    return scipy.signal.lfilter([1.0], [1.0, -rho], draws, axis=1)
+
+
+def _monte_carlo_designs(station, n_replicates, wind_sd, surge_sd, rng):
+    """perturb the wind and surge inputs, returns the endog and exog of the replicates"""
+    valid, columns = station["valid"], station["names"].columns
+    y, X = station["y"][valid], station["X"][valid]
+    endog = np.broadcast_to(y, (n_replicates, len(y))).copy()
+    exog = np.broadcast_to(X, (n_replicates,) + X.shape).copy()
+    if wind_sd:
+        if "wind_u2" not in columns:
+            raise ValueError("wind_sd requires a design with wind")
+        if "u" not in station:
+            raise ValueError("wind_sd requires the u and v columns in the data")
+        # perturb the wind components and recompute the signed squared wind (see add_u2v2)
+        for key, component in [("wind_u2", "u"), ("wind_v2", "v")]:
+            wind = station[component][valid] + rng.normal(
+                scale=wind_sd, size=(n_replicates, len(y))
+            )
+            exog[:, :, columns[key]] = wind**2 * np.sign(wind)
+    # without a surge regressor or a surge corrected quantity the surge is not in the model
+    if surge_sd and ("surge" in columns or station["surge_corrected"]):
+        surge = rng.normal(scale=surge_sd, size=(n_replicates, len(y)))
+        if "surge" in columns:
+            exog[:, :, columns["surge"]] += surge
+        else:
+            # the surge was subtracted from the quantity (height - surge)
+            endog += surge
+    return endog, exog
+
+
+def _replicate_chunk(task):
+    """fit one chunk of replicates of one station, returns the parameters"""
+    station, options, n_replicates, seed = task
+    rng = np.random.default_rng(seed)
+    method = options["method"]
+    if method == "monte_carlo":
+        endog, exog = _monte_carlo_designs(
+            station, n_replicates, options["wind_sd"], options["surge_sd"], rng
+        )
+    else:
+        if method == "block":
+            resid = _block_resample(
+                station["resid"], n_replicates, options["block_length"], rng
+            )
+        else:
+            rho = station["rho"] if options["with_ar"] else 0.0
+            resid = _residual_resample(station["resid"], rho, n_replicates, rng)
+        endog = station["X"] @ station["params"] + resid
+        # the replicates have the gaps of the series, the rows with missing values (and
+        # residuals resampled from a gap) are dropped in the fit
+        endog[:, ~station["valid"]] = np.nan
+        exog = station["X"]
+    results = slr.models.fit_batch(endog, exog, with_ar=options["with_ar"])
+    return results.params.to_numpy()
+
+
+def bootstrap(
+    dfs,
+    design=slr.models.linear_design,
+    method="block",
+    n_replicates=1000,
+    block_length=None,
+    wind_sd=None,
+    surge_sd=None,
+    with_ar=True,
+    quantity="height",
+    alpha=0.05,
+    seed=None,
+    jobs=1,
+    chunk_size=250,
+):
+    """Percentile intervals of the model parameters per station, by resampling.
+
+    dfs maps a station to its data frame, design is a design function (see slr.models).
+    Methods:
+    - block: moving block bootstrap of the residuals (block_length defaults to n ** (1/3)),
+    - residual: resample the AR(1) innovations of the residuals (iid residuals without AR),
+    - monte_carlo: propagate the uncertainty of the inputs, normal noise with standard deviation
+      wind_sd [m/s] on the u and v wind components and surge_sd [mm] on the surge. The surge
+      noise is added to the surge regressor or to a surge corrected quantity (SURGE_CORRECTED),
+      for other quantities (height) without a surge regressor it has no effect.
+    The residuals are resampled on all rows (time steps) of the series, rows with missing
+    values are left out of each fit, so blocks do not join the years around a gap.
+    All replicates of a chunk are fitted as one batch (see fit_batch) and the chunks run in a
+    pool of jobs threads. Each chunk has its own seed spawned from seed, so the results
+    do not depend on jobs.
+    Returns a table indexed by (station, term) with the estimate, the standard error of the
+    replicates and the lower and upper bound of the 1 - alpha interval.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method should be one of {METHODS}: {method}")
+    if method == "monte_carlo" and not (wind_sd or surge_sd):
+        raise ValueError("monte_carlo requires wind_sd and/or surge_sd")
+
+    stations = {
+        station_id: _prepare(df, design, quantity, with_ar)
+        for station_id, df in dfs.items()
+    }
+    if method == "monte_carlo" and surge_sd and not wind_sd:
+        for station in stations.values():
+            has_surge = "surge" in station["names"].columns
+            if not has_surge and not station["surge_corrected"]:
+                raise ValueError(
+                    f"surge_sd has no effect on {quantity} without a surge regressor, "
+                    f"use a design with surge or one of {SURGE_CORRECTED}"
+                )
+
+    options = {
+        "method": method,
+        "wind_sd": wind_sd,
+        "surge_sd": surge_sd,
+        "with_ar": with_ar,
+    }
+    chunk_sizes = [
+        min(chunk_size, n_replicates - start)
+        for start in range(0, n_replicates, chunk_size)
+    ]
+    station_seeds = np.random.SeedSequence(seed).spawn(len(stations))
+    tasks = []
+    for (station_id, station), station_seed in zip(stations.items(), station_seeds):
+        station_options = dict(options)
+        station_options["block_length"] = block_length or max(
+            1, int(round(len(station["y"]) ** (1 / 3)))
+        )
+        chunk_seeds = station_seed.spawn(len(chunk_sizes))
+        for n, chunk_seed in zip(chunk_sizes, chunk_seeds):
+            tasks.append((station, station_options, n, chunk_seed))
+
+    if jobs == 1:
+        chunks = list(map(_replicate_chunk, tasks))
+    else:
+        # numpy releases the GIL in the batched linear algebra
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            chunks = list(executor.map(_replicate_chunk, tasks))
+
+    rows = []
+    for i, (station_id, station) in enumerate(stations.items()):
+        n_chunks = len(chunk_sizes)
+        replicates = np.concatenate(chunks[i * n_chunks : (i + 1) * n_chunks])
+        lower, upper = np.percentile(
+            replicates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0
+        )
+        se = replicates.std(axis=0, ddof=1)
+        for j, term in enumerate(station["names"]):
+            rows.append(
+                {
+                    "station": station_id,
+                    "term": term,
+                    "estimate": station["params"][j],
+                    "se": se[j],
+                    "lower": lower[j],
+                    "upper": upper[j],
+                }
+            )
+    return pd.DataFrame(rows).set_index(["station", "term"])
@@ -0,0 +1,82 @@
+"""On disk cache for derived datasets (parsed archives, wind products)."""
+import hashlib
+import json
+import os
+import pathlib
+import threading
+
+import slr
+
+# increase this if the format of the cached files changes
+CACHE_VERSION = 1
+
+
+def get_cache_dir(cache_dir=None):
+    """get the directory where cached files are stored, created if needed"""
+    if cache_dir is None:
+        cache_dir = slr.get_src_dir() / ".cache"
+    cache_dir = pathlib.Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def file_fingerprint(path, cache_dir=None, chunk_size=2**20):
+    """return the size, modification time and sha256 of a file.
+    The hash is only recomputed if the size or modification time changed. Each file has its
+    own fingerprint file, written atomically, so parallel processes do not lose entries."""
+    path = pathlib.Path(path).resolve()
+    stat = path.stat()
+    fingerprints_dir = get_cache_dir(cache_dir) / "fingerprints"
+    fingerprints_dir.mkdir(exist_ok=True)
+    name = hashlib.sha256(str(path).encode()).hexdigest()[:16]
+    fingerprint_path = fingerprints_dir / f"{name}.json"
+    fingerprint = None
+    if fingerprint_path.exists():
+        fingerprint = json.loads(fingerprint_path.read_text())
+    if (
+        fingerprint is not None
+        and fingerprint["size"] == stat.st_size
+        and fingerprint["mtime_ns"] == stat.st_mtime_ns
+    ):
+        return fingerprint
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    fingerprint = {
+        "path": str(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256.hexdigest(),
+    }
+    write_atomic(fingerprint_path, json.dumps(fingerprint, indent=2).encode())
+    return fingerprint
+
+
+def cache_key(*parts):
+    """create a short key from the cache version and a list of parts"""
+    text = json.dumps([CACHE_VERSION, *parts], default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def cache_path(kind, name, key, suffix=".parquet", cache_dir=None):
+    """return the path of a cached file, removing stale versions of the same name"""
+    directory = get_cache_dir(cache_dir) / kind
+    directory.mkdir(exist_ok=True)
+    path = directory / f"{name}-{key}{suffix}"
+    # a new release (other key) invalidates the old cached files
+    for stale in directory.glob(f"{name}-*{suffix}"):
+        if stale != path and stale.stem.rsplit("-", 1)[0] == name:
+            stale.unlink()
+    return path
+
+
+def write_atomic(path, data):
+    """write bytes to path, so that readers never see a partial file"""
+    # unique per process and thread, the last writer wins
+    tmp_path = path.with_name(
+        path.name + f".{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,124 @@
+"""Catalogue of the psmsl stations, with the main station metadata and spatial queries."""
+import numpy as np
+import pandas as pd
+
+import slr.archive
+import slr.cache
+import slr.grid
+import slr.psmsl
+
+# catalogues by cache key, a station list is parsed once per process
+_catalogues = {}
+
+
+class StationCatalogue:
+    """The stations of a psmsl dataset (see get_station_list), indexed by psmsl id.
+
+    The table has the metadata of the main stations (ddl_id, nap-rlr, alpha, ...) for the
+    stations in main_stations.json and the number of years with data in record_length
+    (if known). Queries return a subset of the table, the spatial queries use a KD-tree
+    on the sphere (see slr.grid) and add the distance in km.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        # not from the grid index cache, every filtered catalogue has its own points
+        self.index = slr.grid.GridIndex(
+            table["lat"].to_numpy(), table["lon"].to_numpy(), regular=False
+        )
+
+    def __len__(self):
+        return len(self.table)
+
+    def _with_distance(self, positions, distance):
+        result = self.table.iloc[positions].copy()
+        result["distance_km"] = distance
+        return result
+
+    def nearest(self, lat, lon, k=1):
+        """the k nearest stations of a location, sorted by distance"""
+        k = min(k, len(self.table))
+        xyz = slr.grid.lonlat_to_xyz(lon, lat)
+        chord, positions = self.index.tree.query(xyz, k=k)
+        positions, chord = np.atleast_1d(positions), np.atleast_1d(chord)
+        return self._with_distance(positions, _chord_to_km(chord))
+
+    def within_radius(self, lat, lon, radius_km):
+        """the stations within radius_km of a location, sorted by distance"""
+        xyz = slr.grid.lonlat_to_xyz(lon, lat)
+        # the chord length on the unit sphere of the radius
+        chord = 2 * np.sin(min(radius_km / slr.grid.EARTH_RADIUS_KM, np.pi) / 2)
+        positions = np.array(self.index.tree.query_ball_point(xyz, chord), dtype=int)
+        distance = _chord_to_km(
+            np.linalg.norm(self.index.tree.data[positions] - xyz, axis=1)
+        )
+        order = np.argsort(distance, kind="stable")
+        return self._with_distance(positions[order], distance[order])
+
+    def within_bbox(self, south, north, west, east):
+        """the stations in a lat/lon box, west > east for boxes across the date line"""
+        lat = self.table["lat"].to_numpy()
+        lon = self.table["lon"].to_numpy()
+        in_lat = (lat >= south) & (lat <= north)
+        if west <= east:
+            in_lon = (lon >= west) & (lon <= east)
+        else:
+            in_lon = (lon >= west) | (lon <= east)
+        return self.table[in_lat & in_lon]
+
+    def filter(self, coastline_code=None, quality=None, min_record_length=None):
+        """Select stations by coastline code(s), quality flag and minimal record length [years].
+        Returns a new catalogue, so queries can be chained."""
+        selected = np.ones(len(self.table), dtype=bool)
+        if coastline_code is not None:
+            codes = np.atleast_1d(coastline_code)
+            selected &= self.table["coastline_code"].isin(codes).to_numpy()
+        if quality is not None:
+            selected &= (self.table["quality"] == quality).to_numpy()
+        if min_record_length is not None:
+            if "record_length" not in self.table:
+                raise ValueError("the record length is not known, see record_lengths")
+            selected &= (self.table["record_length"] >= min_record_length).to_numpy()
+        return StationCatalogue(self.table[selected])
+
+
+def _chord_to_km(chord):
+    """the distance on the earth of a chord length on the unit sphere"""
+    return 2 * np.arcsin(np.minimum(chord / 2, 1)) * slr.grid.EARTH_RADIUS_KM
+
+
+def record_lengths(dataset_name, stations=None):
+    """the number of years with data per station, from the parsed (cached) psmsl table"""
+    table = slr.psmsl.get_psmsl_table(dataset_name, stations=stations)
+    n_values = table["height"].notna().groupby(table["station"]).sum()
+    if "monthly" in dataset_name:
+        n_values = n_values / 12
+    return n_values.rename("record_length")
+
+
+def build_station_table(zf, dataset_name, local=True, main_stations=None):
+    """the station list of an archive joined with the main station metadata"""
+    stations = slr.psmsl.get_station_list(zf, dataset_name=dataset_name, local=local)
+    if main_stations is None:
+        main_stations = slr.psmsl.get_main_stations()
+    # the psmsl name is kept, the name of the main stations is in name_main
+    return stations.join(main_stations, rsuffix="_main")
+
+
+def get_station_catalogue(dataset_name="rlr_annual", with_record_length=True):
+    """Get the catalogue of the stations in a local psmsl archive.
+
+    The catalogue is kept in memory and rebuilt when the archive changes,
+    with_record_length adds the record length of each station (see record_lengths).
+    """
+    zip_path = slr.psmsl.get_psmsl_urls(local=True)[dataset_name]
+    fingerprint = slr.cache.file_fingerprint(zip_path)
+    key = slr.cache.cache_key(dataset_name, fingerprint["sha256"], with_record_length)
+    if key not in _catalogues:
+        with slr.archive.MappedArchive(zip_path) as zf:
+            table = build_station_table(zf, dataset_name)
+        if with_record_length:
+            lengths = record_lengths(dataset_name)
+            table["record_length"] = lengths.reindex(table.index, fill_value=0)
+        _catalogues[key] = StationCatalogue(table)
+    return _catalogues[key]
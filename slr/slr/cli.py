@@ -1,15 +1,468 @@
-"""Console script for slr."""
+"""Console script for slr, the steps of the sea level monitor without the notebooks."""
+import functools
+import statistics
 import sys
+import time
+
 import click
+import numpy as np
+import pandas as pd
+
+import slr
+import slr.archive
+import slr.catalogue
+import slr.gtsm
+import slr.models
+import slr.psmsl
+import slr.regions
+import slr.update
+import slr.wind
+
+# the model families that can be fitted, design functions with a with_wind option
+MODELS = {
+    "linear": slr.models.linear_design,
+    "broken_linear": slr.models.broken_linear_design,
+    "quadratic": slr.models.quadratic_design,
+    "broken_quadratic": slr.models.broken_quadratic_design,
+}
+FORMATS = ["csv", "parquet", "json"]
+DATASET_NAMES = ["rlr_annual", "rlr_monthly", "met_monthly"]
+
+
+def select_stations(
+    dataset_name="rlr_annual",
+    stations=(),
+    regions=True,
+    wind_product="NCEP1",
+    gtsm_version="2022",
+    jobs=1,
+):
+    """Get the stations with their series (see slr.psmsl.add_series_to_stations).
+
+    The main stations by default. Other stations have heights relative to RLR and the
+    surge of the nearest gtsm output point. With regions, the regions of regions.json
+    that have all their stations selected are added (see add_aggregated_stations).
+    """
+    main_stations = slr.psmsl.get_main_stations()
+    zipfiles = slr.psmsl.get_zipfiles(dataset_names=[dataset_name])
+    with zipfiles[dataset_name] as zf:
+        station_list = slr.psmsl.get_station_list(zf, dataset_name=dataset_name)
+    ids = list(stations) or list(main_stations.index)
+    missing = sorted(set(ids) - set(station_list.index))
+    if missing:
+        raise click.BadParameter(
+            f"stations {missing} not in {dataset_name}", param_hint="--station"
+        )
+
+    selected = pd.merge(
+        main_stations,
+        station_list,
+        how="right",
+        left_index=True,
+        right_index=True,
+        suffixes=["_rws", "_psmsl"],
+    ).loc[ids]
+    selected["name"] = selected["name_rws"].fillna(selected["name_psmsl"])
+    selected["nap-rlr"] = selected["nap-rlr"].fillna(0)
+    gtsm_points = None
+    if selected["ddl_id"].isna().any():
+        # only the stations without a ddl_id use the gtsm netcdf output
+        gtsm_points = selected.loc[selected["ddl_id"].isna(), ["lat", "lon"]]
+    selected = slr.psmsl.add_series_to_stations(
+        selected,
+        wind_product=wind_product,
+        gtsm_version=gtsm_version,
+        jobs=jobs,
+        gtsm_points=gtsm_points,
+    )
+    if regions:
+        complete = []
+        for region in slr.regions.load_regions():
+            # the members only, the weights are computed by add_aggregated_stations
+            members = slr.regions.region_members(
+                [{**region, "weights": None}], selected
+            )
+            stations = set(members["station"])
+            if stations and stations <= set(selected.index):
+                complete.append(region)
+        if complete:
+            selected = slr.psmsl.add_aggregated_stations(selected, regions=complete)
+    return selected
+
+
+def fit_stations(
+    selected,
+    dataset_name="rlr_annual",
+    models=("linear",),
+    with_wind=True,
+    with_ar=True,
+    quantity="height",
+    start_year=1890,
+):
+    """fit the model families to the series of the selected stations in one batch"""
+    dfs = {}
+    for station, df in selected[dataset_name].items():
+        dfs[station] = df[df["year"] >= start_year]
+    designs = {
+        model: functools.partial(MODELS[model], with_wind=with_wind) for model in models
+    }
+    results = slr.models.fit_models(dfs, designs, with_ar=with_ar, quantity=quantity)
+    return dfs, results
+
+
+def fits_frame(results):
+    """the estimates and standard errors of all terms of all fits, one row per term"""
+    rows = []
+    for i, label in enumerate(results.index):
+        names = results.names[label]
+        for k, name in enumerate(names):
+            rows.append(
+                (
+                    *label,
+                    name,
+                    names.keys[k],
+                    results.params.iat[i, k],
+                    results.bse.iat[i, k],
+                )
+            )
+    columns = [*results.index.names, "term", "key", "estimate", "se"]
+    terms = pd.DataFrame(rows, columns=columns)
+    stats = results.stats.reset_index()
+    return terms.merge(stats, on=list(results.index.names), how="left")
+
+
+def series_frame(dfs, results):
+    """the series of the stations with the fitted values and components of each model"""
+    frames = []
+    decomposition = results.decomposition
+    for station, df in dfs.items():
+        df = df.reset_index()
+        for model in results.index.unique("variant"):
+            i = results.index.get_loc((station, model))
+            keys = set(results.names[station, model].keys)
+            fitted = np.zeros(len(df))
+            for component, component_keys in slr.models.COMPONENTS.items():
+                values = decomposition[component][i, : len(df)]
+                fitted += values
+                if keys & set(component_keys):
+                    df[f"{component}_{model}"] = values
+            df[f"predicted_{model}"] = fitted
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_table(df, output, fmt=None):
+    """write a table as csv, parquet or json (the format of the suffix by default)"""
+    if fmt is None:
+        suffix = output.rsplit(".", 1)[-1].lower() if "." in output else "csv"
+        fmt = suffix if suffix in FORMATS else "csv"
+    if output == "-":
+        if fmt == "parquet":
+            raise click.UsageError("parquet can not be written to stdout")
+        output = sys.stdout
+    if fmt == "csv":
+        df.to_csv(output, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(output, index=False)
+    else:
+        df.to_json(output, orient="records", date_format="iso")
+
+
+def selection_options(function):
+    """the options to select the stations and their series"""
+    options = [
+        click.option(
+            "--dataset",
+            "dataset_name",
+            type=click.Choice(DATASET_NAMES),
+            default="rlr_annual",
+            show_default=True,
+        ),
+        click.option(
+            "--station",
+            "stations",
+            type=int,
+            multiple=True,
+            help="psmsl id, can be repeated, the main stations by default",
+        ),
+        click.option(
+            "--regions/--no-regions",
+            default=True,
+            show_default=True,
+            help="add the regions (regions.json) of the selected stations",
+        ),
+        click.option("--wind-product", default="NCEP1", show_default=True),
+        click.option(
+            "--gtsm-version",
+            type=click.Choice(list(slr.gtsm.GTSM_VERSIONS)),
+            default="2022",
+            show_default=True,
+        ),
+        click.option(
+            "--jobs",
+            type=int,
+            default=1,
+            show_default=True,
+            help=(
+                "workers to parse the station files that are not cached yet, "
+                "0 for all cores (the models are fitted in one batch)"
+            ),
+        ),
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def model_options(function):
+    """the options of the models to fit"""
+    options = [
+        click.option(
+            "--model",
+            "models",
+            type=click.Choice(list(MODELS)),
+            multiple=True,
+            help="model family, can be repeated, all families by default",
+        ),
+        click.option("--with-wind/--without-wind", default=True, show_default=True),
+        click.option("--with-ar/--without-ar", default=True, show_default=True),
+        click.option("--quantity", default="height", show_default=True),
+        click.option("--start-year", type=int, default=1890, show_default=True),
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def output_options(function):
+    """the output file and its format"""
+    function = click.option(
+        "--format",
+        "fmt",
+        type=click.Choice(FORMATS),
+        help="the format of the output, from its suffix by default",
+    )(function)
+    function = click.option(
+        "-o", "--output", default="-", show_default=True, help="- for stdout"
+    )(function)
+    return function
+
+
+def _fit(
+    dataset_name,
+    stations,
+    regions,
+    wind_product,
+    gtsm_version,
+    jobs,
+    models,
+    with_wind,
+    with_ar,
+    quantity,
+    start_year,
+):
+    """select the stations and fit the models.
+    jobs (0 for all cores) only applies to parsing the archives, see select_stations"""
+    selected = select_stations(
+        dataset_name=dataset_name,
+        stations=stations,
+        regions=regions,
+        wind_product=wind_product,
+        gtsm_version=gtsm_version,
+        jobs=jobs or None,
+    )
+    return fit_stations(
+        selected,
+        dataset_name=dataset_name,
+        models=models or list(MODELS),
+        with_wind=with_wind,
+        with_ar=with_ar,
+        quantity=quantity,
+        start_year=start_year,
+    )
+
+
+@click.group()
+def main():
+    """Sea level rise along the coast from tide gauges, wind and surge."""
+
+
+@main.command()
+@click.option(
+    "--source",
+    "sources",
+    type=click.Choice(["psmsl", "gtsm", "reanalysis"]),
+    multiple=True,
+    help="can be repeated, all sources by default",
+)
+@click.option(
+    "--dataset",
+    "dataset_names",
+    type=click.Choice(DATASET_NAMES),
+    multiple=True,
+    help="psmsl dataset, can be repeated, all datasets by default",
+)
+@click.option(
+    "--product",
+    "products",
+    multiple=True,
+    default=["NCEP1", "20CR"],
+    show_default=True,
+    help="reanalysis product, can be repeated",
+)
+@click.option("--jobs", type=int, default=1, show_default=True)
+def fetch(sources, dataset_names, products, jobs):
+    """Download the datasets that changed since the last fetch.
+
+    The psmsl archives are updated incrementally (see slr.update), reanalysis products
+    are downloaded to their files in data. The gtsm output is part of the repository, it
+    is only loaded.
+    """
+    sources = sources or ["psmsl", "gtsm", "reanalysis"]
+    if "psmsl" in sources:
+        summary = slr.update.update_psmsl(
+            list(dataset_names) or None, jobs=jobs or None
+        )
+        for dataset_name, result in summary.items():
+            click.echo(
+                f"psmsl {dataset_name}: {result['status']}, "
+                f"{len(result['changed'])} changed, {len(result['removed'])} removed"
+            )
+    if "gtsm" in sources:
+        for version in slr.gtsm.GTSM_VERSIONS:
+            store = slr.gtsm.get_gtsm_store(version=version)
+            click.echo(f"gtsm {version}: {len(store.ddl_ids)} stations")
+    if "reanalysis" in sources:
+        src_dir = slr.get_src_dir()
+        for product in products:
+            spec = slr.wind.get_reanalysis_spec(product)
+            if not spec["downloads"]:
+                click.echo(f"reanalysis {product}: no downloads, see its documentation")
+                continue
+            for component, url in spec["downloads"].items():
+                path = src_dir / spec["files"][component]
+                path.parent.mkdir(parents=True, exist_ok=True)
+                status = slr.update.download_archive(url, path)
+                click.echo(f"reanalysis {product} {component}: {status}")
+
+
+@main.command("build-cache")
+@click.option(
+    "--dataset",
+    "dataset_names",
+    type=click.Choice(DATASET_NAMES),
+    multiple=True,
+    help="psmsl dataset, can be repeated, all datasets by default",
+)
+@click.option("--wind/--no-wind", default=True, show_default=True)
+@click.option("--jobs", type=int, default=1, show_default=True)
+def build_cache(dataset_names, wind, jobs):
+    """Parse the local datasets into the cache, so later steps start fast."""
+    for dataset_name in dataset_names or DATASET_NAMES:
+        start = time.perf_counter()
+        table = slr.psmsl.get_psmsl_table(dataset_name, jobs=jobs or None)
+        click.echo(
+            f"psmsl {dataset_name}: {table['station'].nunique()} stations "
+            f"({time.perf_counter() - start:.1f}s)"
+        )
+    catalogue = slr.catalogue.get_station_catalogue()
+    click.echo(f"catalogue: {len(catalogue)} stations")
+    for version in slr.gtsm.GTSM_VERSIONS:
+        store = slr.gtsm.get_gtsm_store(version=version)
+        click.echo(f"gtsm {version}: {len(store.ddl_ids)} stations")
+    if wind:
+        start = time.perf_counter()
+        monthly_wind_products, _ = slr.wind.get_wind_products()
+        click.echo(
+            f"wind: {', '.join(monthly_wind_products)} "
+            f"({time.perf_counter() - start:.1f}s)"
+        )
+
+
+@main.command()
+@selection_options
+@model_options
+@output_options
+def fit(output, fmt, **options):
+    """Fit model families to the selected stations and regions.
+
+    Writes the estimate and standard error of each term with the statistics of the fit
+    (aic, rho, ...), one row per station, model and term.
+    """
+    _, results = _fit(**options)
+    write_table(fits_frame(results), output, fmt)
+
+
+@main.command()
+@selection_options
+@model_options
+@output_options
+def export(output, fmt, **options):
+    """Export the series of the selected stations for the dashboard.
+
+    The series (height, wind, surge, ...) with the fitted values (predicted_<model>) and
+    the components of each model (trend_<model>, nodal_<model>, ...), one row per
+    station and time.
+    """
+    dfs, results = _fit(**options)
+    write_table(series_frame(dfs, results), output, fmt)
+
+
+@main.command()
+@click.option(
+    "--dataset",
+    "dataset_name",
+    type=click.Choice(DATASET_NAMES),
+    default="rlr_annual",
+    show_default=True,
+)
+@click.option("--repeat", type=int, default=3, show_default=True)
+@click.option("--jobs", type=int, default=1, show_default=True)
+@click.option(
+    "--fit/--no-fit",
+    "with_fit",
+    default=True,
+    show_default=True,
+    help="also time loading and fitting the main stations",
+)
+def bench(dataset_name, repeat, jobs, with_fit):
+    """Time the steps of the pipeline, the best and median of repeat runs."""
+    zip_path = slr.psmsl.get_psmsl_urls(local=True)[dataset_name]
+
+    def parse_archive():
+        with slr.archive.MappedArchive(zip_path) as zf:
+            slr.psmsl.read_archive_table(zf, dataset_name, jobs=jobs or None)
+
+    def fit_all():
+        _fit(
+            dataset_name,
+            stations=(),
+            regions=True,
+            wind_product="NCEP1",
+            gtsm_version="2022",
+            jobs=jobs,
+            models=list(MODELS),
+            with_wind=True,
+            with_ar=True,
+            quantity="height",
+            start_year=1890,
+        )
 
+    steps = {
+        "parse archive": parse_archive,
+        "read cached table": lambda: slr.psmsl.get_psmsl_table(dataset_name),
+    }
+    if with_fit:
+        steps["select and fit"] = fit_all
 
-@click.command()
-def main(args=None):
-    """Console script for slr."""
-    click.echo("Replace this message by putting your code into "
-               "slr.cli.main")
-    click.echo("See click documentation at https://click.palletsprojects.com/")
-    return 0
+    for step, function in steps.items():
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        best, median = min(durations), statistics.median(durations)
+        click.echo(f"{step:20s} best {best:8.3f}s median {median:8.3f}s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+"""Spatial index of model grids, to look up the nearest grid points of many locations at once."""
+import hashlib
+import math
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import scipy.spatial
+
+EARTH_RADIUS_KM = 6371.0
+
+# grid indices by the hash of their coordinates, a grid is indexed once per process
+_grid_indices = {}
+
+
+def lonlat_to_xyz(lon, lat):
+    """convert longitudes and latitudes in degrees to points on the unit sphere"""
+    lon = np.deg2rad(np.asarray(lon, dtype="float64"))
+    lat = np.deg2rad(np.asarray(lat, dtype="float64"))
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    )
+
+
+class GridIndex:
+    """KD-tree of the points of a grid on the unit sphere.
+
+    lat and lon are the 1d coordinates of a regular grid (shape (lat, lon)) or, with
+    regular=False, arrays of the same shape (a curvilinear grid or a list of points).
+    Distances on the sphere take the longitude wrap-around and the poles into account.
+    """
+
+    def __init__(self, lat, lon, regular=True):
+        lat = np.ma.filled(np.ma.asarray(lat, dtype="float64"), np.nan)
+        lon = np.ma.filled(np.ma.asarray(lon, dtype="float64"), np.nan)
+        if regular:
+            lon, lat = np.meshgrid(lon, lat)
+        if lat.shape != lon.shape:
+            raise ValueError(
+                f"lat and lon should have the same shape: {lat.shape}, {lon.shape}"
+            )
+        self.lat = lat
+        self.lon = lon
+        self.shape = lat.shape
+        self.tree = scipy.spatial.cKDTree(lonlat_to_xyz(lon.ravel(), lat.ravel()))
+
+    def query(self, lat, lon):
+        """Find the nearest grid points of the locations lat, lon.
+
+        Returns a tuple of index arrays (one per grid dimension) and the distance in km.
+        """
+        xyz = lonlat_to_xyz(np.atleast_1d(lon), np.atleast_1d(lat))
+        chord, flat_index = self.tree.query(xyz)
+        indices = np.unravel_index(flat_index, self.shape)
+        distance = 2 * np.arcsin(np.minimum(chord / 2, 1)) * EARTH_RADIUS_KM
+        return indices, distance
+
+
+def get_grid_index(lat, lon, regular=True):
+    """get the (cached) index of the grid with coordinates lat, lon"""
+    lat = np.ma.filled(np.ma.asarray(lat, dtype="float64"), np.nan)
+    lon = np.ma.filled(np.ma.asarray(lon, dtype="float64"), np.nan)
+    key = hashlib.sha256(
+        b"".join([lat.tobytes(), lon.tobytes(), str((lat.shape, regular)).encode()])
+    ).hexdigest()
+    if key not in _grid_indices:
+        _grid_indices[key] = GridIndex(lat, lon, regular=regular)
+    return _grid_indices[key]
+
+
+def _point_groups(indices, max_ratio=4):
+    """Groups of points that are read as one orthogonal hyperslab.
+
+    Returns (positions of the points, unique indices per dimension, position of each point in
+    them) per group. All points are one group if the hyperslab of their unique rows and columns
+    is at most max_ratio times the number of points, otherwise each row is a group, so that
+    scattered points do not read (almost) the whole grid.
+    """
+    n_points = len(indices[0])
+    uniques, inverses = zip(
+        *(np.unique(index, return_inverse=True) for index in indices)
+    )
+    if math.prod(len(unique) for unique in uniques) <= max_ratio * n_points:
+        return [(np.arange(n_points), uniques, inverses)]
+    groups = []
+    for row in range(len(uniques[0])):
+        positions = np.flatnonzero(inverses[0] == row)
+        others = [
+            np.unique(index[positions], return_inverse=True) for index in indices[1:]
+        ]
+        group_uniques = [uniques[0][row : row + 1]] + [unique for unique, _ in others]
+        group_inverses = [np.zeros(len(positions), dtype=int)] + [
+            inverse for _, inverse in others
+        ]
+        groups.append((positions, tuple(group_uniques), tuple(group_inverses)))
+    return groups
+
+
+def read_points(variable, indices, time_chunk=600, start=0, stop=None, time_axis=0):
+    """Read the time series of many grid points of a (time, lat, lon) variable.
+
+    indices is a tuple of (lat, lon) index arrays, for example from GridIndex.query, or of
+    one index array for a variable of (time, stations).
+    The points are read in chunks of time_chunk time steps. Per chunk only the rows and
+    columns that contain points are read (one orthogonal hyperslab), or, for points that are
+    scattered over the grid, the points of each row, so memory depends on the chunk size and
+    the number of points, not on the size of the grid.
+    start and stop select a range of time steps. time_axis is the position of the time
+    dimension, for example 1 for a variable of (stations, time).
+    Returns an array of shape (time, points), missing values are nan.
+    """
+    indices = [np.atleast_1d(index) for index in indices]
+    groups = _point_groups(indices)
+    n_points = len(indices[0])
+    if stop is None:
+        stop = variable.shape[time_axis]
+
+    result = None
+    for chunk_start in range(start, stop, time_chunk):
+        chunk_stop = min(chunk_start + time_chunk, stop)
+        rows = slice(chunk_start - start, chunk_stop - start)
+        for positions, uniques, inverses in groups:
+            key = list(uniques)
+            key.insert(time_axis, slice(chunk_start, chunk_stop))
+            block = np.moveaxis(np.ma.asarray(variable[tuple(key)]), time_axis, 0)
+            if result is None:
+                dtype = np.result_type(block.dtype, np.float32)
+                result = np.empty((stop - start, n_points), dtype=dtype)
+            result[rows, positions] = np.ma.filled(block.astype(dtype), np.nan)[
+                (slice(None), *inverses)
+            ]
+    if result is None:
+        result = np.empty((0, n_points))
+    return result
+
+
+def read_times(time, units=None, calendar=None):
+    """read a netcdf time variable as datetimes, units and calendar override the attributes"""
+    # convert to datetime
+    # Now defaults to return cftime dates https://github.com/Unidata/cftime/issues/136
+    # cftime dates are not recognized by pandas
+    # in cftime < 1.2.1 there is a bug that this flag doesn't not function properly
+    t = netCDF4.num2date(
+        time[:],
+        units or time.units,
+        calendar=calendar or getattr(time, "calendar", "standard"),
+        only_use_cftime_datetimes=False,
+    )
+    return pd.DatetimeIndex(t, name="t")
+
+
+def monthly_means(t, values, sums, counts):
+    """add values (time, points) to the monthly sums and counts (dicts by month)"""
+    months = t.to_numpy().astype("datetime64[M]")
+    unique_months, month_index = np.unique(months, return_inverse=True)
+    valid = ~np.isnan(values)
+    month_sums = np.zeros((len(unique_months), values.shape[1]))
+    month_counts = np.zeros((len(unique_months), values.shape[1]))
+    np.add.at(month_sums, month_index, np.where(valid, values, 0))
+    np.add.at(month_counts, month_index, valid)
+    for month, month_sum, month_count in zip(unique_months, month_sums, month_counts):
+        sums[month] = sums.get(month, 0) + month_sum
+        counts[month] = counts.get(month, 0) + month_count
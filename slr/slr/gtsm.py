@@ -0,0 +1,325 @@
+"""Surge estimates of the Global Tide and Surge Model (GTSM) at the tide gauge stations."""
+import os
+
+import netCDF4
+import numpy as np
+import pandas as pd
+
+import slr
+import slr.cache
+import slr.grid
+import slr.utils
+
+# the csv files per version, start drops the years before it
+GTSM_VERSIONS = {
+    "2022": {
+        "annual": "gtsm_surge_annual_mean_main_stations.csv",
+        "monthly": "gtsm_surge_monthly_mean_main_stations.csv",
+        "start": None,
+    },
+    # temporary fix to compare two datasets
+    "2023": {
+        "annual": "gtsm_surge_annual_mean_main_stations_2023.csv",
+        "monthly": "gtsm_surge_monthly_mean_main_stations_2023.csv",
+        # drop data from 1950, due to unexplainable high surge
+        "start": "1951-01-01",
+    },
+}
+FREQUENCIES = ["monthly", "annual"]
+
+# the gtsm reanalysis output (timeseries at output stations or a grid), files relative to the
+# source dir, lat and lon are the coordinate variables of the stations (or grid cells)
+GTSM_NETCDF = {
+    "files": "data/deltares/gtsm/netcdf/*surge*.nc",
+    "variable": "surge",
+    "time": "time",
+    "lat": "station_y_coordinate",
+    "lon": "station_x_coordinate",
+    "name": "station_id",
+}
+
+# stores by cache key, the csv files are parsed once per process
+_gtsm_stores = {}
+
+
+def get_gtsm_dir():
+    return slr.get_src_dir() / "data" / "deltares" / "gtsm"
+
+
+def read_gtsm_csv(path, frequency, start=None):
+    """parse a gtsm csv file (surge in m), adds the year and the surge in mm"""
+    # t is parsed as one column, not per cell
+    df = pd.read_csv(path, index_col=0, parse_dates=["t"])
+    df = df.reset_index(drop=True)
+    if frequency == "annual":
+        df["year"] = df["t"].dt.year
+    else:
+        # compute year fraction
+        df["year"] = slr.utils.date2year(df["t"])
+    # add unit suffix (m -> mm * 1000)
+    df["surge_mm"] = df["surge"] * 1000
+    if start is not None:
+        df = df[df["t"] >= pd.Timestamp(start)]
+    return df
+
+
+class GtsmStore:
+    """The monthly and annual surge of a set of stations.
+
+    The tables are indexed by (ddl_id, t) and sorted, the rows of a station are one block,
+    so station returns the series of a station as a slice of the table (no search or copy).
+    The ddl_id and t are also kept as columns.
+    """
+
+    def __init__(self, monthly, annual):
+        self.tables = {}
+        self.slices = {}
+        for frequency, df in [("monthly", monthly), ("annual", annual)]:
+            df = df.sort_values(["ddl_id", "t"], kind="stable")
+            df = df.set_index(["ddl_id", "t"], drop=False)
+            self.tables[frequency] = df
+            self.slices[frequency] = slr.utils.group_slices(df.index, "ddl_id")
+
+    @property
+    def monthly(self):
+        return self.tables["monthly"]
+
+    @property
+    def annual(self):
+        return self.tables["annual"]
+
+    @property
+    def ddl_ids(self):
+        return list(self.slices["annual"])
+
+    def __contains__(self, ddl_id):
+        return ddl_id in self.slices["annual"]
+
+    def station(self, ddl_id, frequency="monthly"):
+        """the surge of one station, indexed by t"""
+        df = self.tables[frequency].iloc[self.slices[frequency][ddl_id]]
+        # replace the index instead of droplevel, which copies the data
+        df.index = df.index.droplevel("ddl_id")
+        return df
+
+    def frames(self, with_m=False):
+        """return copies of the monthly and annual tables, in the format of get_gtsm_dfs"""
+        frames = []
+        for frequency in FREQUENCIES:
+            df = self.tables[frequency].reset_index(drop=True)
+            # explicit use mm
+            if not with_m:
+                df = df.drop(columns=["surge"])
+            frames.append(df)
+        return tuple(frames)
+
+
+def get_gtsm_store(version="2022", use_cache=True, cache_dir=None):
+    """get the gtsm surge of the main stations.
+    The parsed csv files are kept in memory and cached as parquet, keyed by their checksum."""
+    spec = GTSM_VERSIONS[version]
+    paths = {frequency: get_gtsm_dir() / spec[frequency] for frequency in FREQUENCIES}
+    if not use_cache:
+        return GtsmStore(
+            *(
+                read_gtsm_csv(paths[frequency], frequency, start=spec["start"])
+                for frequency in FREQUENCIES
+            )
+        )
+
+    checksums = [
+        slr.cache.file_fingerprint(paths[frequency], cache_dir=cache_dir)["sha256"]
+        for frequency in FREQUENCIES
+    ]
+    key = slr.cache.cache_key(version, spec["start"], checksums)
+    if key not in _gtsm_stores:
+        tables = []
+        for frequency in FREQUENCIES:
+            path = slr.cache.cache_path(
+                "gtsm", f"{version}-{frequency}", key, cache_dir=cache_dir
+            )
+            if path.exists():
+                df = pd.read_parquet(path)
+            else:
+                df = read_gtsm_csv(paths[frequency], frequency, start=spec["start"])
+                slr.cache.write_atomic(path, df.to_parquet(index=False))
+            tables.append(df)
+        _gtsm_stores[key] = GtsmStore(*tables)
+    return _gtsm_stores[key]
+
+
+def get_gtsm_dfs(with_m=False, version="2022"):
+    """get the monthly and annual gtsm surge estimates per station, sorted by ddl_id and t"""
+    return get_gtsm_store(version=version).frames(with_m=with_m)
+
+
+def get_gtsm_netcdf_files(files=None):
+    """get the sorted list of gtsm netcdf files, files is a glob pattern relative to the source dir"""
+    files = files or GTSM_NETCDF["files"]
+    return sorted(slr.get_src_dir().glob(files))
+
+
+def _read_names(variable, index):
+    """read the names (char arrays or strings) of the stations at index"""
+    unique, inverse = np.unique(index, return_inverse=True)
+    names = variable[unique]
+    if variable.dtype == "S1":
+        names = netCDF4.chartostring(names)
+    names = [
+        name.decode().strip() if isinstance(name, bytes) else str(name).strip()
+        for name in names
+    ]
+    return np.array(names, dtype=object)[inverse]
+
+
+def find_gtsm_points(points, path, spec=GTSM_NETCDF):
+    """Find the nearest gtsm output point of each point (lat and lon columns) in a netcdf file.
+
+    Works for files with output stations (lat and lon per station) and for grids.
+    Returns a copy of points with the index (a tuple), the name, lat and lon of the gtsm point
+    and the distance in km.
+    """
+    with netCDF4.Dataset(path) as ds:
+        lat_var, lon_var = ds.variables[spec["lat"]], ds.variables[spec["lon"]]
+        # a grid has separate lat and lon dimensions, stations share one
+        regular = lat_var.dimensions != lon_var.dimensions
+        lat, lon = lat_var[:], lon_var[:]
+        index = slr.grid.get_grid_index(lat, lon, regular=regular)
+        indices, distance = index.query(points["lat"], points["lon"])
+        names = None
+        if not regular and spec.get("name") in ds.variables:
+            names = _read_names(ds.variables[spec["name"]], indices[0])
+
+    result = points[["lat", "lon"]].copy()
+    result["gtsm_index"] = list(zip(*indices))
+    result["gtsm_name"] = names if names is not None else ""
+    result["gtsm_lat"] = index.lat[indices]
+    result["gtsm_lon"] = index.lon[indices]
+    result["distance_km"] = distance
+    return result
+
+
+def read_gtsm_points(points, files=None, spec=GTSM_NETCDF, time_chunk=6 * 24 * 31):
+    """Read the monthly and annual mean surge at the gtsm points nearest to points.
+
+    points is a frame with lat and lon, indexed by station.
+    The files are read one by one, in chunks of time_chunk time steps (a month of 10 minute
+    output by default), and reduced to monthly sums on the fly, so memory depends on the
+    chunk size and the number of months times the number of points, not on the length of the
+    series or the number of output points in the files. The series can be stored as
+    (time, stations), as (stations, time) (his files) or as (time, lat, lon), the time axis
+    is found by name. Annual means are the mean of all time steps of a year.
+    Returns the monthly and annual frames in the format of a GtsmStore, with the station in
+    the ddl_id (and psmsl_id) column.
+    """
+    files = files if files is not None else get_gtsm_netcdf_files()
+    if not files:
+        raise FileNotFoundError(f"no gtsm netcdf files found: {spec['files']}")
+    # the output points are the same in all files
+    found = find_gtsm_points(points, files[0], spec=spec)
+    indices = tuple(np.array(index) for index in zip(*found["gtsm_index"]))
+
+    sums, counts = {}, {}
+    for path in files:
+        with netCDF4.Dataset(path) as ds:
+            time = ds.variables[spec["time"]]
+            t = slr.grid.read_times(time)
+            variable = ds.variables[spec["variable"]]
+            # his files store the series as (stations, time), other output as (time, ...)
+            time_dimension = time.dimensions[0]
+            if time_dimension not in variable.dimensions:
+                raise ValueError(
+                    f"{spec['variable']} in {path} has no {time_dimension} dimension: "
+                    f"{variable.dimensions}"
+                )
+            time_axis = variable.dimensions.index(time_dimension)
+            for start in range(0, len(t), time_chunk):
+                stop = min(start + time_chunk, len(t))
+                values = slr.grid.read_points(
+                    variable,
+                    indices,
+                    time_chunk=time_chunk,
+                    start=start,
+                    stop=stop,
+                    time_axis=time_axis,
+                )
+                slr.grid.monthly_means(t[start:stop], values, sums, counts)
+
+    months = np.array(sorted(sums))
+    month_sums = np.array([sums[month] for month in months])
+    month_counts = np.array([counts[month] for month in months])
+    years, year_index = np.unique(months.astype("datetime64[Y]"), return_inverse=True)
+    year_sums = np.zeros((len(years), len(found)))
+    year_counts = np.zeros((len(years), len(found)))
+    np.add.at(year_sums, year_index, month_sums)
+    np.add.at(year_counts, year_index, month_counts)
+
+    frames = []
+    for frequency, t, totals, n in [
+        ("monthly", months, month_sums, month_counts),
+        ("annual", years, year_sums, year_counts),
+    ]:
+        with np.errstate(invalid="ignore"):
+            surge = totals / n
+        # long format, per station all times
+        df = pd.DataFrame(
+            {
+                "t": np.tile(t.astype("datetime64[ns]"), len(found)),
+                "name": np.repeat(found["gtsm_name"].to_numpy(), len(t)),
+                "psmsl_id": np.repeat(found.index.to_numpy(), len(t)),
+                "ddl_id": np.repeat(found.index.to_numpy(), len(t)),
+                "latitude": np.repeat(found["gtsm_lat"].to_numpy(), len(t)),
+                "longitude": np.repeat(found["gtsm_lon"].to_numpy(), len(t)),
+                "distance_km": np.repeat(found["distance_km"].to_numpy(), len(t)),
+                "surge": surge.T.ravel(),
+            }
+        )
+        if frequency == "annual":
+            df["year"] = df["t"].dt.year
+        else:
+            # compute year fraction
+            df["year"] = slr.utils.date2year(df["t"])
+        # add unit suffix (m -> mm * 1000)
+        df["surge_mm"] = df["surge"] * 1000
+        frames.append(df)
+    return tuple(frames)
+
+
+def get_gtsm_points_store(points, files=None, use_cache=True, cache_dir=None):
+    """Get the gtsm surge at the nearest gtsm output point of each station in points.
+
+    points is a frame with lat and lon, indexed by station (for example from get_station_list),
+    the store is keyed by station (in the ddl_id column) so any station can be corrected for surge.
+    The monthly and annual means are cached as parquet, keyed by the points and the size and
+    modification time of the netcdf files (these are too large to checksum).
+    """
+    files = files if files is not None else get_gtsm_netcdf_files()
+    points = points[["lat", "lon"]]
+    if not use_cache:
+        return GtsmStore(*read_gtsm_points(points, files=files))
+
+    file_stats = []
+    for path in files:
+        stat = os.stat(path)
+        file_stats.append([str(path), stat.st_size, stat.st_mtime_ns])
+    location = [
+        [str(station), round(lat, 6), round(lon, 6)]
+        for station, lat, lon in points.itertuples()
+    ]
+    location_key = slr.cache.cache_key(location)
+    key = slr.cache.cache_key(GTSM_NETCDF, location, file_stats)
+    if key not in _gtsm_stores:
+        paths = [
+            slr.cache.cache_path(
+                "gtsm", f"netcdf-{frequency}-{location_key}", key, cache_dir=cache_dir
+            )
+            for frequency in FREQUENCIES
+        ]
+        if all(path.exists() for path in paths):
+            tables = [pd.read_parquet(path) for path in paths]
+        else:
+            tables = read_gtsm_points(points, files=files)
+            for path, df in zip(paths, tables):
+                slr.cache.write_atomic(path, df.to_parquet(index=False))
+        _gtsm_stores[key] = GtsmStore(*tables)
+    return _gtsm_stores[key]
@@ -1,52 +1,174 @@
+import re
+import weakref
+import functools
+import collections
+
 import numpy as np
+import pandas as pd
+import scipy.stats
 import statsmodels.api as sm
 
 
+# Terms of the design matrices. Each term has a key per column (used to look up columns in any model),
+# a display name per column (formatted with the epoch of the term) and its columns are either computed
+# from the year and epoch (memoized) or taken from the data.
+TERMS = {
+    "constant": {
+        "keys": ["constant"],
+        "names": ["Constant"],
+        "year": lambda year, epoch: [np.ones_like(year)],
+    },
+    "trend": {
+        "keys": ["trend"],
+        "names": ["Trend"],
+        # 0 in epoch, 30 in epoch + 30
+        "year": lambda year, epoch: [year - epoch],
+    },
+    "acceleration": {
+        "keys": ["acceleration"],
+        "names": ["Acceleration"],
+        # 1 in epoch - 1, 0 in epoch, 1 in epoch + 1, 4 in epoch + 2
+        "year": lambda year, epoch: [(year - epoch) * (year - epoch)],
+    },
+    "broken_acceleration": {
+        "keys": ["acceleration"],
+        "names": ["Acceleration from {epoch}"],
+        # 0 before epoch, 0 in epoch, 1 in epoch + 1, 4 in epoch + 2
+        "year": lambda year, epoch: [(year >= epoch) * (year - epoch) ** 2],
+    },
+    "broken_trend": {
+        "keys": ["broken_trend"],
+        "names": ["+trend ({epoch})"],
+        # 0 before epoch, 0 in epoch, 1 in epoch + 1, 2 in epoch + 2
+        "year": lambda year, epoch: [(year >= epoch) * (year - epoch)],
+    },
+    "nodal": {
+        "keys": ["nodal_u", "nodal_v"],
+        "names": ["Nodal U", "Nodal V"],
+        # 18.613 year nodal cycle, always relative to 1970
+        "year": lambda year, epoch: [
+            np.cos(2 * np.pi * (year - epoch) / 18.613),
+            np.sin(2 * np.pi * (year - epoch) / 18.613),
+        ],
+    },
+    "wind": {
+        "keys": ["wind_u2", "wind_v2"],
+        "names": ["Wind $u^2$", "Wind $v^2$"],
+        "data": ["u2", "v2"],
+    },
+    # the squared wind along and perpendicular to the coastline (see slr.wind.project_coastal)
+    "coastal_wind": {
+        "keys": ["wind_main", "wind_perp"],
+        "names": ["Wind along coast $u^2$", "Wind across coast $u^2$"],
+        "data": ["u2main", "u2perp"],
+    },
+    "surge": {
+        "keys": ["surge"],
+        "names": ["Surge"],
+        "data": ["surge_mm"],
+    },
+}
+
+
+# A term in a design matrix, see TERMS for the kinds. names overrides the display names.
+Term = collections.namedtuple("Term", ["kind", "epoch", "names"], defaults=[1970, None])
+
+
+class TermNames(list):
+    """The display names of the columns of a design matrix (as returned by the models),
+    with the key of the term of each column in keys, for example "nodal_u" for "Nodal U"."""
+
+    def __init__(self, names=(), keys=()):
+        super().__init__(names)
+        self.keys = list(keys)
+
+    @property
+    def columns(self):
+        """the column index of each term key"""
+        return {key: i for i, key in enumerate(self.keys)}
+
+
+@functools.lru_cache(maxsize=256)
+def _year_columns(kind, year_bytes, epoch):
+    """columns of a term that only depend on year and epoch, cached per year vector"""
+    year = np.frombuffer(year_bytes, dtype="float64")
+    columns = np.column_stack(TERMS[kind]["year"](year, epoch))
+    columns.flags.writeable = False
+    return columns
+
+
+def build_design(df, terms):
+    """Build the design matrix for a list of terms, returns the matrix and the TermNames.
+
+    The columns that only depend on year are memoized per (year vector, epoch),
+    all columns are copied once into a preallocated matrix.
+    """
+    year = np.asarray(df["year"], dtype="float64")
+    year_bytes = year.tobytes()
+
+    n_columns = sum(len(TERMS[term.kind]["keys"]) for term in terms)
+    X = np.empty((len(year), n_columns))
+    names = TermNames()
+    i = 0
+    for term in terms:
+        spec = TERMS[term.kind]
+        n = len(spec["keys"])
+        if "data" in spec:
+            for j, column in enumerate(spec["data"]):
+                X[:, i + j] = df[column]
+        else:
+            X[:, i : i + n] = _year_columns(term.kind, year_bytes, term.epoch)
+        term_names = term.names or spec["names"]
+        names.extend(name.format(epoch=term.epoch) for name in term_names)
+        names.keys.extend(spec["keys"])
+        i += n
+    return X, names
+
+
+def quadratic_design(df, with_wind=True, with_nodal=True):
+    """Design matrix (with constant) and names of the quadratic model."""
+
+    epoch = 1970
+    terms = [
+        Term("constant", epoch, names=["Constant (in year {epoch})"]),
+        Term("trend", epoch),
+        # use quadratic term since epoch for comparison with other models.
+        Term("acceleration", epoch),
+    ]
+    if with_nodal:
+        terms.append(Term("nodal"))
+    if with_wind:
+        terms.append(Term("wind"))
+    return build_design(df, terms)
+
+
 def quadratic_model(
     df, with_wind=True, with_ar=True, with_nodal=True, quantity="height"
 ):
     """This model computes a parabolic linear fit. This corresponds to the hypothesis that sea-level is accelerating."""
 
-    y = df[quantity]
+    X, names = quadratic_design(df, with_wind=with_wind, with_nodal=with_nodal)
+    fit = fit_model(df[quantity], X, with_ar=with_ar)
 
-    epoch = 1970
+    return fit, names
 
-    # linear term, 0 in 1970, 30 in 2000
-    linear_term = df["year"] - epoch
 
-    # use quadratic term since epoch for comparison with other models.
-    # 1 in 1969, 0 in 1970, 1 in 1971, 4 in 1972, masked if before start_acc
-    quadratic_term = (df["year"] - epoch) * (df["year"] - epoch)
+def broken_quadratic_design(
+    df, with_wind=True, with_nodal=True, start_acceleration=1960
+):
+    """Design matrix (with constant) and names of the broken quadratic model."""
 
-    # regression terms
-    X = np.c_[linear_term, quadratic_term]
-    names = [
-        f"Constant (in year {epoch})",
-        "Trend",
-        "Acceleration",
+    terms = [
+        Term("constant", start_acceleration, names=["Constant (in year {epoch})"]),
+        Term("trend", start_acceleration),
+        # masked if before start_acceleration
+        Term("broken_acceleration", start_acceleration),
     ]
-
     if with_nodal:
-        nodal_cos_term = np.cos(2 * np.pi * (df["year"] - epoch) / 18.613)
-        nodal_sin_term = np.sin(2 * np.pi * (df["year"] - epoch) / 18.613)
-        X = np.c_[X, nodal_cos_term, nodal_sin_term]
-        names.extend(["Nodal U", "Nodal V"])
-
+        terms.append(Term("nodal"))
     if with_wind:
-        X = np.c_[X, df["u2"], df["v2"]]
-        names.extend(["Wind $u^2$", "Wind $v^2$"])
-
-    # add constant to the start
-    X = sm.add_constant(X)
-
-    if with_ar:
-        model = sm.GLSAR(y, X, missing="drop", rho=1)
-        fit = model.iterative_fit(cov_type="HC0")
-    else:
-        model = sm.OLS(y, X, missing="drop")
-        fit = model.fit(cov_type="HC0")
-
-    return fit, names
+        terms.append(Term("wind"))
+    return build_design(df, terms)
 
 
 def broken_quadratic_model(
@@ -59,47 +181,29 @@ def broken_quadratic_model(
 ):
     """This model computes a parabolic linear fit, starting in year start_accleration. This corresponds to the hypothesis that sea-level is accelerating since start_acceleration."""
 
-    y = df[quantity]
+    X, names = broken_quadratic_design(
+        df,
+        with_wind=with_wind,
+        with_nodal=with_nodal,
+        start_acceleration=start_acceleration,
+    )
+    fit = fit_model(df[quantity], X, with_ar=with_ar)
 
-    # linear term, 0 in 1970, 30 in 2000
-    linear_term = df["year"] - start_acceleration
+    return fit, names
 
-    # use quadratic term since epoch for comparison with other models.
-    # 1 in 1969, 0 in 1970, 1 in 1971, 4 in 1972, masked if before start_acceleration
-    quadratic_term = (df["year"] >= start_acceleration) * (
-        df["year"] - start_acceleration
-    ) ** 2
 
-    # regression terms
-    X = np.c_[linear_term, quadratic_term]
-    names = [
-        f"Constant (in year {start_acceleration})",
-        "Trend",
-        f"Acceleration from {start_acceleration}",
+def broken_linear_design(df, with_wind=True, start_acceleration=1993):
+    """Design matrix (with constant) and names of the broken linear model."""
+    terms = [
+        Term("constant"),
+        Term("trend"),
+        # 1991 -> 0, 1992 -> 0, 1993 -> 0, 1994 -> 1, 1995 -> 2, etc...,
+        Term("broken_trend", start_acceleration),
+        Term("nodal"),
     ]
-
-    if with_nodal:
-        # always relative to 1970
-        nodal_cos_term = np.cos(2 * np.pi * (df["year"] - 1970) / 18.613)
-        nodal_sin_term = np.sin(2 * np.pi * (df["year"] - 1970) / 18.613)
-        X = np.c_[X, nodal_cos_term, nodal_sin_term]
-        names.extend(["Nodal U", "Nodal V"])
-
     if with_wind:
-        X = np.c_[X, df["u2"], df["v2"]]
-        names.extend(["Wind $u^2$", "Wind $v^2$"])
-
-    # add constant to the start
-    X = sm.add_constant(X)
-
-    if with_ar:
-        model = sm.GLSAR(y, X, missing="drop", rho=1)
-        fit = model.iterative_fit(cov_type="HC0")
-    else:
-        model = sm.OLS(y, X, missing="drop")
-        fit = model.fit(cov_type="HC0")
-
-    return fit, names
+        terms.append(Term("wind"))
+    return build_design(df, terms)
 
 
 # define the statistical model
@@ -107,69 +211,625 @@ def broken_linear_model(
     df, with_wind=True, with_ar=True, quantity="height", start_acceleration=1993
 ):
     """This model fits the sea-level rise has started to rise faster in epoch."""
-    y = df[quantity]
-    X = np.c_[
-        df["year"] - 1970,
-        # 1991 -> 0, 1992 -> 0, 1993 -> 0, 1994 -> 1, 1995, 4, etc...,
-        (df["year"] >= 1993) * (df["year"] - 1993),
-        np.cos(2 * np.pi * (df["year"] - 1970) / 18.613),
-        np.sin(2 * np.pi * (df["year"] - 1970) / 18.613),
-    ]
-    names = ["Constant", "Trend", "+trend (1993)", "Nodal U", "Nodal V"]
-    if with_wind:
-        X = np.c_[X, df["u2"], df["v2"]]
-        names.extend(["Wind $u^2$", "Wind $v^2$"])
-    X = sm.add_constant(X)
-    if with_ar:
-        model = sm.GLSAR(y, X, missing="drop", rho=1)
-        fit = model.iterative_fit(cov_type="HC0")
-
-    else:
-        model = sm.OLS(y, X, missing="drop")
-        fit = model.fit(cov_type="HC0")
+    X, names = broken_linear_design(
+        df, with_wind=with_wind, start_acceleration=start_acceleration
+    )
+    fit = fit_model(df[quantity], X, with_ar=with_ar)
 
     return fit, names
 
 
+def linear_design(df, with_wind=True):
+    """Design matrix (with constant) and names of the linear model."""
+    terms = [Term("constant"), Term("trend"), Term("nodal")]
+    if with_wind:
+        terms.append(Term("wind"))
+    return build_design(df, terms)
+
+
 def linear_model(df, with_wind=True, with_ar=True, quantity="height"):
     """Define the linear model with optional wind and autoregression.
     See the latest report for a detailed description.
     """
 
-    y = df[quantity]
-    X = np.c_[
-        df["year"] - 1970,
-        np.cos(2 * np.pi * (df["year"] - 1970) / 18.613),
-        np.sin(2 * np.pi * (df["year"] - 1970) / 18.613),
-    ]
-    names = ["Constant", "Trend", "Nodal U", "Nodal V"]
-    if with_wind:
-        X = np.c_[X, df["u2"], df["v2"]]
-        names.extend(["Wind $u^2$", "Wind $v^2$"])
-    X = sm.add_constant(X)
+    X, names = linear_design(df, with_wind=with_wind)
+    fit = fit_model(df[quantity], X, with_ar=with_ar)
+    return fit, names
+
+
+def fit_model(y, X, with_ar=True):
+    """Fit a model with HC0 covariance, with autoregression (AR(1), GLSAR) or without (OLS)."""
     if with_ar:
         model = sm.GLSAR(y, X, missing="drop", rho=1)
         fit = model.iterative_fit(cov_type="HC0")
     else:
         model = sm.OLS(y, X, missing="drop")
         fit = model.fit(cov_type="HC0")
-    return fit, names
+    return fit
 
 
-def tide_effect(fit, names):
+# Prediction variants of a fit, with the columns that are replaced by their mean (or a value).
+# Variants are only computed if the fit has all the replaced columns.
+PREDICTION_VARIANTS = {
+    "prediction": {},
+    "prediction_mean_tide": {"Nodal U": "mean", "Nodal V": "mean"},
+    "prediction_mean_wind": {"Wind $u^2$": "mean", "Wind $v^2$": "mean"},
+    # set both wind and tide to mean/0
+    "prediction_mean_tide_mean_wind": {
+        "Nodal U": 0,
+        "Nodal V": 0,
+        "Wind $u^2$": "mean",
+        "Wind $v^2$": "mean",
+    },
+}
+
+
+class Prediction:
+    """Predicted mean and variances of a fit, a compact version of statsmodels PredictionResults.
+
+    Supports predicted_mean, se_mean, se_obs, conf_int and summary_frame.
+    """
+
+    def __init__(self, predicted_mean, var_pred_mean, var_resid, dist="norm", df=None):
+        self.predicted_mean = predicted_mean
+        self.var_pred_mean = var_pred_mean
+        self.var_resid = var_resid
+        self.dist = dist
+        self.df = df
+
+    @property
+    def se_mean(self):
+        return np.sqrt(self.var_pred_mean)
+
+    @property
+    def se_obs(self):
+        return np.sqrt(self.var_pred_mean + self.var_resid)
+
+    def conf_int(self, obs=False, alpha=0.05):
+        """confidence interval (obs=False) or prediction interval (obs=True), shape (n, 2)"""
+        se = self.se_obs if obs else self.se_mean
+        if self.dist == "t":
+            q = scipy.stats.t.ppf(1 - alpha / 2.0, self.df)
+        else:
+            q = scipy.stats.norm.ppf(1 - alpha / 2.0)
+        lower = self.predicted_mean - q * se
+        upper = self.predicted_mean + q * se
+        return np.column_stack((lower, upper))
+
+    def summary_frame(self, alpha=0.05):
+        ci_mean = self.conf_int(obs=False, alpha=alpha)
+        ci_obs = self.conf_int(obs=True, alpha=alpha)
+        return pd.DataFrame(
+            {
+                "mean": self.predicted_mean,
+                "mean_se": self.se_mean,
+                "mean_ci_lower": ci_mean[:, 0],
+                "mean_ci_upper": ci_mean[:, 1],
+                "obs_ci_lower": ci_obs[:, 0],
+                "obs_ci_upper": ci_obs[:, 1],
+            }
+        )
+
+
+def predict_variants(fit, names, variants=PREDICTION_VARIANTS):
+    """Compute the prediction variants of an OLS or GLSAR fit in one pass.
+
+    This gives the same results as fit.get_prediction(exog=...) with the replaced columns,
+    using the parameter covariance of the fit. Returns a dict of Prediction by variant name.
+    """
+    # the unwrapped results, to avoid creating pandas objects for params and covariance
+    results = getattr(fit, "_results", fit)
+    exog = np.asarray(results.model.exog)
+    params = np.asarray(results.params)
+    cov_params = np.asarray(results.cov_params())
+
+    variant_names = [
+        name
+        for name, replace in variants.items()
+        if all(column in names for column in replace)
+    ]
+    exogs = np.repeat(exog[np.newaxis], len(variant_names), axis=0)
+    for i, name in enumerate(variant_names):
+        for column, value in variants[name].items():
+            j = names.index(column)
+            exogs[i, :, j] = exog[:, j].mean() if value == "mean" else value
+
+    predicted_means = exogs @ params
+    var_pred_means = np.einsum("vnk,kl,vnl->vn", exogs, cov_params, exogs)
+    dist = ["norm", "t"][results.use_t]
+    return {
+        name: Prediction(
+            predicted_means[i],
+            var_pred_means[i],
+            results.scale,
+            dist=dist,
+            df=results.df_resid,
+        )
+        for i, name in enumerate(variant_names)
+    }
+
+
+class BatchResults:
+    """Results of fit_batch, for a batch of models (for example stations x model variants).
+
+    The parameters are named as in statsmodels (const, x1, x2, ...), params, bse and the
+    statistics are indexed by the labels of the batch. The display names of each model are in names
+    (one TermNames for all or a dict by label), the components of the fits are in decomposition.
+    """
+
+    def __init__(
+        self, index, exog_names, names, params, cov_params, stats, endog=None, exog=None
+    ):
+        self.index = index
+        self.endog = endog
+        self.exog = exog
+        self.exog_names = exog_names
+        self.names = names
+        self.params = pd.DataFrame(params, index=index, columns=exog_names)
+        self.cov_params = cov_params
+        bse = np.sqrt(np.diagonal(cov_params, axis1=1, axis2=2))
+        self.bse = pd.DataFrame(bse, index=index, columns=exog_names)
+        self.stats = pd.DataFrame(stats, index=index)
+
+    def __len__(self):
+        return len(self.index)
+
+    @functools.cached_property
+    def decomposition(self):
+        """the additive components of all fits (see decompose), computed once"""
+        if self.names is None:
+            raise ValueError("the names of the terms are needed to decompose the fits")
+        if isinstance(self.names, dict):
+            names = [self.names[label] for label in self.index]
+        else:
+            names = [self.names] * len(self.index)
+        return decompose(
+            self.endog, self.exog, self.params.to_numpy(), names, index=self.index
+        )
+
+    def __getattr__(self, name):
+        # rho, nobs, ssr, llf, aic, ... as a series
+        stats = self.__dict__.get("stats")
+        if stats is not None and name in stats:
+            return stats[name]
+        raise AttributeError(name)
+
+
+def _compress_rows(endog, exog):
+    """move the rows without missing values to the start of each batch element, pad with zeros"""
+    valid = ~np.isnan(endog) & ~np.isnan(exog).any(axis=2)
+    n_valid = valid.sum(axis=1)
+    # stable sort: valid rows first, in their original order
+    order = np.argsort(~valid, axis=1, kind="stable")
+    y = np.take_along_axis(endog, order, axis=1)
+    X = np.take_along_axis(exog, order[:, :, np.newaxis], axis=1)
+    mask = np.arange(endog.shape[1])[np.newaxis, :] < n_valid[:, np.newaxis]
+    y = np.where(mask, y, 0.0)
+    X = np.where(mask[:, :, np.newaxis], X, 0.0)
+    return y, X, mask, n_valid
+
+
+def _whiten(y, X, mask, rho):
+    """whiten with AR(1) coefficients rho (per batch element), dropping the first observation"""
+    wy = y[:, 1:] - rho[:, np.newaxis] * y[:, :-1]
+    wX = X[:, 1:] - rho[:, np.newaxis, np.newaxis] * X[:, :-1]
+    wmask = mask[:, 1:]
+    wy = np.where(wmask, wy, 0.0)
+    wX = np.where(wmask[:, :, np.newaxis], wX, 0.0)
+    return wy, wX, wmask
+
+
+def _yule_walker_ar1(resid, mask, n_valid):
+    """AR(1) coefficient of the residuals (adjusted Yule-Walker, as in statsmodels)"""
+    mean = (resid * mask).sum(axis=1) / n_valid
+    x = np.where(mask, resid - mean[:, np.newaxis], 0.0)
+    r0 = (x**2).sum(axis=1) / n_valid
+    r1 = (x[:, :-1] * x[:, 1:]).sum(axis=1) / (n_valid - 1)
+    return r1 / r0
+
+
+def fit_batch(
+    endog,
+    exog,
+    with_ar=True,
+    maxiter=3,
+    rtol=1e-4,
+    index=None,
+    names=None,
+):
+    """Fit a batch of linear models with HC0 covariance in one vectorized pass.
 
-    # Nodal parameters should be stored as x2, x3 in the fit
-    u_index = names.index("Nodal U")
-    v_index = names.index("Nodal V")
+    This gives the same results as fit_model (GLSAR.iterative_fit or OLS) for each element.
+    endog has shape (n_batch, n_obs), exog (n_batch, n_obs, n_params) or (n_obs, n_params) if
+    the design is shared. Rows with missing values are dropped per element (missing="drop").
+    Columns of zeros can be used to pad models with fewer parameters.
+    """
+    endog = np.asarray(endog, dtype="float64")
+    exog = np.asarray(exog, dtype="float64")
+    if exog.ndim == 2:
+        exog = np.broadcast_to(exog, endog.shape + exog.shape[-1:])
+    n_batch, _, n_params = exog.shape
+
+    y, X, mask, n_valid = _compress_rows(endog, exog)
+
+    def solve(rho):
+        if with_ar:
+            wy, wX, wmask = _whiten(y, X, mask, rho)
+        else:
+            wy, wX, wmask = y, X, mask
+        pinv_wX = np.linalg.pinv(wX)
+        params = np.einsum("bkn,bn->bk", pinv_wX, wy)
+        return params, wy, wX, wmask, pinv_wX
+
+    rho = np.zeros(n_batch)
+    if with_ar:
+        # iterate as GLSAR.iterative_fit, rho is no longer updated once the params converged
+        converged = np.zeros(n_batch, dtype=bool)
+        for i in range(maxiter - 1):
+            params = solve(rho)[0]
+            if i == 0:
+                last = params
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    diff = np.max(np.abs(last - params) / np.abs(last), axis=1)
+                converged |= diff < rtol
+                last = params
+            resid = y - np.einsum("bnk,bk->bn", X, params)
+            rho = np.where(converged, rho, _yule_walker_ar1(resid, mask, n_valid))
+
+    params, wy, wX, wmask, pinv_wX = solve(rho)
+    wresid = wy - np.einsum("bnk,bk->bn", wX, params)
+    # HC0: pinv(X) diag(e^2) pinv(X)^T
+    cov_params = np.einsum("bkn,bn,bln->bkl", pinv_wX, wresid**2, pinv_wX)
+
+    nobs = wmask.sum(axis=1).astype("float64")
+    rank = np.linalg.matrix_rank(wX).astype("float64")
+    ssr = (wresid**2).sum(axis=1)
+    llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1)
+    stats = {
+        "rho": rho if with_ar else np.full(n_batch, np.nan),
+        "nobs": nobs,
+        "df_model": rank - 1,
+        "df_resid": nobs - rank,
+        "ssr": ssr,
+        "scale": ssr / (nobs - rank),
+        "llf": llf,
+        "aic": -2 * llf + 2 * rank,
+        "bic": -2 * llf + np.log(nobs) * rank,
+    }
+
+    if index is None:
+        index = pd.RangeIndex(n_batch)
+    exog_names = ["const"] + [f"x{i}" for i in range(1, n_params)]
+    return BatchResults(
+        index,
+        exog_names,
+        names,
+        params,
+        cov_params,
+        stats,
+        endog=endog,
+        exog=exog,
+    )
+
+
+def fit_models(dfs, models, with_ar=True, quantity="height"):
+    """Fit model variants for many stations in one batch.
+
+    dfs maps a station to its data frame, models maps a variant name to a design function,
+    for example {"linear": linear_design, "quadratic": functools.partial(quadratic_design, with_wind=False)}.
+    The results are indexed by (station, variant), parameters that a variant does not have are nan.
+    """
+    designs = []
+    for station, df in dfs.items():
+        y = np.asarray(df[quantity], dtype="float64")
+        for variant, design in models.items():
+            X, names = design(df)
+            designs.append(((station, variant), y, np.asarray(X), names))
+
+    n_obs = max(len(y) for _, y, _, _ in designs)
+    n_params = max(X.shape[1] for _, _, X, _ in designs)
+    # pad the series with missing values and the designs with columns of zeros
+    endog = np.full((len(designs), n_obs), np.nan)
+    exog = np.zeros((len(designs), n_obs, n_params))
+    for i, (_, y, X, _) in enumerate(designs):
+        endog[i, : len(y)] = y
+        exog[i, : len(y), : X.shape[1]] = X
+
+    index = pd.MultiIndex.from_tuples(
+        [label for label, _, _, _ in designs], names=["station", "variant"]
+    )
+    names = {label: names for label, _, _, names in designs}
+    results = fit_batch(endog, exog, with_ar=with_ar, index=index, names=names)
+
+    # parameters of the padding columns do not exist
+    k = np.array([X.shape[1] for _, _, X, _ in designs])
+    padding = np.arange(n_params)[np.newaxis, :] >= k[:, np.newaxis]
+    results.params = results.params.mask(padding)
+    results.bse = results.bse.mask(padding)
+    return results
+
+
+def _breakpoint_design(df, start_accelerations, model, with_wind, with_nodal):
+    """The design of the first candidate, the column of the breakpoint term, the breakpoint
+    column of every candidate (n_candidates, n_obs) and the trend since each candidate."""
+    year = np.asarray(df["year"], dtype="float64")
+    if model == "broken_linear":
+        X, names = broken_linear_design(
+            df, with_wind=with_wind, start_acceleration=start_accelerations[0]
+        )
+        breakpoint_index = names.columns["broken_trend"]
+        power = 1
+    elif model == "broken_quadratic":
+        X, names = broken_quadratic_design(
+            df,
+            with_wind=with_wind,
+            with_nodal=with_nodal,
+            start_acceleration=start_accelerations[0],
+        )
+        breakpoint_index = names.columns["acceleration"]
+        power = 2
+    else:
+        raise ValueError(f"model should be broken_linear or broken_quadratic: {model}")
+    since_start = year[np.newaxis, :] - start_accelerations[:, np.newaxis]
+    breakpoint_columns = (since_start >= 0) * since_start**power
+    return np.asarray(X, dtype="float64"), names, breakpoint_index, breakpoint_columns
 
-    u_name = fit.model.exog_names[u_index]
-    v_name = fit.model.exog_names[v_index]
 
-    # Extract parameters  and input parameters of the linear model for tide
-    exog_u = fit.model.exog[:, u_index]
-    param_u = fit.params[u_name]
-    exog_v = fit.model.exog[:, v_index]
-    param_v = fit.params[v_name]
+def _scan_ols(y, X, breakpoint_index, breakpoint_columns):
+    """OLS (HC0) fits of all candidates of one station, the shared columns are factored once.
 
-    sea_surface_height_due_to_tide = exog_u * param_u + exog_v * param_v
-    return sea_surface_height_due_to_tide
+    Each candidate only adds its breakpoint column b to the shared columns Z. With Q an
+    orthonormal basis of Z, the coefficient of b is the regression of y on b - QQ'b
+    (Frisch-Waugh-Lovell) and its row of pinv(X) is (b - QQ'b)' / |b - QQ'b|^2, which gives
+    the HC0 standard error without a fit per candidate.
+    """
+    valid = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+    y = y[valid]
+    Z = np.delete(X[valid], breakpoint_index, axis=1)
+    B = breakpoint_columns[:, valid].T
+    # the singular vectors of the non-zero singular values, as pinv drops dependent columns
+    U, singular_values, _ = np.linalg.svd(Z, full_matrices=False)
+    tol = singular_values.max(initial=0) * max(Z.shape) * np.finfo("float64").eps
+    Q = U[:, singular_values > tol]
+    y_perp = y - Q @ (Q.T @ y)
+    B_perp = B - Q @ (Q.T @ B)
+    bb = (B_perp**2).sum(axis=0)
+    # a breakpoint column that is 0 or in the span of Z (after the last year) is dropped
+    identified = bb > 1e-10 * np.maximum((B**2).sum(axis=0), 1)
+    safe_bb = np.where(identified, bb, 1)
+    gamma = np.where(identified, B_perp.T @ y_perp / safe_bb, 0)
+    resid = y_perp[:, np.newaxis] - B_perp * gamma
+    bse = np.where(identified, np.sqrt((B_perp**2 * resid**2).sum(axis=0)) / safe_bb, 0)
+
+    nobs = float(len(y))
+    rank = Q.shape[1] + identified
+    ssr = (resid**2).sum(axis=0)
+    llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1)
+    return {
+        "acceleration": gamma,
+        "acceleration_se": bse,
+        "aic": -2 * llf + 2 * rank,
+        "llf": llf,
+        "rho": np.full(len(gamma), np.nan),
+        "nobs": np.full(len(gamma), nobs),
+    }
+
+
+def _scan_glsar(designs, start_accelerations, model, with_ar):
+    """fit all candidates of a list of (y, X, names, breakpoint index, columns) in one batch"""
+    n_candidates = len(start_accelerations)
+    n_obs = max(len(y) for y, *_ in designs)
+    n_params = designs[0][1].shape[1]
+    endog = np.full((len(designs), n_candidates, n_obs), np.nan)
+    exog = np.zeros((len(designs), n_candidates, n_obs, n_params))
+    for i, (y, X, names, breakpoint_index, breakpoint_columns) in enumerate(designs):
+        n = len(y)
+        endog[i, :, :n] = y
+        exog[i, :, :n] = X
+        exog[i, :, :n, breakpoint_index] = breakpoint_columns
+        if model == "broken_quadratic":
+            # the trend (and constant) are relative to the start of the acceleration
+            year = X[:, names.columns["trend"]] + start_accelerations[0]
+            exog[i, :, :n, names.columns["trend"]] = (
+                year[np.newaxis, :] - start_accelerations[:, np.newaxis]
+            )
+    results = fit_batch(
+        endog.reshape(-1, n_obs),
+        exog.reshape(-1, n_obs, n_params),
+        with_ar=with_ar,
+    )
+    breakpoint_index = designs[0][3]
+    return {
+        "acceleration": results.params.iloc[:, breakpoint_index].to_numpy(),
+        "acceleration_se": results.bse.iloc[:, breakpoint_index].to_numpy(),
+        "aic": results.aic.to_numpy(),
+        "llf": results.llf.to_numpy(),
+        "rho": results.rho.to_numpy(),
+        "nobs": results.nobs.to_numpy(),
+    }
+
+
+def scan_breakpoints(
+    dfs,
+    start_accelerations=range(1900, 2011),
+    model="broken_linear",
+    with_wind=True,
+    with_ar=True,
+    with_nodal=True,
+    quantity="height",
+    batch_size=2048,
+):
+    """Fit the broken_linear or broken_quadratic model for every candidate start of the acceleration.
+
+    dfs is the data frame of one station or a mapping of station to data frame.
+    The shared columns (constant, trend, nodal, wind) are computed once per station, only the
+    breakpoint column differs per candidate. Without AR the shared columns are factored once per
+    station and each candidate is a rank one update (see _scan_ols). With AR, rho differs per
+    candidate, so the whitened designs are not shared: stations x candidates are fitted in
+    batches of at most batch_size models (see fit_batch).
+    Returns a table indexed by start_acceleration (by station and start_acceleration for a
+    mapping) with the acceleration (the +trend for broken_linear, the quadratic term for
+    broken_quadratic), its standard error, aic, llf, rho and nobs.
+    with_nodal only applies to broken_quadratic, broken_linear always includes the nodal cycle.
+    """
+    single = isinstance(dfs, pd.DataFrame)
+    if single:
+        dfs = {None: dfs}
+    start_accelerations = np.asarray(start_accelerations)
+    stations = list(dfs)
+    designs = []
+    for station in stations:
+        df = dfs[station]
+        X, names, breakpoint_index, breakpoint_columns = _breakpoint_design(
+            df, start_accelerations, model, with_wind, with_nodal
+        )
+        y = np.asarray(df[quantity], dtype="float64")
+        designs.append((y, X, names, breakpoint_index, breakpoint_columns))
+
+    columns = collections.defaultdict(list)
+    if with_ar:
+        per_batch = max(batch_size // len(start_accelerations), 1)
+        for i in range(0, len(designs), per_batch):
+            scan = _scan_glsar(
+                designs[i : i + per_batch], start_accelerations, model, with_ar
+            )
+            for column, values in scan.items():
+                columns[column].append(values)
+    else:
+        for y, X, _, breakpoint_index, breakpoint_columns in designs:
+            scan = _scan_ols(y, X, breakpoint_index, breakpoint_columns)
+            for column, values in scan.items():
+                columns[column].append(values)
+
+    data = {column: np.concatenate(values) for column, values in columns.items()}
+    if single:
+        index = pd.Index(start_accelerations, name="start_acceleration")
+    else:
+        index = pd.MultiIndex.from_product(
+            [stations, start_accelerations], names=["station", "start_acceleration"]
+        )
+    return pd.DataFrame(data, index=index)
+
+
+# Additive components of the models, with the term keys of each component.
+# The constant and the terms of the components add up to the fitted values.
+COMPONENTS = {
+    "constant": ["constant"],
+    "trend": ["trend", "broken_trend"],
+    "acceleration": ["acceleration"],
+    "nodal": ["nodal_u", "nodal_v"],
+    "wind": ["wind_u2", "wind_v2", "wind_main", "wind_perp"],
+    "surge": ["surge"],
+}
+
+# the decompositions of single fits (see decompose_fit), computed once per fit
+_decompositions = weakref.WeakKeyDictionary()
+
+
+def _term_keys(names):
+    """the term key of each column, names are TermNames or a list of display names"""
+    if getattr(names, "keys", None):
+        return list(names.keys)
+    # plain lists of display names, match them with the names of the terms
+    patterns = [("constant", "Constant (in year {epoch})")]
+    for spec in TERMS.values():
+        patterns.extend(zip(spec["keys"], spec["names"]))
+    keys = []
+    for name in names:
+        for key, pattern in patterns:
+            regex = re.escape(pattern).replace(re.escape("{epoch}"), r"-?\d+")
+            if re.fullmatch(regex, name):
+                keys.append(key)
+                break
+        else:
+            keys.append(None)
+    return keys
+
+
+class Decomposition:
+    """The additive components of a batch of fits, see COMPONENTS.
+
+    Each component is an array of shape (n_batch, n_obs), aligned with the endog of the fits,
+    the residual is the endog minus all components. Rows with missing values are nan.
+    The labels of the batch are in index.
+    """
+
+    def __init__(self, index, components):
+        self.index = index
+        self.components = components
+
+    def __getitem__(self, component):
+        return self.components[component]
+
+    def __iter__(self):
+        return iter(self.components)
+
+    def anomaly(self, component):
+        """the component minus its mean (per fit)"""
+        values = self.components[component]
+        return values - np.nanmean(values, axis=1, keepdims=True)
+
+    def frame(self, label=None):
+        """the components of one fit as a data frame (the only fit if label is None)"""
+        i = 0 if label is None else self.index.get_loc(label)
+        return pd.DataFrame(
+            {component: values[i] for component, values in self.components.items()}
+        )
+
+
+def decompose(endog, exog, params, names, index=None):
+    """Split the fitted values of a batch of linear models into additive components.
+
+    endog has shape (n_batch, n_obs), exog (n_batch, n_obs, n_params), params
+    (n_batch, n_params) and names is a list with the TermNames of each fit.
+    All components of all fits are computed in one pass, returns a Decomposition.
+    """
+    endog = np.asarray(endog, dtype="float64")
+    exog = np.asarray(exog, dtype="float64")
+    if exog.ndim == 2:
+        exog = np.broadcast_to(exog, endog.shape + exog.shape[-1:])
+    # the parameters of padding columns are nan
+    params = np.nan_to_num(np.asarray(params, dtype="float64"))
+    n_batch, _, n_params = exog.shape
+
+    # the columns of each component, per fit
+    indicator = np.zeros((n_batch, n_params, len(COMPONENTS)))
+    component_index = {
+        key: c for c, keys in enumerate(COMPONENTS.values()) for key in keys
+    }
+    for b, names_b in enumerate(names):
+        for k, key in enumerate(_term_keys(names_b)):
+            if key in component_index:
+                indicator[b, k, component_index[key]] = 1
+
+    valid = ~np.isnan(endog) & ~np.isnan(exog).any(axis=2)
+    values = np.einsum("bnk,bk,bkc->cbn", exog, params, indicator)
+    values[:, ~valid] = np.nan
+    components = dict(zip(COMPONENTS, values))
+    components["residual"] = endog - values.sum(axis=0)
+    if index is None:
+        index = pd.RangeIndex(n_batch)
+    return Decomposition(index, components)
+
+
+def decompose_fit(fit, names):
+    """The components of an OLS or GLSAR fit (see decompose), computed once per fit."""
+    # the unwrapped results, the wrapper is recreated on access
+    results = getattr(fit, "_results", fit)
+    keys = tuple(_term_keys(names))
+    cached = _decompositions.get(results)
+    if cached is None or cached[0] != keys:
+        decomposition = decompose(
+            np.asarray(results.model.endog)[np.newaxis],
+            np.asarray(results.model.exog)[np.newaxis],
+            np.asarray(results.params)[np.newaxis],
+            [names],
+        )
+        _decompositions[results] = (keys, decomposition)
+    return _decompositions[results][1]
+
+
+def tide_effect(fit, names):
+    """the sea surface height due to the nodal tide"""
+    return decompose_fit(fit, names)["nodal"][0]
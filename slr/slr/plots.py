@@ -334,7 +334,7 @@ def sea_level_due_to_tide(mean_df, fit, names):
     exog_u = fit.model.exog[:, u_index]
     exog_v = fit.model.exog[:, v_index]
 
-    sea_surface_height_due_to_tide = slr.models.tide_effect(fit=fit, names=names)
+    sea_surface_height_due_to_tide = slr.models.decompose_fit(fit, names)["nodal"][0]
 
     # This should show a cos (u) and sine (v) function with 1 period
     fig, axes = plt.subplots(ncols=2, figsize=(13, 6))
@@ -357,7 +357,9 @@ def sea_level_due_to_tide(mean_df, fit, names):
 
 def wind_anomaly_vs_surge_anomaly(mean_df, fit, names):
     """return an overview of wind and surge anomalies"""
-    wind_effect, wind_anomaly = slr.wind.compute_wind_effect_and_anomaly(fit, names)
+    decomposition = slr.models.decompose_fit(fit, names)
+    wind_effect = decomposition["wind"][0]
+    wind_anomaly = decomposition.anomaly("wind")[0]
 
     fig, axes = plt.subplots(
         figsize=(13, 8), nrows=2, gridspec_kw=dict(height_ratios=(3, 1)), sharex=True
@@ -438,9 +440,11 @@ def model_compare_plot(mean_df, fits_df, quantity):
     quadratic_fit = fits_df.loc["quadratic", "fit"]
     broken_quadratic_fit = fits_df.loc["broken_quadratic", "fit"]
 
-    wind_effect, wind_anomaly = slr.wind.compute_wind_effect_and_anomaly(
-        fit=linear_with_wind_fit, names=linear_with_wind_names
+    decomposition = slr.models.decompose_fit(
+        linear_with_wind_fit, linear_with_wind_names
     )
+    wind_effect = decomposition["wind"][0]
+    wind_anomaly = decomposition.anomaly("wind")[0]
 
     fig.circle(
         mean_df.year,
@@ -1,13 +1,22 @@
 import io
-import datetime
+import os
+import re
 import zipfile
+import warnings
+import threading
 import functools
+import concurrent.futures
 
 import numpy as np
 import pandas as pd
-import requests
 
 import slr
+import slr.archive
+import slr.cache
+import slr.gtsm
+import slr.regions
+import slr.update
+import slr.utils
 import slr.wind
 
 
@@ -19,9 +28,31 @@ def missing2nan(value, missing=-99999):
     return value
 
 
+def parse_psmsl_data(data, datum_offset=0, missing=-99999):
+    """parse the contents of a psmsl data file (.rlrdata/.metdata) into a data frame.
+    Uses the C parser without per-cell converters. Missing heights are set to nan and
+    the datum_offset (for example nap-rlr) is subtracted from the heights."""
+    df = pd.read_csv(
+        io.BytesIO(data),
+        sep=";",
+        names=("year", "height", "interpolated", "flags"),
+        dtype={"interpolated": str},
+    )
+    height = df["height"].to_numpy(dtype="float64")
+    height[height == missing] = np.nan
+    if datum_offset:
+        height -= datum_offset
+    df["height"] = height
+    # the number of interpolated days (monthly) or Y/N (annual), repeated a lot
+    df["interpolated"] = df["interpolated"].str.strip().astype("category")
+    df["flags"] = pd.to_numeric(df["flags"], downcast="integer")
+    return df
+
+
 def year2date(year_fraction, dtype="datetime64[s]"):
     """convert a fraction of a year + fraction of a year to a date, for example 1993.083 -~> 1993-02-01.
-    The dtype should be a valid numpy datetime unit, such as datetime64[s]"""
+    The dtype should be a valid numpy datetime unit, such as datetime64[s].
+    See slr.utils.date2year for the reverse."""
     startpoints = np.linspace(0, 1, num=12, endpoint=False)
     remainder = np.mod(year_fraction, 1)
     year = np.floor_divide(year_fraction, 1).astype("int")
@@ -29,10 +60,12 @@ def year2date(year_fraction, dtype="datetime64[s]"):
     if (month == 0).all():
         # if month is set to 0 (for annual data), set to january
         month = np.ones_like(month)
-    dates = [
-        datetime.datetime(year_i, month_i, 1) for year_i, month_i in zip(year, month)
-    ]
-    datetime64s = np.asarray(dates, dtype=dtype)
+    elif (month == 0).any():
+        # mix of whole years and fractions, not a valid date
+        raise ValueError("month must be in 1..12")
+    # months since 1970-01, as datetime64[M]
+    months = (np.asarray(year) - 1970) * 12 + (np.asarray(month) - 1)
+    datetime64s = months.astype("datetime64[M]").astype(dtype)
     return datetime64s
 
 
@@ -40,16 +73,8 @@ def get_data(zf, station, dataset_name):
     """get data for the station (pandas record) from the dataset (url)"""
     info = dict(dataset_name=dataset_name, id=station.name)
     bytes = zf.read("{dataset_name}/data/{id}.rlrdata".format(**info))
-    df = pd.read_csv(
-        io.BytesIO(bytes),
-        sep=";",
-        names=("year", "height", "interpolated", "flags"),
-        converters={
-            "year": lambda x: float(x),
-            "height": lambda x: missing2nan(x),
-            "interpolated": str.strip,
-        },
-    )
+    df = parse_psmsl_data(bytes)
+    df["year"] = df["year"].astype("float64")
     df["station"] = station.name
     # store time as t
     df["t"] = year2date(df.year)
@@ -59,9 +84,15 @@ def get_data(zf, station, dataset_name):
 
 
 def get_data_with_wind(
-    station, dataset_name, zipfiles, monthly_wind_df=None, annual_wind_df=None
+    station,
+    dataset_name,
+    zipfiles,
+    monthly_wind_df=None,
+    annual_wind_df=None,
+    data=None,
 ):
-    """get data for the station (pandas record) from the dataset (url)"""
+    """get data for the station (pandas record) from the dataset (url).
+    If data (the rows of the station from get_psmsl_table) is passed, the zipfiles are not read."""
     if "monthly" in dataset_name:
         assert (
             monthly_wind_df is not None
@@ -70,24 +101,26 @@ def get_data_with_wind(
         assert (
             annual_wind_df is not None
         ), "for annual dataset, please pass the annual_wind_df argument"
-    info = dict(dataset_name=dataset_name, id=station.name)
-    url_names = get_url_names()
-    bytes = zipfiles[dataset_name].read(url_names[dataset_name].format(**info))
-    df = pd.read_csv(
-        io.BytesIO(bytes),
-        sep=";",
-        names=("year", "height", "interpolated", "flags"),
-        converters={
-            "height": lambda x: missing2nan(x) - station["nap-rlr"],
-            "interpolated": str.strip,
-        },
-    )
+    if data is None:
+        info = dict(dataset_name=dataset_name, id=station.name)
+        url_names = get_url_names()
+        bytes = zipfiles[dataset_name].read(url_names[dataset_name].format(**info))
+        df = parse_psmsl_data(bytes, datum_offset=station["nap-rlr"])
+    else:
+        df = data[["year", "height", "interpolated", "flags"]].reset_index(drop=True)
+        df["height"] = df["height"] - station["nap-rlr"]
     df["station"] = station.name
     # store time as t
     df["t"] = year2date(df.year, dtype="<M8[ns]")
     df["alpha"] = station["alpha"]
     df = df.set_index("t")
 
+    # select the wind of this station (see slr.wind.get_wind_products with points)
+    if monthly_wind_df is not None and "station" in monthly_wind_df.index.names:
+        monthly_wind_df = monthly_wind_df.xs(station.name, level="station")
+    if annual_wind_df is not None and "station" in annual_wind_df.index.names:
+        annual_wind_df = annual_wind_df.xs(station.name, level="station")
+
     # merge the wind and water levels
     if "monthly" in dataset_name:
         merged = pd.merge(
@@ -153,23 +186,218 @@ def get_url_names():
     return url_names
 
 
-def get_zipfiles(local=True):
+def get_zipfiles(local=True, dataset_names=None, cache_dir=None):
+    """Open the psmsl archives (all datasets or dataset_names) as memory mapped archives.
+
+    Members are read on demand (see slr.archive.MappedArchive), so an open archive takes
+    little memory. Remote archives are downloaded to the cache directory first, the
+    download is skipped if the archive did not change (see slr.update.download_archive).
+    """
     zipfiles = {}
 
     psmsl_urls = get_psmsl_urls(local=local)
 
-    for dataset_name, psmsl_url in psmsl_urls.items():
+    for dataset_name in dataset_names or list(psmsl_urls):
+        psmsl_url = psmsl_urls[dataset_name]
         if local:
-            zf = zipfile.ZipFile(psmsl_url)
+            path = psmsl_url
         else:
-            resp = requests.get(psmsl_url)
-            # we can read the zipfile
-            stream = io.BytesIO(resp.content)
-            zf = zipfile.ZipFile(stream)
-        zipfiles[dataset_name] = zf
+            # stream to disk instead of keeping the archive in memory
+            download_dir = slr.cache.get_cache_dir(cache_dir) / "psmsl"
+            download_dir.mkdir(exist_ok=True)
+            path = download_dir / f"{dataset_name}.zip"
+            slr.update.download_archive(psmsl_url, path, cache_dir=cache_dir)
+        zipfiles[dataset_name] = slr.archive.MappedArchive(path)
     return zipfiles
 
 
+# zipfiles opened by a worker (thread or process), one handle per archive
+_worker = threading.local()
+
+
+def _worker_zipfile(archive):
+    """return the zipfile of this worker for the archive (a path or an open zipfile)"""
+    if isinstance(archive, (zipfile.ZipFile, slr.archive.MappedArchive)):
+        # reading members from several threads is safe
+        return archive
+    zipfiles = _worker.__dict__.setdefault("zipfiles", {})
+    if archive not in zipfiles:
+        zipfiles[archive] = slr.archive.MappedArchive(archive)
+    return zipfiles[archive]
+
+
+def _parse_members(archive, members):
+    """parse a batch of (station, member name) from the archive.
+    Returns a list of (station, data frame, error), a failure does not stop the batch."""
+    zf = _worker_zipfile(archive)
+    results = []
+    for station, name in members:
+        try:
+            df = parse_psmsl_data(zf.read(name))
+        except Exception as e:
+            results.append((station, None, f"{type(e).__name__}: {e}"))
+        else:
+            results.append((station, df, None))
+    return results
+
+
+def read_archive_table(zf, dataset_name, stations=None, jobs=1):
+    """parse all station files of a psmsl archive into one long table with the columns
+    station, t, year, height, interpolated and flags (heights relative to RLR).
+    Pass a list of station ids to only parse those stations.
+    With jobs > 1 (None for all cores) the stations are parsed in a pool of workers: processes
+    for archives on disk, threads for archives in memory. Stations that could not be parsed
+    are reported with a warning and listed in table.attrs["failed"]."""
+    pattern = re.compile(rf"{dataset_name}/data/(\d+)\.(rlrdata|metdata)$")
+    if stations is not None:
+        stations = {int(station) for station in stations}
+    members = []
+    for name in zf.namelist():
+        match = pattern.match(name)
+        if match is None:
+            continue
+        if stations is not None and int(match.group(1)) not in stations:
+            continue
+        members.append((int(match.group(1)), name))
+
+    if jobs is None:
+        jobs = os.cpu_count()
+    if jobs == 1 or len(members) < 2:
+        results = _parse_members(zf, members)
+    else:
+        # a few batches per worker, the order of the results is the order of the batches
+        n_batches = min(len(members), jobs * 4)
+        batches = [members[i::n_batches] for i in range(n_batches)]
+        if zf.filename is not None and isinstance(zf.filename, str):
+            archive = zf.filename
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        else:
+            archive = zf
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        with executor:
+            batch_results = executor.map(
+                functools.partial(_parse_members, archive), batches
+            )
+            results = [result for batch in batch_results for result in batch]
+
+    dfs = []
+    failed = {}
+    for station, df, error in results:
+        if error is not None:
+            failed[station] = error
+            continue
+        df.insert(0, "station", np.int32(station))
+        dfs.append(df)
+    if failed:
+        warnings.warn(
+            f"could not parse {len(failed)} stations of {dataset_name}: {failed}"
+        )
+
+    if dfs:
+        table = pd.concat(dfs, ignore_index=True)
+    else:
+        table = pd.DataFrame(
+            {
+                "station": np.array([], dtype="int32"),
+                "year": np.array([], dtype="float64"),
+                "height": np.array([], dtype="float64"),
+                "interpolated": np.array([], dtype=str),
+                "flags": np.array([], dtype="int8"),
+            }
+        )
+    # categories differ per file, recompute them for the whole archive
+    table["interpolated"] = table["interpolated"].astype(str).astype("category")
+    table.insert(1, "t", year2date(table["year"], dtype="<M8[ns]"))
+    table = table.sort_values(["station", "t"], kind="stable", ignore_index=True)
+    table.attrs["failed"] = failed
+    return table
+
+
+def get_psmsl_table(
+    dataset_name,
+    stations=None,
+    start=None,
+    end=None,
+    local=True,
+    cache_dir=None,
+    jobs=1,
+):
+    """get the long table of the psmsl dataset for a selection of station ids and a time range.
+    For local archives the parsed table is cached as parquet, keyed by the checksum of the zip file,
+    so a new release in data/psmsl is parsed once, by jobs workers (see read_archive_table).
+    A table with stations that could not be parsed is not cached, it is parsed (and the failures
+    are reported) again on the next call."""
+    filters = []
+    if stations is not None:
+        filters.append(("station", "in", [int(station) for station in stations]))
+    if start is not None:
+        filters.append(("t", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("t", "<", pd.Timestamp(end)))
+
+    if not local:
+        # no file to key the cache on, parse the downloaded archive
+        zf = get_zipfiles(local=False, dataset_names=[dataset_name])[dataset_name]
+        with zf:
+            table = read_archive_table(zf, dataset_name, jobs=jobs)
+        return _filter_table(table, filters)
+
+    path = psmsl_table_path(dataset_name, cache_dir=cache_dir)
+    if not path.exists():
+        zip_path = get_psmsl_urls(local=True)[dataset_name]
+        with slr.archive.MappedArchive(zip_path) as zf:
+            table = read_archive_table(zf, dataset_name, jobs=jobs)
+        if table.attrs["failed"]:
+            return _filter_table(table, filters)
+        write_psmsl_table(table, path)
+
+    table = pd.read_parquet(path, filters=filters or None)
+    return table
+
+
+def _filter_table(table, filters):
+    """apply parquet style filters (see get_psmsl_table) to a table in memory"""
+    failed = table.attrs.get("failed", {})
+    for column, op, value in filters:
+        if op == "in":
+            table = table[table[column].isin(value)]
+        elif op == ">=":
+            table = table[table[column] >= value]
+        else:
+            table = table[table[column] < value]
+    table = table.reset_index(drop=True)
+    table.attrs["failed"] = failed
+    return table
+
+
+def psmsl_table_path(dataset_name, cache_dir=None):
+    """the path of the cached table of the local archive, keyed by the checksum of the zip file.
+    Cached tables of other releases are removed."""
+    zip_path = get_psmsl_urls(local=True)[dataset_name]
+    fingerprint = slr.cache.file_fingerprint(zip_path, cache_dir=cache_dir)
+    key = slr.cache.cache_key(dataset_name, fingerprint["sha256"])
+    return slr.cache.cache_path("psmsl", dataset_name, key, cache_dir=cache_dir)
+
+
+def write_psmsl_table(table, path):
+    """write a parsed table (see read_archive_table) to the cache"""
+    # sorted by station, small row groups allow skipping stations while reading
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    table.to_parquet(tmp_path, index=False, row_group_size=50_000)
+    os.replace(tmp_path, path)
+
+
+def format_urls(template, ids, **fields):
+    """format a url template (see get_url_names) for many station ids at once"""
+    # fill in the other fields, then put the ids in between the parts around {id}
+    parts = template.replace("{id}", "\0").format(**fields).split("\0")
+    ids = pd.Series(ids, dtype="str").to_numpy(dtype="object")
+    urls = np.full(len(ids), parts[0], dtype="object")
+    for part in parts[1:]:
+        urls = urls + ids + part
+    return urls
+
+
 def get_station_list(zf, dataset_name="rlr_annual", local=True):
     # this list contains a table of
     # station ID, latitude, longitude, station name, coastline code, station code, and quality flag
@@ -179,8 +407,10 @@ def get_station_list(zf, dataset_name="rlr_annual", local=True):
         io.BytesIO(csvtext),
         sep=";",
         names=("id", "lat", "lon", "name", "coastline_code", "station_code", "quality"),
-        converters={"name": str.strip, "quality": str.strip},
+        dtype={"name": "str", "quality": "str"},
     )
+    for column in ["name", "quality"]:
+        stations[column] = stations[column].str.strip()
     stations = stations.set_index("id")
 
     # each station has a number of files that you can look at.
@@ -190,19 +420,12 @@ def get_station_list(zf, dataset_name="rlr_annual", local=True):
     # define the name formats for the relevant files
     url_names = get_url_names()
 
-    # add url's
-    def get_url(station, dataset_name):
-        """return the url of the station information (diagram and datum)"""
-        info = dict(dataset_name=dataset_name, id=station.name)
-        url = url_names["url"].format(**info)
-        return url
-
+    # add url's, the url of the station information (diagram and datum)
     psmsl_urls = get_psmsl_urls(local)
     for dataset_name in psmsl_urls:
-        # fill in the dataset parameter using the global dataset_name
-        f = functools.partial(get_url, dataset_name=dataset_name)
-        # compute the url for each station
-        stations[dataset_name + "_url"] = stations.apply(f, axis=1)
+        stations[dataset_name + "_url"] = format_urls(
+            url_names["url"], stations.index, dataset_name=dataset_name
+        )
 
     return stations
 
@@ -215,170 +438,247 @@ def get_main_stations():
     return main_stations
 
 
+def load_stations(dataset_name, stations, local=True, use_cache=True, jobs=1):
+    """load the dataset for all stations at once, as one long frame indexed by (station, t).
+    The stations are a data frame indexed by psmsl id. If it has a nap-rlr column the heights
+    are converted to NAP, an alpha column (coastline angle) is added to the data.
+    Station files that are not cached yet are parsed by jobs workers."""
+    ids = list(stations.index)
+    if local and use_cache:
+        table = get_psmsl_table(dataset_name, stations=ids, jobs=jobs)
+    else:
+        zf = get_zipfiles(local=local, dataset_names=[dataset_name])[dataset_name]
+        with zf:
+            table = read_archive_table(zf, dataset_name, stations=ids, jobs=jobs)
+
+    station_ids = table["station"]
+    if "nap-rlr" in stations:
+        nap_rlr = station_ids.map(stations["nap-rlr"]).to_numpy(dtype="float64")
+        table["height"] = table["height"].to_numpy() - nap_rlr
+    if "alpha" in stations:
+        table["alpha"] = station_ids.map(stations["alpha"]).to_numpy()
+    table = table.set_index(["station", "t"])
+    return table
+
+
+def station_slices(long_df):
+    """return a slice (row range) per station of a long frame, the rows of a station should be contiguous"""
+    return slr.utils.group_slices(long_df.index, "station")
+
+
+def iter_stations(long_df):
+    """iterate over (station, data) of a long frame, without copying the data.
+    The data of each station is indexed by t."""
+    if not long_df.index.is_monotonic_increasing:
+        long_df = long_df.sort_index()
+    for station, rows in station_slices(long_df).items():
+        df = long_df.iloc[rows]
+        # replace the index instead of droplevel, which copies the data
+        df.index = df.index.droplevel("station")
+        yield station, df
+
+
+def merge_wind(long_df, wind_df):
+    """merge a wind dataset (indexed by t, or by station and t for wind per station)
+    with a long frame (indexed by station, t).
+    Missing wind is filled with the mean of each station, speed and direction are recomputed."""
+    # don't include year otherwise we get year_x and year_y
+    wind_df = wind_df.drop(columns=["year"], errors="ignore")
+    if "station" in wind_df.index.names:
+        merged = pd.merge(
+            long_df,
+            wind_df,
+            how="left",
+            left_index=True,
+            right_index=True,
+        )
+    else:
+        merged = pd.merge(
+            long_df.reset_index("station"),
+            wind_df,
+            how="left",
+            left_index=True,
+            right_index=True,
+        )
+        merged = merged.set_index("station", append=True).swaplevel()
+
+    # fill in missing wind
+    grouped = merged.groupby(level="station", sort=False)
+    for column in ["u", "v", "u2", "v2"]:
+        merged[column] = merged[column].fillna(grouped[column].transform("mean"))
+
+    # recompute speed and direction
+    merged["speed"] = np.sqrt(merged["u"] ** 2 + merged["v"] ** 2)
+    merged["direction"] = np.mod(np.angle(merged["u"] + merged["v"] * 1j), 2 * np.pi)
+    return merged
+
+
+def merge_surge(long_df, gtsm_df, ddl_ids, on="t"):
+    """merge the gtsm surge (in mm) with a long frame, using the ddl_id of each station.
+    Use on="year" for annual data and on="t" for monthly data.
+    gtsm_df is a frame with ddl_id and on columns, for example a table of a GtsmStore.
+    Missing surge is filled with the mean of each station."""
+    df = long_df.reset_index()
+    # one lookup of all (ddl_id, on) keys
+    keys = pd.MultiIndex.from_arrays([df["station"].map(ddl_ids), df[on]])
+    surge = pd.Series(
+        gtsm_df["surge_mm"].to_numpy(),
+        index=pd.MultiIndex.from_arrays([gtsm_df["ddl_id"], gtsm_df[on]]),
+    )
+    df["surge_mm"] = surge.reindex(keys).to_numpy()
+    df = df.set_index(["station", "t"])
+
+    surge = df["surge_mm"]
+    surge_mean = surge.groupby(level="station", sort=False).transform("mean")
+    df["surge_mm"] = surge.fillna(surge_mean)
+    df["height - surge"] = df["height"] - df["surge_mm"]
+    df["height - surge anomaly"] = df["height"] - (df["surge_mm"] - surge_mean)
+    return df
+
+
+def station_frames(long_df, ids):
+    """convert a long frame into a list of data frames (indexed by t), one for each station id.
+    This is the format used in the columns of selected_stations. Stations without data (that
+    failed to parse or are not in the archive) are skipped with a warning, their frame is None."""
+    frames = dict(iter_stations(long_df))
+    missing = [id_ for id_ in ids if id_ not in frames]
+    if missing:
+        warnings.warn(f"no data for stations {missing}, they are skipped")
+    result = []
+    for id_ in ids:
+        if id_ not in frames:
+            result.append(None)
+            continue
+        df = frames[id_].copy()
+        df.insert(df.columns.get_loc("flags") + 1, "station", id_)
+        result.append(df)
+    return result
+
+
 def add_series_to_stations(
     selected_stations,
     local=True,
     wind_product="NCEP1",
     reference_point_wind=None,
     gtsm_version="2022",
+    use_cache=True,
+    jobs=1,
+    wind_points=None,
+    gtsm_points=None,
 ):
-    zipfiles = get_zipfiles(local=local)
-
-    monthly_wind_products, annual_wind_products = slr.wind.get_wind_products(
-        reference_point_wind=reference_point_wind
-    )
+    """add the rlr_annual, rlr_monthly and met_monthly series, merged with wind and surge, to the stations.
+    With use_cache (only for local data) the parsed archives are read from the parquet cache.
+    Station files are parsed by jobs workers (None for all cores).
+    Pass wind_points (lat and lon indexed by station, for example from get_station_list) to use
+    the local wind of each station instead of the wind at reference_point_wind.
+    Pass gtsm_points (lat and lon indexed by station) to use the surge of the nearest point of the
+    gtsm netcdf output (see slr.gtsm) for those stations, this works for stations without a
+    ddl_id. The other stations use the gtsm store of their ddl_id.
+    Stations without data in one of the datasets are left out with a warning and listed in
+    attrs["failed"] of the result.
+    See load_stations, merge_wind and merge_surge for the long format."""
+
+    if wind_points is None:
+        monthly_wind_products, annual_wind_products = slr.wind.get_wind_products(
+            reference_point_wind=reference_point_wind
+        )
+    else:
+        monthly_wind_products, annual_wind_products = slr.wind.get_wind_products(
+            points=wind_points.loc[selected_stations.index, ["lat", "lon"]].rename_axis(
+                "station"
+            )
+        )
 
     annual_wind_df = annual_wind_products[wind_product]
     monthly_wind_df = monthly_wind_products[wind_product]
-    monthly_gtsm_df, annual_gtsm_df = slr.wind.get_gtsm_dfs(version=gtsm_version)
-
-    # get data for all stations
-    for dataset_name in get_psmsl_urls(local=local):
-        f = functools.partial(
-            # this  function  fills in missing wind with nan
-            slr.psmsl.get_data_with_wind,
-            dataset_name=dataset_name,
-            # don't include year otherwise we get year_x and year_y
-            monthly_wind_df=monthly_wind_df.drop(columns=["year"]),
-            annual_wind_df=annual_wind_df.drop(columns=["year"]),
-            zipfiles=zipfiles,
-        )
-        # look up the data for each station
-        selected_stations[dataset_name] = [
-            f(station) for _, station in selected_stations.iterrows()
-        ]
-
-    # add surge to stations annual data
-    rlr_annual_dfs = []
-    rlr_monthly_dfs = []
-    met_monthly_dfs = []
-    for idx, station in selected_stations.iterrows():
-        annual_df = station["rlr_annual"]
-        assert (
-            station.ddl_id in annual_gtsm_df["ddl_id"].values
-        ), f"ddl_id ({station.ddl_id}) of station: {station.name} not in gtsm"
-        # add gtsm
-        annual_df = pd.merge(
-            annual_df,
-            annual_gtsm_df[annual_gtsm_df.ddl_id == station["ddl_id"]].set_index(
-                "year"
-            )[["surge_mm"]],
-            left_on="year",
-            right_index=True,
-            how="left",
-        )
-        annual_df["surge_mm"] = annual_df["surge_mm"].fillna(
-            annual_df["surge_mm"].mean()
-        )
-        annual_df["height - surge"] = annual_df["height"] - annual_df["surge_mm"]
-        annual_df["height - surge anomaly"] = annual_df["height"] - (
-            annual_df["surge_mm"] - annual_df["surge_mm"].mean()
-        )
-        rlr_annual_dfs.append(annual_df)
-
-        # Add gtsm to monthly data
-        rlr_monthly_df = station["rlr_monthly"]
-        monthly_gtsm_df_i = monthly_gtsm_df[
-            monthly_gtsm_df["ddl_id"] == station["ddl_id"]
-        ]
-        rlr_monthly_df = pd.merge(
-            rlr_monthly_df,
-            monthly_gtsm_df_i[["t", "surge_mm"]],
-            left_index=True,
-            right_on="t",
-            how="left",
-        )
-        rlr_monthly_df = rlr_monthly_df.set_index("t")
-        rlr_monthly_df["surge_mm"] = rlr_monthly_df["surge_mm"].fillna(
-            rlr_monthly_df["surge_mm"].mean()
-        )
-        rlr_monthly_df["height - surge"] = (
-            rlr_monthly_df["height"] - rlr_monthly_df["surge_mm"]
-        )
-        rlr_monthly_df["height - surge anomaly"] = rlr_monthly_df["height"] - (
-            rlr_monthly_df["surge_mm"] - rlr_monthly_df["surge_mm"].mean()
+    ddl_ids = selected_stations["ddl_id"].astype(object)
+    on_points = pd.Series(False, index=selected_stations.index)
+    if gtsm_points is not None:
+        on_points[:] = selected_stations.index.isin(gtsm_points.index)
+    gtsm_stores = []
+    if not on_points.all():
+        gtsm_store = slr.gtsm.get_gtsm_store(version=gtsm_version)
+        missing = [ddl_id for ddl_id in ddl_ids[~on_points] if ddl_id not in gtsm_store]
+        if missing:
+            raise ValueError(
+                f"ddl_ids {missing} not in gtsm {gtsm_version}, "
+                "pass gtsm_points to use the gtsm netcdf output"
+            )
+        gtsm_stores.append(gtsm_store)
+    if on_points.any():
+        # the surge at the nearest gtsm output point, keyed by station
+        point_ids = selected_stations.index[on_points]
+        gtsm_stores.append(
+            slr.gtsm.get_gtsm_points_store(gtsm_points.loc[point_ids, ["lat", "lon"]])
         )
-        rlr_monthly_dfs.append(rlr_monthly_df)
-
-        # also for the metric data
+        ddl_ids[on_points] = point_ids
+    monthly_gtsm_df, annual_gtsm_df = (
+        pd.concat([store.tables[frequency] for store in gtsm_stores], ignore_index=True)
+        for frequency in ["monthly", "annual"]
+    )
 
-        met_monthly_df = station["met_monthly"]
-        monthly_gtsm_df_i = monthly_gtsm_df[
-            monthly_gtsm_df["ddl_id"] == station["ddl_id"]
-        ]
-        met_monthly_df = pd.merge(
-            met_monthly_df,
-            monthly_gtsm_df_i[["t", "surge_mm"]],
-            left_index=True,
-            right_on="t",
-            how="left",
-        )
-        met_monthly_df = met_monthly_df.set_index("t")
-        met_monthly_df["surge_mm"] = met_monthly_df["surge_mm"].fillna(
-            met_monthly_df["surge_mm"].mean()
-        )
-        met_monthly_df["height - surge"] = (
-            met_monthly_df["height"] - met_monthly_df["surge_mm"]
+    # get data for all stations
+    dataset_names = list(get_psmsl_urls(local=local))
+    for dataset_name in dataset_names:
+        long_df = load_stations(
+            dataset_name,
+            selected_stations,
+            local=local,
+            use_cache=use_cache,
+            jobs=jobs,
         )
-        met_monthly_df["height - surge anomaly"] = met_monthly_df["height"] - (
-            met_monthly_df["surge_mm"] - met_monthly_df["surge_mm"].mean()
+        if "monthly" in dataset_name:
+            long_df = merge_wind(long_df, monthly_wind_df)
+            long_df = merge_surge(long_df, monthly_gtsm_df, ddl_ids, on="t")
+        else:
+            long_df = merge_wind(long_df, annual_wind_df)
+            long_df = merge_surge(long_df, annual_gtsm_df, ddl_ids, on="year")
+        # one data frame per station
+        selected_stations[dataset_name] = station_frames(
+            long_df, selected_stations.index
         )
-        met_monthly_dfs.append(met_monthly_df)
-
-    selected_stations["rlr_annual"] = rlr_annual_dfs
-    selected_stations["rlr_monthly"] = rlr_monthly_dfs
-    selected_stations["met_monthly"] = met_monthly_dfs
 
+    # stations that failed in one of the datasets
+    failed = selected_stations[dataset_names].isna().any(axis=1)
+    selected_stations = selected_stations[~failed].copy()
+    selected_stations.attrs["failed"] = failed.index[failed].tolist()
     return selected_stations
 
 
-def add_aggregated_stations(selected_stations):
-    """add the aggregated stations to the list, note that the psmsl_ids are hard coded."""
-    aggregated_stations = [
-        {
-            "ddl_id": "NL",
-            "name": "Netherlands",
-            "psmsl_id": 10000,
-            "idx": [20, 22, 23, 24, 25, 32],
-        },
-        {
-            "ddl_id": "NL-DELFZL",
-            "name": "Netherlands (without Delfzijl)",
-            "psmsl_id": 10001,
-            "idx": [20, 22, 23, 25, 32],
-        },
-    ]
-
-    frames = [selected_stations]
-    for aggregated_station in aggregated_stations:
-        sub_selection = selected_stations.loc[aggregated_station["idx"]]
-        row = {
-            "name_rws": aggregated_station["name"],
-            "name": aggregated_station["name"],
-            "ddl_id": aggregated_station["ddl_id"],
-            "location": aggregated_station["name"],
-            "psmsl_id": aggregated_station["psmsl_id"],
-            "id": aggregated_station["psmsl_id"],
+def add_aggregated_stations(selected_stations, regions=None):
+    """add the aggregated stations to the list, regions defaults to data/deltares/regions.json.
+    All regions are computed at once per dataset (see slr.regions.aggregate_regions)."""
+    if regions is None:
+        regions = slr.regions.load_regions()
+
+    rows = {}
+    for region in regions:
+        rows[region["id"]] = {
+            "name_rws": region["name"],
+            "name": region["name"],
+            "ddl_id": region["ddl_id"],
+            "location": region["name"],
+            "psmsl_id": region["id"],
+            "id": region["id"],
         }
-        for dataset_name in ["rlr_annual", "rlr_monthly", "met_monthly"]:
-            data_per_station = pd.concat(sub_selection[dataset_name].tolist())
-            grouped = data_per_station[
-                ["year", "height", "u2", "v2", "surge_mm"]
-            ].groupby("t")
-            mean_df = grouped.mean().reset_index()
-            # # filter out non-trusted part (before NAP, also with some missing stations)
-            mean_df = mean_df[mean_df["year"] >= 1890].copy()
-            surge = mean_df["surge_mm"]
-            mean_df["station"] = aggregated_station["psmsl_id"]
-            # recompute the surge and anomalies
-            surge = surge.fillna(surge.mean())
-            mean_df["height - surge"] = mean_df["height"] - surge
-            mean_df["height - surge anomaly"] = mean_df["height"] - (
-                surge - surge.mean()
+    for dataset_name in ["rlr_annual", "rlr_monthly", "met_monthly"]:
+        long_df = pd.concat(
+            selected_stations[dataset_name].tolist(),
+            keys=selected_stations.index,
+            names=["station", "t"],
+        )
+        aggregated = slr.regions.aggregate_regions(
+            long_df, regions, stations=selected_stations
+        )
+        for region_id, mean_df in iter_stations(aggregated):
+            mean_df = mean_df.copy()
+            mean_df.insert(
+                len(slr.regions.AGGREGATE_COLUMNS), "station", region_id
             )
-            mean_df = mean_df.set_index("t")
-            row[dataset_name] = mean_df
+            rows[region_id][dataset_name] = mean_df
 
-        frames.append(pd.DataFrame([pd.Series(row, name=row["id"])]))
+    frames = [selected_stations]
+    for region_id, row in rows.items():
+        frames.append(pd.DataFrame([pd.Series(row, name=region_id)]))
     selected_stations = pd.concat(frames)
     return selected_stations
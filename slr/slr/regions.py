@@ -0,0 +1,154 @@
+"""Regional means of tide gauge stations (for example the Netherlands), defined in a regions file."""
+import json
+
+import numpy as np
+import pandas as pd
+
+import slr
+
+# the columns that are averaged over the stations of a region
+AGGREGATE_COLUMNS = ["year", "height", "u2", "v2", "surge_mm"]
+
+
+def get_regions_path():
+    return slr.get_src_dir() / "data" / "deltares" / "regions.json"
+
+
+def load_regions(path=None):
+    """Read the region definitions, a list of regions with:
+    - id, ddl_id and name,
+    - stations (a list of psmsl ids) or coastline_code (all stations of that coastline),
+    - weights (optional): a dict by station id, a column of the station table (for example a
+      coastline length) or "inverse_variance" (1 / variance of the detrended heights),
+    - min_coverage (optional): the minimal fraction of the stations with a height per time,
+    - start_year (optional): the first year of the regional mean.
+    """
+    path = path or get_regions_path()
+    with open(path) as f:
+        return json.load(f)
+
+
+def coastline_regions(stations, start_id=20000, **options):
+    """one region per coastline code of a station table (see slr.psmsl.get_station_list)"""
+    codes = np.unique(stations["coastline_code"])
+    return [
+        {
+            "id": start_id + i,
+            "ddl_id": f"COASTLINE-{code}",
+            "name": f"Coastline {code}",
+            "coastline_code": int(code),
+            **options,
+        }
+        for i, code in enumerate(codes)
+    ]
+
+
+def region_members(regions, stations=None):
+    """Return the stations of each region with their (unnormalized) weight.
+
+    A table with region, station, weight and inverse_variance (the weight is computed from the data).
+    stations (indexed by id) is needed for regions by coastline_code and weights by column.
+    """
+    frames = []
+    for region in regions:
+        if "stations" in region:
+            ids = np.asarray(region["stations"])
+        else:
+            ids = stations.index[stations["coastline_code"] == region["coastline_code"]]
+            ids = ids.to_numpy()
+        weights = region.get("weights")
+        if isinstance(weights, dict):
+            # json keys are strings
+            weights = {int(station): weight for station, weight in weights.items()}
+            weight = np.array([weights[station] for station in ids], dtype="float64")
+        elif isinstance(weights, str) and weights != "inverse_variance":
+            weight = stations.loc[ids, weights].to_numpy(dtype="float64")
+        else:
+            weight = np.ones(len(ids))
+        frames.append(
+            pd.DataFrame(
+                {
+                    "region": region["id"],
+                    "station": ids,
+                    "weight": weight,
+                    "inverse_variance": weights == "inverse_variance",
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def inverse_variance(long_df):
+    """1 / the variance of the residual of a linear trend in height, per station"""
+    df = long_df[["year", "height"]].dropna()
+    grouped = df.groupby(level="station")
+    anomaly = df - grouped.transform("mean")
+    sums = pd.DataFrame(
+        {
+            "yy": anomaly["year"] ** 2,
+            "yh": anomaly["year"] * anomaly["height"],
+            "hh": anomaly["height"] ** 2,
+        }
+    )
+    sums = sums.groupby(level="station").sum()
+    resid_variance = (sums["hh"] - sums["yh"] ** 2 / sums["yy"]) / (grouped.size() - 2)
+    return 1 / resid_variance
+
+
+def aggregate_regions(long_df, regions, stations=None, columns=AGGREGATE_COLUMNS):
+    """Compute the weighted mean of all regions in one grouped pass.
+
+    long_df is a long frame indexed by (station, t), regions as in load_regions.
+    Each station row is joined with the regions it belongs to and the weighted sums are grouped
+    by (region, t), missing values are left out of the mean.
+    Times where fewer than min_coverage of the stations of a region have a height are dropped.
+    The surge corrected heights are recomputed from the mean surge (see merge_surge).
+    Returns a long frame indexed by (station, t), with the region id as station.
+    """
+    members = region_members(regions, stations)
+    if members["inverse_variance"].any():
+        weights = inverse_variance(long_df)
+        selected = members["inverse_variance"]
+        members.loc[selected, "weight"] = (
+            members.loc[selected, "station"].map(weights).to_numpy()
+        )
+
+    data = long_df[columns].reset_index()
+    joined = members[["region", "station", "weight"]].merge(data, on="station")
+    values = joined[columns].to_numpy(dtype="float64")
+    valid = ~np.isnan(values)
+    weight = joined["weight"].to_numpy()[:, np.newaxis]
+    # per (region, t): the weighted sums, the sums of the weights and the number of stations
+    sums = pd.DataFrame(
+        np.hstack([np.where(valid, values * weight, 0), np.where(valid, weight, 0), valid])
+    )
+    sums = sums.groupby([joined["region"], joined["t"]]).sum()
+    index = sums.index.set_names(["station", "t"])
+    sums = sums.to_numpy()
+    n = len(columns)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums[:, :n] / sums[:, n : 2 * n]
+    result = pd.DataFrame(means, index=index, columns=columns)
+
+    # the rules of the region of each row
+    rules = pd.DataFrame(regions).set_index("id").reindex(
+        columns=["min_coverage", "start_year"]
+    )
+    rules["n_stations"] = members.groupby("region").size()
+    rules = rules.loc[index.get_level_values("station")].to_numpy(dtype="float64")
+    min_coverage, start_year, n_stations = rules.T
+    keep = np.ones(len(result), dtype=bool)
+    if "height" in columns:
+        coverage = sums[:, 2 * n + columns.index("height")] / n_stations
+        keep &= ~(coverage < min_coverage)
+    # filter out non-trusted part (before NAP, also with some missing stations)
+    keep &= ~(result["year"].to_numpy() < start_year)
+    result = result[keep]
+
+    if "height" in columns and "surge_mm" in columns:
+        # recompute the surge and anomalies
+        surge_mean = result["surge_mm"].groupby(level="station").transform("mean")
+        surge = result["surge_mm"].fillna(surge_mean)
+        result["height - surge"] = result["height"] - surge
+        result["height - surge anomaly"] = result["height"] - (surge - surge_mean)
+    return result
@@ -3,13 +3,14 @@ import pandas as pd
 import ipywidgets
 import IPython.display
 
+import slr.models
+
 def fits_to_fits_df(fits):
     """add information to a list of fits and convert it to data frame"""
     for row in fits:
         row['aic'] = row['fit'].aic
         row['F'] = row['fit'].fvalue
         row['df_model'] = row['fit'].df_model
-        row['prediction'] = row['fit'].get_prediction()
 
     for row in fits:
         # does this model have tide included
@@ -23,7 +24,9 @@ def fits_to_fits_df(fits):
 
     # add exogenuous table, this column will be added later (dataframe in dataframe should be added as a column)
     exogs = []
-    # add prediction with mean wind and tide
+    # the additive components (trend, nodal, wind, ...) of each fit, these are cached with the fit
+    components = []
+    # add prediction as is, with mean wind and/or tide (all variants from the covariance matrix at once)
     for row in fits:
         # lookup the values that were used for this prediction
         exog_df = pd.DataFrame(
@@ -31,29 +34,15 @@ def fits_to_fits_df(fits):
             columns=row['names']
         )
         exogs.append(exog_df)
+        components.append(slr.models.decompose_fit(row['fit'], row['names']).frame())
 
-        if row['has_tide']:
-            exog_mean_tide_df = exog_df.copy()
-            exog_mean_tide_df['Nodal U'] = exog_mean_tide_df['Nodal U'].mean()
-            exog_mean_tide_df['Nodal V'] = exog_mean_tide_df['Nodal V'].mean()
-            row['prediction_mean_tide'] = row['fit'].get_prediction(exog=exog_mean_tide_df)
-        if row['has_wind']:
-            exog_mean_wind_df = exog_df.copy()
-            exog_mean_wind_df['Wind $u^2$'] = exog_mean_wind_df['Wind $u^2$'].mean()
-            exog_mean_wind_df['Wind $v^2$'] = exog_mean_wind_df['Wind $v^2$'].mean()
-            row['prediction_mean_wind'] = row['fit'].get_prediction(exog=exog_mean_wind_df)
-        if row['has_wind'] and row['has_tide']:
-            # set both wind and tide to mean/0
-            exog_mean_tide_mean_wind_df = exog_df.copy()
-            exog_mean_tide_mean_wind_df['Nodal U'] = 0
-            exog_mean_tide_mean_wind_df['Nodal V'] = 0
-            exog_mean_tide_mean_wind_df['Wind $u^2$'] = exog_mean_tide_mean_wind_df['Wind $u^2$'].mean()
-            exog_mean_tide_mean_wind_df['Wind $v^2$'] = exog_mean_tide_mean_wind_df['Wind $v^2$'].mean()
-            row['prediction_mean_tide_mean_wind'] = row['fit'].get_prediction(exog=exog_mean_tide_mean_wind_df)
+        predictions = slr.models.predict_variants(row['fit'], row['names'])
+        row.update(predictions)
 
 
     fits_df = pd.DataFrame(fits)
     fits_df['exog'] = exogs
+    fits_df['components'] = components
 
     return fits_df
 
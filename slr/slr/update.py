@@ -0,0 +1,179 @@
+"""Incremental updates of the psmsl archives, only changed archives are downloaded and only
+changed stations are parsed again."""
+import json
+import os
+import pathlib
+import re
+import zipfile
+
+import pandas as pd
+import requests
+
+import slr.archive
+import slr.cache
+import slr.psmsl
+
+
+def _state_path(path, cache_dir=None):
+    """the file with the http validators (etag, last-modified) of a downloaded file"""
+    directory = slr.cache.get_cache_dir(cache_dir) / "http"
+    directory.mkdir(exist_ok=True)
+    return directory / f"{pathlib.Path(path).name}.json"
+
+
+def _validators(response):
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def download_archive(url, path, chunk_size=2**20, timeout=60, cache_dir=None):
+    """Download url to path if it changed since the last download.
+
+    The request is conditional on the ETag and Last-Modified of the last download (a 304 response
+    means there is nothing to do). The response is streamed to path.partial, an interrupted
+    download is resumed with a range request if the file did not change on the server in between.
+    path is replaced once the download is complete. Returns "not_modified" or "downloaded".
+    """
+    path = pathlib.Path(path)
+    partial_path = path.with_name(path.name + ".partial")
+    state_path = _state_path(path, cache_dir=cache_dir)
+    state = json.loads(state_path.read_text()) if state_path.exists() else {}
+
+    headers = {}
+    complete = state.get("complete")
+    if complete and path.exists():
+        if complete["etag"]:
+            headers["If-None-Match"] = complete["etag"]
+        if complete["last_modified"]:
+            headers["If-Modified-Since"] = complete["last_modified"]
+    partial = state.get("partial")
+    if partial and partial_path.exists():
+        validator = partial["etag"] or partial["last_modified"]
+        if validator:
+            headers["Range"] = f"bytes={partial_path.stat().st_size}-"
+            headers["If-Range"] = validator
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return "not_modified"
+        response.raise_for_status()
+        # the server ignores the range if the file changed, then start over
+        mode = "ab" if response.status_code == 206 else "wb"
+        state["partial"] = _validators(response)
+        slr.cache.write_atomic(state_path, json.dumps(state).encode())
+        with open(partial_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+    os.replace(partial_path, path)
+    state["complete"] = state.pop("partial")
+    slr.cache.write_atomic(state_path, json.dumps(state).encode())
+    return "downloaded"
+
+
+def central_directory(path):
+    """the crc32 and size of each member of a zip file, only the central directory is read"""
+    with zipfile.ZipFile(path) as zf:
+        return {info.filename: (info.CRC, info.file_size) for info in zf.infolist()}
+
+
+def diff_members(old, new):
+    """the changed (or added) and removed members of two central directories"""
+    changed = sorted(name for name, entry in new.items() if old.get(name) != entry)
+    removed = sorted(name for name in old if name not in new)
+    return changed, removed
+
+
+def station_ids(names, dataset_name):
+    """the station ids of the data members in a list of member names"""
+    pattern = re.compile(rf"{dataset_name}/data/(\d+)\.(rlrdata|metdata)$")
+    matches = (pattern.match(name) for name in names)
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+def update_psmsl_table(
+    dataset_name, old_table=None, old_members=None, jobs=1, cache_dir=None
+):
+    """Cache the table of a new release of a local archive, from the table of the previous release.
+
+    Only the stations whose member changed (crc32 or size) are parsed, removed stations are dropped.
+    Without a previous table (or its central directory) the whole archive is parsed.
+    Returns the ids of the changed, removed and failed stations. A table with stations that
+    could not be parsed is not cached (see get_psmsl_table).
+    """
+    zip_path = slr.psmsl.get_psmsl_urls(local=True)[dataset_name]
+    path = slr.psmsl.psmsl_table_path(dataset_name, cache_dir=cache_dir)
+    new_members = central_directory(zip_path)
+    if old_table is None or old_members is None:
+        old_table, old_members = None, {}
+    changed, removed = diff_members(old_members, new_members)
+    changed = station_ids(changed, dataset_name)
+    removed = station_ids(removed, dataset_name)
+    if path.exists():
+        return {"changed": changed, "removed": removed, "failed": []}
+
+    with slr.archive.MappedArchive(zip_path) as zf:
+        if old_table is None:
+            table = slr.psmsl.read_archive_table(zf, dataset_name, jobs=jobs)
+        else:
+            tables = [old_table[~old_table["station"].isin(changed + removed)]]
+            failed = {}
+            if changed:
+                tables.append(
+                    slr.psmsl.read_archive_table(
+                        zf, dataset_name, stations=changed, jobs=jobs
+                    )
+                )
+                failed = tables[-1].attrs["failed"]
+            table = pd.concat(tables, ignore_index=True)
+            # categories differ per release, recompute them for the whole archive
+            table["interpolated"] = (
+                table["interpolated"].astype(str).astype("category")
+            )
+            table = table.sort_values(["station", "t"], kind="stable", ignore_index=True)
+            table.attrs["failed"] = failed
+    failed = sorted(table.attrs["failed"])
+    if not failed:
+        slr.psmsl.write_psmsl_table(table, path)
+    return {"changed": changed, "removed": removed, "failed": failed}
+
+
+def update_psmsl(dataset_names=None, urls=None, jobs=1, cache_dir=None):
+    """Download the psmsl archives that changed to data/psmsl and update the cached tables.
+
+    urls defaults to the psmsl website (see get_psmsl_urls).
+    Returns per dataset the status (downloaded or not_modified) and the changed, removed and
+    failed station ids.
+    """
+    local_paths = slr.psmsl.get_psmsl_urls(local=True)
+    urls = urls or slr.psmsl.get_psmsl_urls(local=False)
+    summary = {}
+    for dataset_name in dataset_names or list(local_paths):
+        zip_path = local_paths[dataset_name]
+        zip_path.parent.mkdir(parents=True, exist_ok=True)
+        old_members = old_table_path = None
+        if zip_path.exists():
+            old_members = central_directory(zip_path)
+            old_table_path = slr.psmsl.psmsl_table_path(
+                dataset_name, cache_dir=cache_dir
+            )
+
+        status = download_archive(urls[dataset_name], zip_path, cache_dir=cache_dir)
+        result = {"status": status, "changed": [], "removed": [], "failed": []}
+        if status == "downloaded":
+            old_table = None
+            if old_table_path is not None and old_table_path.exists():
+                old_table = pd.read_parquet(old_table_path)
+            result.update(
+                update_psmsl_table(
+                    dataset_name,
+                    old_table=old_table,
+                    old_members=old_members,
+                    jobs=jobs,
+                    cache_dir=cache_dir,
+                )
+            )
+        summary[dataset_name] = result
+    return summary
@@ -1,5 +1,7 @@
 import datetime
 
+import numpy as np
+
 
 def datetime2year(dt):
     """compute year fraction from datetime"""
@@ -8,3 +10,25 @@ def datetime2year(dt):
         year=dt.year + 1, month=1, day=1
     ) - datetime.datetime(year=dt.year, month=1, day=1)
     return dt.year + year_part / year_length
+
+
+def date2year(dates):
+    """compute year fraction from an array of dates, vectorized version of datetime2year"""
+    t = np.asarray(dates, dtype="datetime64[ns]")
+    years = t.astype("datetime64[Y]")
+    year_start = years.astype(t.dtype)
+    year_length = (years + np.timedelta64(1, "Y")).astype(t.dtype) - year_start
+    year = years.astype("int64") + 1970
+    return year + (t - year_start) / year_length
+
+
+def group_slices(index, level):
+    """return a slice (row range) per value of a level of a multi index, the rows of a value should be contiguous"""
+    codes = index.codes[index.names.index(level)]
+    levels = index.levels[index.names.index(level)]
+    # first row of each block of values
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    stops = np.r_[starts[1:], len(codes)]
+    return {
+        levels[codes[start]]: slice(start, stop) for start, stop in zip(starts, stops)
+    }
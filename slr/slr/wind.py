@@ -1,9 +1,15 @@
+import collections
+import concurrent.futures
 import datetime
+import functools
+import glob
 import pathlib
+import warnings
 
 import netCDF4
 import numpy as np
 import pandas as pd
+import scipy.stats
 
 import windrose
 import cmocean
@@ -11,84 +17,232 @@ import matplotlib.colors
 import matplotlib.pyplot as plt
 
 import slr
+import slr.cache
+import slr.grid
+import slr.gtsm
+import slr.models
 import slr.utils
 
 
-def make_wind_df(lat_i=53, lon_i=3, product="NCEP1", local=True):
-    """create a dataset for wind, for 1 latitude/longitude"""
-
-    src_dir = slr.get_src_dir()
-    if product == "NCEP1":
+# Reanalysis products with their files (relative to the source directory, glob patterns
+# for products in several files), optional urls, variable and coordinate names and the
+# frequency. Products that are not monthly are reduced to monthly means while reading.
+# time_units and calendar override the attributes of the time variable. downloads are the
+# urls of the files (see slr fetch), the urls are read remotely (opendap). Use
+# register_reanalysis to add a product.
+REANALYSIS_PRODUCTS = {
+    "NCEP1": {
+        "files": {
+            "u": "data/noaa/uwnd.10m.mon.mean.nc",
+            "v": "data/noaa/vwnd.10m.mon.mean.nc",
+        },
         # the following url's are not available during a government shutdown
-        u_file = "https://www.esrl.noaa.gov/psd/thredds/dodsC/Datasets/ncep.reanalysis.derived/surface_gauss/uwnd.10m.mon.mean.nc"
-        v_file = "https://www.esrl.noaa.gov/psd/thredds/dodsC/Datasets/ncep.reanalysis.derived/surface_gauss/vwnd.10m.mon.mean.nc"
-
-        if local:
-            u_file = pathlib.Path(
-                src_dir / "data/noaa/uwnd.10m.mon.mean.nc"
-            ).expanduser()
-            v_file = pathlib.Path(
-                src_dir / "data/noaa/vwnd.10m.mon.mean.nc"
-            ).expanduser()
-
-    elif product == "20CR":
-        if local:
-            u_file = pathlib.Path(
-                src_dir / "data/noaa/20cr.uwnd.10m.mon.mean.nc"
-            ).expanduser()
-            v_file = pathlib.Path(
-                src_dir / "data/noaa/20cr.vwnd.10m.mon.mean.nc"
-            ).expanduser()
+        "urls": {
+            "u": "https://www.esrl.noaa.gov/psd/thredds/dodsC/Datasets/ncep.reanalysis.derived/surface_gauss/uwnd.10m.mon.mean.nc",
+            "v": "https://www.esrl.noaa.gov/psd/thredds/dodsC/Datasets/ncep.reanalysis.derived/surface_gauss/vwnd.10m.mon.mean.nc",
+        },
+        "downloads": {
+            "u": "https://psl.noaa.gov/thredds/fileServer/Datasets/ncep.reanalysis.derived/surface_gauss/uwnd.10m.mon.mean.nc",
+            "v": "https://psl.noaa.gov/thredds/fileServer/Datasets/ncep.reanalysis.derived/surface_gauss/vwnd.10m.mon.mean.nc",
+        },
+        "variables": {"u": "uwnd", "v": "vwnd"},
+    },
+    # 20th century reanalysis V3 (see data/noaa/Makefile)
+    "20CR": {
+        "files": {
+            "u": "data/noaa/20cr.uwnd.10m.mon.mean.nc",
+            "v": "data/noaa/20cr.vwnd.10m.mon.mean.nc",
+        },
+        "downloads": {
+            "u": "https://psl.noaa.gov/thredds/fileServer/Datasets/20thC_ReanV3/Monthlies/10mSI-MO/uwnd.10m.mon.mean.nc",
+            "v": "https://psl.noaa.gov/thredds/fileServer/Datasets/20thC_ReanV3/Monthlies/10mSI-MO/vwnd.10m.mon.mean.nc",
+        },
+        "variables": {"u": "uwnd", "v": "vwnd"},
+    },
+    # hourly 10m wind from the Copernicus climate data store, one or more files with u10 and v10
+    "ERA5": {
+        "files": {"u": "data/ecmwf/era5/*.nc", "v": "data/ecmwf/era5/*.nc"},
+        "variables": {"u": "u10", "v": "v10"},
+        "lat": "latitude",
+        "lon": "longitude",
+        "frequency": "hourly",
+    },
+}
+
+REANALYSIS_DEFAULTS = {
+    "urls": {},
+    "downloads": {},
+    "lat": "lat",
+    "lon": "lon",
+    "time": "time",
+    "time_units": None,
+    "calendar": None,
+    "frequency": "monthly",
+}
+
+
+def register_reanalysis(product, **spec):
+    """add a reanalysis product, see REANALYSIS_PRODUCTS for the keys"""
+    missing = {"files", "variables"} - set(spec)
+    if missing:
+        raise ValueError(f"reanalysis product {product} needs {sorted(missing)}")
+    REANALYSIS_PRODUCTS[product] = spec
+
+
+def get_reanalysis_spec(product):
+    """the specification of a reanalysis product, with defaults"""
+    if product not in REANALYSIS_PRODUCTS:
+        raise ValueError(f"Reanalysis product not available: {product}")
+    return {**REANALYSIS_DEFAULTS, **REANALYSIS_PRODUCTS[product]}
+
+
+def get_wind_files(product="NCEP1", local=True):
+    """get the lists of u and v files (or urls) of a reanalysis product"""
+
+    spec = get_reanalysis_spec(product)
+    src_dir = slr.get_src_dir()
+    files = []
+    for component in ["u", "v"]:
+        if not local:
+            if component not in spec["urls"]:
+                raise ValueError(
+                    f"The reanalysis product {product} first needs to be downloaded"
+                )
+            files.append([spec["urls"][component]])
+            continue
+        pattern = spec["files"][component]
+        if glob.has_magic(pattern):
+            paths = sorted(src_dir.glob(pattern))
+            if not paths:
+                raise FileNotFoundError(
+                    f"No files for reanalysis product {product}: {pattern}"
+                )
         else:
-            print(
-                f"ERROR: The reanalysis product {product} first needs to be downloaded"
-            )
+            paths = [pathlib.Path(src_dir / pattern).expanduser()]
+        files.append(paths)
+    return tuple(files)
 
-    else:
-        print(f"Reanalysis product not available: {product}")
 
-    # open the 2 files
-    ds_u = netCDF4.Dataset(u_file)
-    ds_v = netCDF4.Dataset(v_file)
+def _modification_time(path):
+    """modification time of a local file, None for urls"""
+    if isinstance(path, pathlib.Path):
+        return path.stat().st_mtime_ns
+    return None
 
-    # read lat,lon, time from 1 dataset
-    lat, lon, time = (
-        ds_u.variables["lat"][:],
-        ds_u.variables["lon"][:],
-        ds_u.variables["time"][:],
+
+def _read_times(ds, spec):
+    """read the times of a dataset as datetimes"""
+    return slr.grid.read_times(
+        ds.variables[spec["time"]], units=spec["time_units"], calendar=spec["calendar"]
     )
 
+
+# increase this if the computation of the wind products changes
+WIND_PRODUCTS_VERSION = 2
+# number of computed wind products (per location) that are kept in memory
+WIND_PRODUCTS_MEMORY_SIZE = 8
+_wind_products_memory = collections.OrderedDict()
+
+
+@functools.lru_cache(maxsize=8)
+def _open_wind_grid(product, u_file, v_file, mtimes=None):
+    """read the coordinates of the (first) u and v files once, mtimes rereads changed files.
+    The files are closed again, the variables are opened per read (see read_grid_points)."""
+
+    spec = get_reanalysis_spec(product)
+    # read lat,lon, time from 1 dataset
+    with netCDF4.Dataset(u_file) as ds_u:
+        lat, lon = ds_u.variables[spec["lat"]][:], ds_u.variables[spec["lon"]][:]
+        t = _read_times(ds_u, spec)
+
     # check with the others
-    lat_v, lon_v, time_v = (
-        ds_v.variables["lat"][:],
-        ds_v.variables["lon"][:],
-        ds_v.variables["time"][:],
-    )
-    assert (lat == lat_v).all() and (lon == lon_v).all() and (time == time_v).all()
-
-    # convert to datetime
-    # Now defaults to return cftime dates https://github.com/Unidata/cftime/issues/136
-    # cftime dates are not recognized by pandas
-    # in cftime < 1.2.1 there is a bug that this flag doesn't not function properly
-    t = netCDF4.num2date(
-        time, ds_u.variables["time"].units, only_use_cftime_datetimes=False
-    )
+    with netCDF4.Dataset(v_file) as ds_v:
+        lat_v, lon_v = ds_v.variables[spec["lat"]][:], ds_v.variables[spec["lon"]][:]
+        t_v = _read_times(ds_v, spec)
+    assert (lat == lat_v).all() and (lon == lon_v).all() and t.equals(t_v)
+
+    return {
+        "files": {"u": u_file, "v": v_file},
+        "variables": spec["variables"],
+        "lat": np.asarray(lat),
+        "lon": np.asarray(lon),
+        "t": t,
+        "index": slr.grid.get_grid_index(lat, lon),
+    }
+
+
+def get_wind_grid(product="NCEP1", local=True):
+    """the (cached) files, coordinates and grid index of a reanalysis product.
+    For products in several files these are the files and times of the first file."""
+    u_files, v_files = get_wind_files(product=product, local=local)
+    mtimes = (_modification_time(u_files[0]), _modification_time(v_files[0]))
+    return _open_wind_grid(product, u_files[0], v_files[0], mtimes)
+
+
+def read_grid_points(grid, component, indices, **kwargs):
+    """read the u or v of grid points of a wind grid (see slr.grid.read_points), the file
+    is only open during the read"""
+    with netCDF4.Dataset(grid["files"][component]) as ds:
+        variable = ds.variables[grid["variables"][component]]
+        return slr.grid.read_points(variable, indices, **kwargs)
+
+
+def read_monthly_points(product, indices, local=True, time_chunk=24 * 31):
+    """Read the monthly u and v of grid points (indices from the grid index) of a product.
+
+    Monthly products in one file are read at once. Other products are read file by file in
+    chunks of time_chunk time steps and reduced to monthly means on the fly, so memory depends
+    on the chunk size and the number of months times the number of points (see
+    slr.grid.read_points), not on the length of the series or the size of the grid.
+    Returns the times (start of the months) and u and v with shape (time, points).
+    """
+    spec = get_reanalysis_spec(product)
+    u_files, v_files = get_wind_files(product=product, local=local)
+    if spec["frequency"] == "monthly" and len(u_files) == 1 and len(v_files) == 1:
+        grid = get_wind_grid(product=product, local=local)
+        u = read_grid_points(grid, "u", indices)
+        v = read_grid_points(grid, "v", indices)
+        return grid["t"], u, v
+
+    sums, counts = {"u": {}, "v": {}}, {"u": {}, "v": {}}
+    for component, files in [("u", u_files), ("v", v_files)]:
+        for path in files:
+            with netCDF4.Dataset(path) as ds:
+                t = _read_times(ds, spec)
+                variable = ds.variables[spec["variables"][component]]
+                for start in range(0, len(t), time_chunk):
+                    stop = min(start + time_chunk, len(t))
+                    values = slr.grid.read_points(
+                        variable, indices, start=start, stop=stop
+                    )
+                    slr.grid.monthly_means(
+                        t[start:stop], values, sums[component], counts[component]
+                    )
+    # u and v are returned on the same months
+    months = sorted(sums["u"])
+    if months != sorted(sums["v"]):
+        raise ValueError(f"The u and v files of {product} do not cover the same months")
+    with np.errstate(invalid="ignore"):
+        u, v = (
+            np.array([sums[component][m] / counts[component][m] for m in months])
+            for component in ["u", "v"]
+        )
+    t = pd.DatetimeIndex(np.array(months, dtype="datetime64[ns]"), name="t")
+    return t, u, v
 
-    def find_closest(lat, lon, lat_i=lat_i, lon_i=lon_i):
-        """lookup the index of the closest lat/lon"""
-        Lon, Lat = np.meshgrid(lon, lat)
-        idx = np.argmin(((Lat - lat_i) ** 2 + (Lon - lon_i) ** 2))
-        Lat.ravel()[idx], Lon.ravel()[idx]
-        [i, j] = np.unravel_index(idx, Lat.shape)
-        return i, j
 
-    # this is the index where we want our data
-    i, j = find_closest(lat, lon)
+def make_wind_df(lat_i=53, lon_i=3, product="NCEP1", local=True):
+    """create a dataset for wind, for 1 latitude/longitude"""
+
+    grid = get_wind_grid(product=product, local=local)
+
+    # this is the index where we want our data (nearest on the sphere)
+    (i, j), _ = grid["index"].query(lat_i, lon_i)
 
     # get the u, v variables
-    print("found point", lat[i], lon[j])
-    u = ds_u.variables["uwnd"][:, i, j]
-    v = ds_v.variables["vwnd"][:, i, j]
+    print("found point", grid["lat"][i[0]], grid["lon"][j[0]])
+    t, u, v = read_monthly_points(product, (i, j), local=local)
+    u, v = u[:, 0], v[:, 0]
 
     # compute derived quantities
     speed = np.sqrt(u**2 + v**2)
@@ -105,6 +259,55 @@ def make_wind_df(lat_i=53, lon_i=3, product="NCEP1", local=True):
     return wind_df
 
 
+def make_points_wind_df(points, product="NCEP1", local=True):
+    """Create a wind dataset for many points at once, indexed by (station, t).
+
+    points is a data frame with lat and lon columns, indexed by station (or for example by
+    station and point for several coastal points per station). All points are looked up in
+    the grid index and read in one pass (see read_monthly_points).
+    """
+    grid = get_wind_grid(product=product, local=local)
+    indices, _ = grid["index"].query(
+        points["lat"].to_numpy(dtype="float64"), points["lon"].to_numpy(dtype="float64")
+    )
+    # shape (t, points), stored per point
+    t, u, v = read_monthly_points(product, indices, local=local)
+    u, v = u.T.ravel(), v.T.ravel()
+
+    levels = [
+        points.index.get_level_values(level).repeat(len(t))
+        for level in range(points.index.nlevels)
+    ]
+    index = pd.MultiIndex.from_arrays(
+        levels + [np.tile(t, len(points))],
+        names=[name or "station" for name in points.index.names] + ["t"],
+    )
+    wind_df = pd.DataFrame(
+        data=dict(
+            u=u,
+            v=v,
+            speed=np.sqrt(u**2 + v**2),
+            direction=np.mod(np.angle(u + v * 1j), 2 * np.pi),
+        ),
+        index=index,
+    )
+    wind_df["year"] = wind_df.index.get_level_values("t").year
+    return wind_df
+
+
+def apply_per_point(function, *long_dfs):
+    """apply a function for wind datasets indexed by t to each point of long (station, t) datasets"""
+    levels = [name for name in long_dfs[0].index.names if name != "t"]
+    level = levels[0] if len(levels) == 1 else levels
+    groups = [dict(iter(df.groupby(level=level, sort=False))) for df in long_dfs]
+    results = {}
+    for key, group in groups[0].items():
+        dfs = [group] + [other[key] for other in groups[1:]]
+        dfs = [df.droplevel(levels) for df in dfs]
+        results[key] = function(*dfs)
+    return pd.concat(results, names=levels)
+
+
 def make_annual_wind_df(monthly_wind_df):
     """Compute annual averaged wind dataset from monthly wind dataset"""
 
@@ -139,121 +342,654 @@ def combine_linear_scaling(df1, df2):
     return combined_df
 
 
-def add_u2v2(wind_df):
-    """compute and add the u2 and v2 (signed squared wind)"""
+def _nanstd(values, axis=0):
+    """standard deviation (ddof=1, as pandas) ignoring missing values"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanstd(values, axis=axis, ddof=1)
+
+
+def _nanmean(values, axis=0):
+    """mean ignoring missing values, nan if there are none"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(values, axis=axis)
+
+
+def blend_wind_products(products, per_month=False, coefficients=None, keep=("year",)):
+    """Blend wind products (data frames indexed by t) in priority order.
+
+    The first product is the reference. Each next product is scaled to the blend so far
+    (mean and standard deviation matching over the overlap, per column and with per_month per
+    calendar month) and fills the times before and after the blend so far, as in
+    combine_linear_scaling for two products. The columns in keep are not scaled.
+    All products are aligned once on the union of their times.
+    Long (station, t) frames are blended for all points at once, each column of each point is
+    scaled separately (as blending the points one by one).
+    coefficients (as returned) can be passed to apply the same scaling to other data, for
+    example from the cache. Returns the blended frame and a table of the coefficients and
+    overlap diagnostics (number of overlapping values, correlation and rmse before and after
+    scaling) per product, column (and point) and month (0 without per_month).
+    """
+    names = list(products)
+    first = products[names[0]]
+    levels = [name for name in first.index.names if name != "t"]
+    frames = []
+    for name in names:
+        frame = products[name]
+        if levels:
+            # one column per column and point
+            frame = frame.unstack(levels)
+            frame.columns = frame.columns.set_names(["column", *levels])
+        frames.append(frame)
+    index = frames[0].index
+    for frame in frames[1:]:
+        index = index.union(frame.index)
+    columns = frames[0].columns[
+        [all(column in f for f in frames) for column in frames[0].columns]
+    ]
+    scaled_columns = ~columns.get_level_values(0).isin(keep)
+    arrays = [
+        frame.reindex(index)[columns].to_numpy(dtype="float64") for frame in frames
+    ]
+    t = index.to_numpy()
+    months = index.month.to_numpy() if per_month else np.zeros(len(index), dtype=int)
+
+    result = arrays[0].copy()
+    present = index.isin(frames[0].index)
+    start, end = frames[0].index[0], frames[0].index[-1]
+    rows = []
+    for name, frame, values in zip(names[1:], frames[1:], arrays[1:]):
+        window = (t >= max(start, frame.index[0])) & (t <= min(end, frame.index[-1]))
+        # mean and standard deviation per month (rows) and column
+        fitted = {}
+        for month in np.unique(months):
+            selected = window & (months == month)
+            if coefficients is None:
+                fitted[month] = {
+                    "mean": _nanmean(values[selected]),
+                    "std": _nanstd(values[selected]),
+                    "reference_mean": _nanmean(result[selected]),
+                    "reference_std": _nanstd(result[selected]),
+                }
+            else:
+                fitted[month] = {
+                    key: coefficients.loc[name].xs(month, level="month")
+                    .reindex(columns)[key]
+                    .to_numpy()
+                    for key in ["mean", "std", "reference_mean", "reference_std"]
+                }
+        month_index = np.searchsorted(np.unique(months), months)
+        stacked = {
+            key: np.stack([fitted[month][key] for month in np.unique(months)])[
+                month_index
+            ]
+            for key in ["mean", "std", "reference_mean", "reference_std"]
+        }
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scaled = (values - stacked["mean"]) * (
+                stacked["reference_std"] / stacked["std"]
+            ) + stacked["reference_mean"]
+        scaled[:, ~scaled_columns] = values[:, ~scaled_columns]
+
+        # overlap diagnostics
+        for month in np.unique(months):
+            selected = window & (months == month)
+            for k, column in enumerate(columns):
+                x, y, z = values[selected, k], result[selected, k], scaled[selected, k]
+                both = ~np.isnan(x) & ~np.isnan(y)
+                row = {
+                    "product": name,
+                    **dict(zip(["column", *levels], column if levels else [column])),
+                    "month": month,
+                    **{key: fitted[month][key][k] for key in fitted[month]},
+                    "n_overlap": both.sum(),
+                    "correlation": np.nan,
+                    "rmse": np.nan,
+                    "rmse_scaled": np.nan,
+                }
+                if both.sum() > 1:
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        row["correlation"] = np.corrcoef(x[both], y[both])[0, 1]
+                    row["rmse"] = np.sqrt(np.mean((x[both] - y[both]) ** 2))
+                    row["rmse_scaled"] = np.sqrt(np.mean((z[both] - y[both]) ** 2))
+                rows.append(row)
+
+        # fill the times before and after the blend so far
+        outside = ((t < start) | (t > end)) & index.isin(frame.index)
+        result[outside] = scaled[outside]
+        present |= outside
+        start, end = min(start, frame.index[0]), max(end, frame.index[-1])
+
+    blended = pd.DataFrame(result[present], index=index[present], columns=columns)
+    if levels:
+        blended = blended.stack(levels, dropna=False)
+        blended = blended.reorder_levels([*levels, "t"]).sort_index()
+        blended = blended[[column for column in first.columns if column in blended]]
+        blended.columns.name = None
+    for column in keep:
+        if column in blended:
+            blended[column] = blended[column].astype(first[column].dtype)
+    if coefficients is None:
+        coefficients = pd.DataFrame(
+            rows,
+            columns=[
+                "product",
+                "column",
+                *levels,
+                "month",
+                "mean",
+                "std",
+                "reference_mean",
+                "reference_std",
+                "n_overlap",
+                "correlation",
+                "rmse",
+                "rmse_scaled",
+            ],
+        ).set_index(["product", "column", *levels, "month"])
+    return blended, coefficients
+
 
-    # we now switched to the signed mean (sometimes the wind comes from the north/east)
-    wind_df["u2"] = wind_df["u"] ** 2 * np.sign(wind_df["u"])
-    wind_df["v2"] = wind_df["v"] ** 2 * np.sign(wind_df["v"])
-    wind_df["u2"].fillna(wind_df["u2"].mean(), inplace=True)
-    wind_df["v2"].fillna(wind_df["v2"].mean(), inplace=True)
+def add_u2v2(wind_df):
+    """compute and add the u2 and v2 (signed squared wind).
+    Missing values are filled with the mean, per point for long (station, t) datasets."""
+
+    # the levels of the points, if any
+    levels = [name for name in wind_df.index.names if name not in ("t", None)]
+    for component in ["u", "v"]:
+        # we now switched to the signed mean (sometimes the wind comes from the north/east)
+        squared = wind_df[component] ** 2 * np.sign(wind_df[component])
+        if levels:
+            mean = squared.groupby(level=levels, sort=False).transform("mean")
+        else:
+            mean = squared.mean()
+        wind_df[f"{component}2"] = squared.fillna(mean)
 
     return wind_df
 
 
+# the North Sea / European window of the wind fields (lat_min, lat_max, lon_min, lon_max)
+EUROPE_WINDOW = (40, 70, -20, 30)
+WIND_FIELD_VARIABLES = ["u", "v", "u2", "v2", "speed"]
+
+
+def _annual_wind_field_chunk(task):
+    """annual means of the wind in a window for a chunk of whole years"""
+    files, variables, rows, columns, column_order, start, stop, year_index, n_years = task
+    fields = {}
+    for name in ["u", "v"]:
+        path, variable = files[name], variables[name]
+        with netCDF4.Dataset(path) as ds:
+            block = ds.variables[variable][start:stop, rows, columns]
+        block = np.ma.filled(np.ma.asarray(block, dtype="float64"), np.nan)
+        fields[name] = block[:, :, column_order]
+    # signed squared wind (see add_u2v2)
+    fields["u2"] = fields["u"] ** 2 * np.sign(fields["u"])
+    fields["v2"] = fields["v"] ** 2 * np.sign(fields["v"])
+
+    annual = {}
+    for name, field in fields.items():
+        valid = ~np.isnan(field)
+        shape = (n_years,) + field.shape[1:]
+        sums = np.zeros(shape)
+        counts = np.zeros(shape)
+        np.add.at(sums, year_index, np.where(valid, field, 0))
+        np.add.at(counts, year_index, valid)
+        with np.errstate(invalid="ignore"):
+            annual[name] = sums / counts
+    # speed of the mean wind (see make_annual_wind_df)
+    annual["speed"] = np.sqrt(annual["u"] ** 2 + annual["v"] ** 2)
+    return annual
+
+
+def linear_trends(year, field):
+    """Linear trend (per year) of a field (year, ...) in each cell, with standard error and p-value.
+
+    Missing values are left out per cell, cells with less than 3 years are nan.
+    """
+    valid = ~np.isnan(field)
+    x = np.where(valid, np.reshape(year, (-1,) + (1,) * (field.ndim - 1)), 0.0)
+    y = np.where(valid, field, 0.0)
+    n = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = x.sum(axis=0) / n
+        y_mean = y.sum(axis=0) / n
+        dx = np.where(valid, x - x_mean, 0.0)
+        dy = np.where(valid, y - y_mean, 0.0)
+        sxx = (dx**2).sum(axis=0)
+        trend = (dx * dy).sum(axis=0) / sxx
+        resid = dy - trend * dx
+        df_resid = n - 2
+        se = np.sqrt((resid**2).sum(axis=0) / df_resid / sxx)
+        p_value = 2 * scipy.stats.t.sf(np.abs(trend / se), df_resid)
+    few = n < 3
+    trend[few], se[few], p_value[few] = np.nan, np.nan, np.nan
+    return trend, se, p_value
+
+
+def compute_wind_field(
+    product="NCEP1",
+    window=EUROPE_WINDOW,
+    start_year=None,
+    end_year=None,
+    years_per_chunk=10,
+    jobs=None,
+    path=None,
+    local=True,
+):
+    """Compute the annual mean wind and its linear trends for every grid cell in a window.
+
+    The window is (lat_min, lat_max, lon_min, lon_max), longitudes in -180..180 or 0..360
+    (whatever the convention of the grid), from the west to the east edge. The longitudes of
+    the result are those of the grid, west to east. A ValueError is raised if the window or
+    the years contain no data.
+    The fields are read in chunks of years_per_chunk years (only the window), chunks are
+    processed by jobs worker processes (all cores by default). Returns a dict with the
+    coordinates (year, lat, lon), the annual means of u, v, u2, v2 and speed and for each of
+    these the trend (per year), the standard error and the p-value of the trend (OLS).
+    If path is given the result is written to a NetCDF file.
+    """
+    spec = get_reanalysis_spec(product)
+    u_files, v_files = get_wind_files(product=product, local=local)
+    if spec["frequency"] != "monthly" or len(u_files) != 1 or len(v_files) != 1:
+        raise ValueError(
+            f"compute_wind_field needs a monthly product in one file: {product}"
+        )
+    grid = get_wind_grid(product=product, local=local)
+    lat_min, lat_max, lon_min, lon_max = window
+    lat, lon = grid["lat"], grid["lon"]
+    rows = np.flatnonzero((lat >= lat_min) & (lat <= lat_max))
+    # degrees east of the west edge of the window, this works for both conventions of the
+    # grid and the window and for windows across the 0 meridian or the date line
+    east = np.mod(lon - lon_min, 360)
+    width = lon_max - lon_min
+    if width < 360:
+        width = np.mod(width, 360)
+    columns = np.flatnonzero(east <= width)
+    if not len(rows) or not len(columns):
+        raise ValueError(f"No grid cells of {product} in the window {window}")
+    # the output is sorted west to east, from the west edge of the window
+    column_order = np.argsort(east[columns], kind="stable")
+
+    t_year = grid["t"].year.to_numpy()
+    selected = np.ones(len(t_year), dtype=bool)
+    if start_year is not None:
+        selected &= t_year >= start_year
+    if end_year is not None:
+        selected &= t_year <= end_year
+    time_index = np.flatnonzero(selected)
+    years = np.unique(t_year[time_index])
+    if not len(years):
+        raise ValueError(f"No years of {product} from {start_year} to {end_year}")
+
+    tasks = []
+    for first in range(0, len(years), years_per_chunk):
+        chunk_years = years[first : first + years_per_chunk]
+        chunk = time_index[np.isin(t_year[time_index], chunk_years)]
+        start, stop = chunk[0], chunk[-1] + 1
+        year_index = np.searchsorted(chunk_years, t_year[start:stop])
+        tasks.append(
+            (
+                {"u": str(u_files[0]), "v": str(v_files[0])},
+                spec["variables"],
+                rows,
+                columns,
+                column_order,
+                start,
+                stop,
+                year_index,
+                len(chunk_years),
+            )
+        )
+
+    if jobs == 1 or len(tasks) == 1:
+        chunks = list(map(_annual_wind_field_chunk, tasks))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunks = list(executor.map(_annual_wind_field_chunk, tasks))
+
+    field = {"year": years, "lat": lat[rows], "lon": lon[columns][column_order]}
+    for name in WIND_FIELD_VARIABLES:
+        annual = np.concatenate([chunk[name] for chunk in chunks])
+        trend, se, p_value = linear_trends(years, annual)
+        field[name] = annual
+        field[f"{name}_trend"] = trend
+        field[f"{name}_trend_se"] = se
+        field[f"{name}_trend_p_value"] = p_value
+
+    if path is not None:
+        write_wind_field(field, path, product=product)
+    return field
+
+
+def write_wind_field(field, path, product=""):
+    """write the result of compute_wind_field to a NetCDF file"""
+    units = {"u": "m/s", "v": "m/s", "speed": "m/s", "u2": "m2/s2", "v2": "m2/s2"}
+    with netCDF4.Dataset(path, "w") as ds:
+        ds.title = f"Annual mean wind and linear trends ({product})"
+        for name in ["year", "lat", "lon"]:
+            ds.createDimension(name, len(field[name]))
+            ds.createVariable(name, "f8", (name,))[:] = field[name]
+        ds.variables["lat"].units = "degrees_north"
+        ds.variables["lon"].units = "degrees_east"
+        for name in WIND_FIELD_VARIABLES:
+            var = ds.createVariable(name, "f4", ("year", "lat", "lon"), zlib=True)
+            var[:] = field[name]
+            var.units = units[name]
+            var.long_name = f"annual mean {name}"
+            for suffix, unit in [
+                ("trend", f"{units[name]}/year"),
+                ("trend_se", f"{units[name]}/year"),
+                ("trend_p_value", "1"),
+            ]:
+                var = ds.createVariable(f"{name}_{suffix}", "f4", ("lat", "lon"))
+                var[:] = field[f"{name}_{suffix}"]
+                var.units = unit
+
+
+def project_coastal(u, v, alpha, speed=None):
+    """Project the squared wind on the coastline with angle alpha (degrees, North 0, CW).
+
+    Returns u2main (along the coastline) and u2perp (perpendicular to the coastline).
+    Arrays are broadcasted, for example u and v of shape (stations, time) with alpha of
+    shape (stations, 1), or u and v of shape (time,) with candidate angles of shape (angles, 1).
+    The speed defaults to the speed of u and v.
+    """
+    # convert alpha to radians and from North 0, CW to 0 east, CW
+    alpha_in_rad = np.deg2rad(90 - alpha)
+    direction_in_rad = np.arctan2(v, u)
+    if speed is None:
+        speed_squared = u**2 + v**2
+    else:
+        speed_squared = speed**2
+    u2main = speed_squared * np.cos(direction_in_rad - alpha_in_rad)
+    u2perp = speed_squared * np.sin(direction_in_rad - alpha_in_rad)
+    return u2main, u2perp
+
+
 def compute_coastal_directions(df, wind_df):
     """compute the wind in coastal directions"""
-    # convert alpha to radians and from North 0, CW to 0 east, CW
-    # x * pi / 180
-    alpha_in_rad = np.deg2rad(90 - df["alpha"])
-    direction_in_rad = np.arctan2(df["v"], df["u"])
     # these were used in intermediate reports
-    df["u2main"] = (wind_df["speed"] ** 2) * np.cos(direction_in_rad - alpha_in_rad)
-    df["u2perp"] = (wind_df["speed"] ** 2) * np.sin(direction_in_rad - alpha_in_rad)
+    u2main, u2perp = project_coastal(
+        df["u"], df["v"], df["alpha"], speed=wind_df["speed"]
+    )
     # the squared wind speed components along and perpendicular to the coastline
-    df["u2main"].fillna(df["u2main"].mean(), inplace=True)
-    df["u2perp"].fillna(df["u2perp"].mean(), inplace=True)
+    df["u2main"] = u2main.fillna(u2main.mean())
+    df["u2perp"] = u2perp.fillna(u2perp.mean())
 
     return df
 
 
-def get_wind_products(reference_point_wind=None):
-    """create a list of all the wind products"""
-    if reference_point_wind is None:
-        reference_point_wind = {"lat": 53, "lon": 3}
+def add_coastal_directions(long_df):
+    """Compute the wind in coastal directions for all stations of a long frame at once.
 
-    monthly_wind_products = {}
-    monthly_wind_products["NCEP1"] = slr.wind.make_wind_df(
-        product="NCEP1",
-        lat_i=reference_point_wind["lat"],
-        lon_i=reference_point_wind["lon"],
+    The long frame (indexed by station, t) needs u, v, speed and alpha columns
+    (see slr.psmsl.load_stations and merge_wind). Missing values are filled with the
+    mean of each station.
+    """
+    u2main, u2perp = project_coastal(
+        long_df["u"].to_numpy(),
+        long_df["v"].to_numpy(),
+        long_df["alpha"].to_numpy(dtype="float64"),
+        speed=long_df["speed"].to_numpy(),
+    )
+    long_df = long_df.assign(u2main=u2main, u2perp=u2perp)
+    grouped = long_df.groupby(level="station", sort=False)
+    for column in ["u2main", "u2perp"]:
+        long_df[column] = long_df[column].fillna(grouped[column].transform("mean"))
+    return long_df
+
+
+def _coastal_candidates(df, angles):
+    """u2main of a station for candidate angles (angles, time), as add_coastal_directions"""
+    speed = np.asarray(df["speed"], dtype="float64") if "speed" in df else None
+    u2main, _ = project_coastal(
+        np.asarray(df["u"], dtype="float64"),
+        np.asarray(df["v"], dtype="float64"),
+        angles[:, np.newaxis],
+        speed=speed,
     )
-    monthly_wind_products["20CR"] = slr.wind.make_wind_df(
-        product="20CR",
-        lat_i=reference_point_wind["lat"],
-        lon_i=reference_point_wind["lon"],
+    # missing values are filled with the mean of the station
+    return np.where(np.isnan(u2main), _nanmean(u2main, axis=1)[:, np.newaxis], u2main)
+
+
+def scan_coastal_angles(
+    dfs,
+    angles=range(0, 180),
+    with_ar=True,
+    with_nodal=True,
+    quantity="height",
+    batch_size=2048,
+):
+    """Fit the linear model with the wind along the coastline (u2main) for candidate angles.
+
+    dfs maps a station to its data frame (with u, v, speed and year, see merge_wind). The wind
+    along the coastline is computed and filled as in add_coastal_directions, so the scan uses
+    the same regressor as the fit with the chosen angle. Stations x angles are fitted in
+    batches of at most batch_size models (see slr.models.fit_batch), so memory does not grow
+    with the number of stations. u2main and u2perp together span the same space for every
+    angle, so only u2main is used, and angles 0-180 are enough (u2main of alpha + 180 is
+    -u2main of alpha). Returns a table indexed by (station, angle) with the wind effect
+    (mm per m2/s2), its standard error, aic, llf and rho. Use for example
+    scan.groupby(level="station")["aic"].idxmin() to pick the best angle of each station.
+    """
+    angles = np.asarray(angles, dtype="float64")
+    terms = [slr.models.Term("constant"), slr.models.Term("trend")]
+    if with_nodal:
+        terms.append(slr.models.Term("nodal"))
+
+    stations = list(dfs)
+    per_batch = max(batch_size // len(angles), 1)
+    scans = []
+    for i in range(0, len(stations), per_batch):
+        batch = stations[i : i + per_batch]
+        n_obs = max(len(dfs[station]) for station in batch)
+        endogs, exogs = [], []
+        for station in batch:
+            df = dfs[station]
+            X, _ = slr.models.build_design(df, terms)
+            u2main = _coastal_candidates(df, angles)
+            # pad to the longest station of the batch with missing values
+            exog = np.full((len(angles), n_obs, X.shape[1] + 1), np.nan)
+            exog[:, : len(df), :-1] = X
+            exog[:, : len(df), -1] = u2main
+            endog = np.full((len(angles), n_obs), np.nan)
+            endog[:, : len(df)] = np.asarray(df[quantity], dtype="float64")
+            endogs.append(endog)
+            exogs.append(exog)
+
+        index = pd.MultiIndex.from_product([batch, angles], names=["station", "angle"])
+        results = slr.models.fit_batch(
+            np.concatenate(endogs), np.concatenate(exogs), with_ar=with_ar, index=index
+        )
+        scans.append(
+            pd.DataFrame(
+                {
+                    "wind_effect": results.params.iloc[:, -1],
+                    "wind_effect_se": results.bse.iloc[:, -1],
+                    "aic": results.aic,
+                    "llf": results.llf,
+                    "rho": results.rho,
+                }
+            )
+        )
+    return pd.concat(scans)
+
+
+def get_wind_products(
+    reference_point_wind=None,
+    points=None,
+    products=("NCEP1", "20CR"),
+    blend=("20CR", "NCEP1"),
+    use_cache=True,
+    cache_dir=None,
+):
+    """create a list of all the wind products.
+    products are names of reanalysis products (see REANALYSIS_PRODUCTS), blend is a list of
+    products from old to new that is combined into the Combined product (see blend_wind_products).
+    With points (a data frame with lat and lon, indexed by station) the wind products
+    are computed for each station and indexed by (station, t).
+    With use_cache the products are stored in the cache directory and kept in memory, they
+    are recomputed if the location, the reanalysis files or WIND_PRODUCTS_VERSION change."""
+    if reference_point_wind is None:
+        reference_point_wind = {"lat": 53, "lon": 3}
+    products = list(products)
+    if blend is not None:
+        blend = list(blend)
+        products += [product for product in blend if product not in products]
+    if not use_cache:
+        return compute_wind_products(
+            reference_point_wind, points=points, products=products, blend=blend
+        )
+
+    location = _wind_location(reference_point_wind, points)
+    files = [
+        file_name
+        for product in products
+        for component_files in get_wind_files(product=product)
+        for file_name in component_files
+    ]
+    mtimes = [(str(file_name), _modification_time(file_name)) for file_name in files]
+    key = slr.cache.cache_key(
+        "wind", location, products, blend, mtimes, WIND_PRODUCTS_VERSION
     )
-    monthly_wind_products["Combined"] = slr.wind.combine_linear_scaling(
-        monthly_wind_products["20CR"], monthly_wind_products["NCEP1"]
+    product_names = products + (["Combined"] if blend is not None else [])
+
+    if key not in _wind_products_memory:
+        # stale files of the same location are replaced
+        location_key = slr.cache.cache_key(location)
+        paths = [
+            {
+                product: slr.cache.cache_path(
+                    "wind",
+                    f"{frequency}-{product}-{location_key}",
+                    key,
+                    cache_dir=cache_dir,
+                )
+                for product in product_names
+            }
+            for frequency in ["monthly", "annual"]
+        ]
+        if all(path.exists() for paths_i in paths for path in paths_i.values()):
+            computed = tuple(
+                {product: pd.read_parquet(path) for product, path in paths_i.items()}
+                for paths_i in paths
+            )
+        else:
+            computed = compute_wind_products(
+                reference_point_wind,
+                points=points,
+                products=products,
+                blend=blend,
+                use_cache=True,
+                cache_dir=cache_dir,
+            )
+            for paths_i, products_i in zip(paths, computed):
+                for product, path in paths_i.items():
+                    slr.cache.write_atomic(path, products_i[product].to_parquet())
+        _wind_products_memory[key] = computed
+        while len(_wind_products_memory) > WIND_PRODUCTS_MEMORY_SIZE:
+            _wind_products_memory.popitem(last=False)
+    _wind_products_memory.move_to_end(key)
+
+    # copies, callers are allowed to add columns (see add_u2v2)
+    return tuple(
+        {product: wind_df.copy() for product, wind_df in products_i.items()}
+        for products_i in _wind_products_memory[key]
     )
-    for product, wind_df in monthly_wind_products.items():
-        monthly_wind_products[product] = add_u2v2(wind_df)
 
-    annual_wind_products = {}
-    for product, wind_df in monthly_wind_products.items():
-        annual_wind_products[product] = slr.wind.make_annual_wind_df(wind_df)
-    return monthly_wind_products, annual_wind_products
 
+def _wind_location(reference_point_wind, points=None):
+    """the location of the wind products, as part of the cache keys"""
+    if points is None:
+        return [reference_point_wind["lat"], reference_point_wind["lon"]]
+    return [
+        list(points.index.names),
+        points.index.tolist(),
+        points["lat"].tolist(),
+        points["lon"].tolist(),
+    ]
 
-def get_gtsm_dfs(with_m=False, version="2022"):
-    """get the monthly and annual gtsm surge estimates per station"""
-    if version == "2022":
-        annual_file_name = "gtsm_surge_annual_mean_main_stations.csv"
-        monthly_file_name = "gtsm_surge_monthly_mean_main_stations.csv"
-    # temporary fix to compare twe datasets
-    elif version == "2023":
-        annual_file_name = "gtsm_surge_annual_mean_main_stations_2023.csv"
-        monthly_file_name = "gtsm_surge_monthly_mean_main_stations_2023.csv"
 
-    src_dir = slr.get_src_dir()
-    annual_gtsm_df = pd.read_csv(
-        src_dir / "data" / "deltares" / "gtsm" / annual_file_name,
-        converters={"t": pd.to_datetime},
+def _blend_coefficients_path(location, blend, cache_dir=None):
+    """the cached blend coefficients of a location, by the checksums of the reanalysis files"""
+    checksums = [
+        slr.cache.file_fingerprint(file_name, cache_dir=cache_dir)["sha256"]
+        for product in blend
+        for component_files in get_wind_files(product=product)
+        for file_name in component_files
+    ]
+    key = slr.cache.cache_key(
+        "blend", location, blend, checksums, WIND_PRODUCTS_VERSION
     )
-    annual_gtsm_df = annual_gtsm_df.drop(columns=["Unnamed: 0"])
-    annual_gtsm_df["year"] = annual_gtsm_df.t.dt.year
-
-    monthly_gtsm_df = pd.read_csv(
-        src_dir / "data" / "deltares" / "gtsm" / monthly_file_name,
-        converters={"t": pd.to_datetime},
+    location_key = slr.cache.cache_key(location)
+    return slr.cache.cache_path(
+        "wind", f"blend-{location_key}", key, cache_dir=cache_dir
     )
-    monthly_gtsm_df = monthly_gtsm_df.drop(columns=["Unnamed: 0"])
-    # compute year fraction
-    monthly_gtsm_df["year"] = [
-        slr.utils.datetime2year(dt) for dt in monthly_gtsm_df["t"]
-    ]
 
-    # add unit suffix (m -> mm * 1000)
-    annual_gtsm_df["surge_mm"] = annual_gtsm_df["surge"] * 1000
 
-    monthly_gtsm_df["surge_mm"] = monthly_gtsm_df["surge"] * 1000
+def compute_wind_products(
+    reference_point_wind,
+    points=None,
+    products=("NCEP1", "20CR"),
+    blend=("20CR", "NCEP1"),
+    use_cache=False,
+    cache_dir=None,
+):
+    """compute the monthly and annual wind products, see get_wind_products.
+    With use_cache the blend coefficients are reused until the reanalysis files change."""
 
-    # explicit use mm
-    if not with_m:
-        annual_gtsm_df = annual_gtsm_df.drop(columns=["surge"])
-        monthly_gtsm_df = monthly_gtsm_df.drop(columns=["surge"])
+    monthly_wind_products = {}
+    for product in products:
+        if points is None:
+            monthly_wind_products[product] = slr.wind.make_wind_df(
+                product=product,
+                lat_i=reference_point_wind["lat"],
+                lon_i=reference_point_wind["lon"],
+            )
+        else:
+            monthly_wind_products[product] = make_points_wind_df(
+                points, product=product
+            )
+    if blend is not None:
+        # the newest product has the highest priority, all points are blended at once
+        frames = {
+            product: monthly_wind_products[product] for product in reversed(blend)
+        }
+        coefficients = None
+        if use_cache:
+            path = _blend_coefficients_path(
+                _wind_location(reference_point_wind, points), blend, cache_dir=cache_dir
+            )
+            if path.exists():
+                coefficients = pd.read_parquet(path)
+        combined, fitted = blend_wind_products(frames, coefficients=coefficients)
+        if use_cache and coefficients is None:
+            slr.cache.write_atomic(path, fitted.to_parquet())
+        monthly_wind_products["Combined"] = combined
+    for product, wind_df in monthly_wind_products.items():
+        monthly_wind_products[product] = add_u2v2(wind_df)
 
-    if version == "2023":
-        # drop date from 1950, due to unexplainable high surge
-        monthly_gtsm_df = monthly_gtsm_df[
-            monthly_gtsm_df["t"] >= datetime.datetime(1951, 1, 1)
-        ]
-        annual_gtsm_df = annual_gtsm_df[
-            annual_gtsm_df["t"] >= datetime.datetime(1951, 1, 1)
-        ]
+    annual_wind_products = {}
+    for product, wind_df in monthly_wind_products.items():
+        if points is None:
+            annual_wind_products[product] = slr.wind.make_annual_wind_df(wind_df)
+        else:
+            annual_wind_products[product] = apply_per_point(
+                make_annual_wind_df, wind_df
+            )
+    return monthly_wind_products, annual_wind_products
 
-    return monthly_gtsm_df, annual_gtsm_df
+
+def get_gtsm_dfs(with_m=False, version="2022"):
+    """get the monthly and annual gtsm surge estimates per station (see slr.gtsm)"""
+    return slr.gtsm.get_gtsm_dfs(with_m=with_m, version=version)
 
 
 def compute_wind_effect_and_anomaly(fit, names):
     """compute the wind and anomaly effect for the model"""
-    u2_index = names.index("Wind $u^2$")
-    v2_index = names.index("Wind $v^2$")
-    u2_name = fit.model.exog_names[u2_index]
-    v2_name = fit.model.exog_names[v2_index]
-    u2 = fit.model.exog[:, u2_index]
-    v2 = fit.model.exog[:, v2_index]
-
-    wind_effect = fit.params.loc[u2_name] * u2 + fit.params.loc[v2_name] * v2
-    wind_anomaly = wind_effect - wind_effect.mean()
+    decomposition = slr.models.decompose_fit(fit, names)
+    wind_effect = decomposition["wind"][0]
+    wind_anomaly = decomposition.anomaly("wind")[0]
     return wind_effect, wind_anomaly
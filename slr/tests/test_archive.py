@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import pickle
+import zipfile
+
+import pandas as pd
+
+import pytest
+
+import slr.archive
+import slr.psmsl
+
+
+@pytest.fixture
+def zip_path(tmp_path):
+    """an archive with stored and deflated members"""
+    zip_path = tmp_path / "rlr_annual.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        zf.writestr("rlr_annual/filelist.txt", "")
+        zf.writestr("rlr_annual/empty.txt", "")
+        for station in range(1, 20):
+            lines = [
+                f"{year};{6000 + station + year:6d};N;000" for year in range(1900, 2000)
+            ]
+            compression = zipfile.ZIP_DEFLATED if station % 2 else zipfile.ZIP_STORED
+            zf.writestr(
+                f"rlr_annual/data/{station}.rlrdata",
+                "\n".join(lines),
+                compress_type=compression,
+            )
+    return zip_path
+
+
+def test_mapped_archive_same_as_zipfile(zip_path):
+    """test that the members are read the same as with zipfile"""
+    with zipfile.ZipFile(zip_path) as zf, slr.archive.MappedArchive(zip_path) as mf:
+        assert mf.namelist() == zf.namelist()
+        for name in zf.namelist():
+            assert mf.read(name) == zf.read(name)
+        assert "rlr_annual/data/1.rlrdata" in mf
+        with pytest.raises(KeyError):
+            mf.read("rlr_annual/data/20.rlrdata")
+
+        # the archive is opened again after pickling (for process pools)
+        copy = pickle.loads(pickle.dumps(mf))
+        name = "rlr_annual/data/3.rlrdata"
+        assert copy.read(name) == zf.read(name)
+        copy.close()
+
+        serial = slr.psmsl.read_archive_table(zf, "rlr_annual")
+        parallel = slr.psmsl.read_archive_table(mf, "rlr_annual", jobs=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_mapped_archive_crc(zip_path):
+    """test that a corrupt member is detected"""
+    with slr.archive.MappedArchive(zip_path) as mf:
+        name = "rlr_annual/data/2.rlrdata"
+        offset = mf.data_offset(name)
+    data = bytearray(zip_path.read_bytes())
+    data[offset] ^= 0xFF
+    zip_path.write_bytes(bytes(data))
+    with slr.archive.MappedArchive(zip_path) as mf:
+        with pytest.raises(zipfile.BadZipFile, match="bad crc32"):
+            mf.read(name)
+        # the other members can still be read
+        assert mf.read("rlr_annual/data/4.rlrdata").startswith(b"1900;")
+
+
+def test_mapped_archive_other_compression_and_empty(tmp_path):
+    """test that bzip2 members are read with zipfile and that empty files are bad zips"""
+    zip_path = tmp_path / "rlr_annual.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        zf.writestr("a.txt", "bzip2 " * 10, compress_type=zipfile.ZIP_BZIP2)
+        zf.writestr("b.txt", "stored", compress_type=zipfile.ZIP_STORED)
+    with slr.archive.MappedArchive(zip_path) as mf:
+        assert mf.read("a.txt") == b"bzip2 " * 10
+        assert mf.read("b.txt") == b"stored"
+
+    empty_path = tmp_path / "empty.zip"
+    empty_path.write_bytes(b"")
+    with pytest.raises(zipfile.BadZipFile, match="is empty"):
+        slr.archive.MappedArchive(empty_path)
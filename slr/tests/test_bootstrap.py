@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+import slr.bootstrap
+import slr.models
+import slr.wind
+
+
+@pytest.fixture
+def station_dfs():
+    """create dataframes for 2 stations with a trend of 2 mm/year, wind and AR(1) noise"""
+    rng = np.random.default_rng(1)
+    dfs = {}
+    for station in [20, 22]:
+        year = np.arange(1890, 2020).astype("float64")
+        noise = np.zeros_like(year)
+        for i in range(1, len(year)):
+            noise[i] = 0.5 * noise[i - 1] + rng.normal(scale=5)
+        u = rng.normal(scale=3, size=len(year))
+        v = rng.normal(scale=3, size=len(year))
+        df = pd.DataFrame({"year": year, "u": u, "v": v})
+        df = slr.wind.add_u2v2(df)
+        df["surge_mm"] = rng.normal(scale=2, size=len(year))
+        df["height"] = 2 * (year - 1970) + 0.5 * df["u2"] + df["surge_mm"] + noise
+        df["height - surge"] = df["height"] - df["surge_mm"]
+        dfs[station] = df
+    return dfs
+
+
+@pytest.mark.parametrize("method", ["block", "residual"])
+def test_bootstrap_interval(station_dfs, method):
+    """test that the intervals contain the trend and are close to the HC0 standard errors"""
+    result = slr.bootstrap.bootstrap(
+        station_dfs, method=method, n_replicates=400, seed=0
+    )
+    assert list(result.index.get_level_values("station").unique()) == [20, 22]
+    trend = result.xs("Trend", level="term")
+    assert ((trend["lower"] < 2) & (2 < trend["upper"])).all()
+
+    fit, _ = slr.models.linear_model(station_dfs[20])
+    np.testing.assert_allclose(trend.loc[20, "estimate"], fit.params["x1"])
+    np.testing.assert_allclose(trend.loc[20, "se"], fit.bse["x1"], rtol=0.5)
+
+
+def test_block_resample_keeps_gaps():
+    """test that blocks are taken from consecutive time steps, across the gaps"""
+    resid = np.arange(20.0)
+    resid[[5, 6, 12]] = np.nan
+    rng = np.random.default_rng(0)
+    resampled = slr.bootstrap._block_resample(resid, 50, 4, rng)
+    assert resampled.shape == (50, 20)
+    # the values of a block are consecutive time steps, a gap stays a gap
+    offsets = resampled.reshape(50, 5, 4) - np.arange(4)
+    np.testing.assert_array_equal(
+        np.nanmin(offsets, axis=2), np.nanmax(offsets, axis=2)
+    )
+    assert np.isnan(resampled).any()
+
+    # with missing years the blocks do not join the years around a gap
+    station = slr.bootstrap._prepare(
+        pd.DataFrame({"year": np.arange(1990, 2010.0), "height": resid}),
+        functools.partial(slr.models.linear_design, with_wind=False),
+        "height",
+        with_ar=False,
+    )
+    assert len(station["resid"]) == 20
+    assert np.isnan(station["resid"][[5, 6, 12]]).all()
+
+
+def test_bootstrap_with_gaps(station_dfs):
+    """test that series with missing years are resampled on all years"""
+    dfs = {}
+    for station, df in station_dfs.items():
+        df = df.copy()
+        df.loc[40:59, "height"] = np.nan
+        dfs[station] = df
+    for method in ["block", "residual"]:
+        result = slr.bootstrap.bootstrap(dfs, method=method, n_replicates=200, seed=0)
+        trend = result.xs("Trend", level="term")
+        assert ((trend["lower"] < 2) & (2 < trend["upper"])).all()
+        fit, _ = slr.models.linear_model(dfs[20].dropna(subset=["height"]))
+        np.testing.assert_allclose(trend.loc[20, "estimate"], fit.params["x1"])
+
+
+def test_bootstrap_reproducible(station_dfs):
+    """test that the results only depend on the seed, not on the number of jobs"""
+    kwargs = dict(method="residual", n_replicates=100, chunk_size=30, seed=42)
+    serial = slr.bootstrap.bootstrap(station_dfs, **kwargs)
+    parallel = slr.bootstrap.bootstrap(station_dfs, jobs=3, **kwargs)
+    pd.testing.assert_frame_equal(serial, parallel)
+    other = slr.bootstrap.bootstrap(station_dfs, **dict(kwargs, seed=43))
+    assert not serial.equals(other)
+
+
+def test_bootstrap_monte_carlo(station_dfs):
+    """test that more wind and surge uncertainty gives wider intervals"""
+    design = functools.partial(slr.models.linear_design, with_wind=True)
+    widths = []
+    for sd in [0.1, 1.0]:
+        result = slr.bootstrap.bootstrap(
+            station_dfs,
+            design=design,
+            method="monte_carlo",
+            n_replicates=200,
+            wind_sd=sd,
+            surge_sd=sd,
+            quantity="height - surge",
+            seed=0,
+        )
+        wind = result.xs("Wind $u^2$", level="term")
+        widths.append((wind["upper"] - wind["lower"]).to_numpy())
+    assert (widths[0] < widths[1]).all()
+
+    with pytest.raises(ValueError):
+        slr.bootstrap.bootstrap(station_dfs, method="monte_carlo")
+
+
+def test_bootstrap_monte_carlo_surge_not_in_model(station_dfs):
+    """test that surge_sd has no effect on the height without a surge regressor"""
+    design = functools.partial(slr.models.linear_design, with_wind=True)
+    kwargs = dict(design=design, method="monte_carlo", n_replicates=50, seed=0)
+    without_surge = slr.bootstrap.bootstrap(station_dfs, wind_sd=1.0, **kwargs)
+    with_surge = slr.bootstrap.bootstrap(
+        station_dfs, wind_sd=1.0, surge_sd=10.0, **kwargs
+    )
+    pd.testing.assert_frame_equal(without_surge, with_surge)
+
+    # the surge corrected height is perturbed
+    corrected = slr.bootstrap.bootstrap(
+        station_dfs, wind_sd=1.0, surge_sd=10.0, quantity="height - surge", **kwargs
+    )
+    uncorrected = slr.bootstrap.bootstrap(
+        station_dfs, wind_sd=1.0, quantity="height - surge", **kwargs
+    )
+    assert not corrected.equals(uncorrected)
+
+    with pytest.raises(ValueError, match="surge_sd has no effect"):
+        slr.bootstrap.bootstrap(station_dfs, surge_sd=10.0, **kwargs)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import json
+import os
+
+import slr.cache
+
+
+def test_file_fingerprint_parallel(tmp_path, monkeypatch):
+    """test that fingerprints computed at the same time are all kept"""
+    cache_dir = tmp_path / ".cache"
+    paths = []
+    for i in range(20):
+        paths.append(tmp_path / f"{i}.zip")
+        paths[-1].write_bytes(bytes([i]) * 1000)
+
+    def fingerprint(path):
+        return slr.cache.file_fingerprint(path, cache_dir=cache_dir)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        fingerprints = list(executor.map(fingerprint, paths + paths))
+    assert len({f["sha256"] for f in fingerprints}) == 20
+    stored = [json.loads(p.read_text()) for p in (cache_dir / "fingerprints").iterdir()]
+    assert sorted(f["path"] for f in stored) == sorted(str(p.resolve()) for p in paths)
+
+    # the stored fingerprints are used until a file changes
+    def open_(*args):
+        raise AssertionError("the file is hashed again")
+
+    monkeypatch.setattr(slr.cache, "open", open_, raising=False)
+    assert fingerprint(paths[3]) == fingerprints[3]
+    stat = paths[3].stat()
+    os.utime(paths[3], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    monkeypatch.undo()
+    assert fingerprint(paths[3])["mtime_ns"] == stat.st_mtime_ns + 10**9
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+import slr
+import slr.catalogue
+import slr.grid
+import slr.psmsl
+
+STATIONS = [
+    # id, lat, lon, name, coastline code, station code, quality, years of data
+    (20, 51.442222, 3.596111, "VLISSINGEN", 150, 1, "N", 130),
+    (22, 51.977500, 4.120000, "HOEK VAN HOLLAND", 150, 51, "N", 120),
+    (24, 53.326389, 6.933056, "DELFZIJL", 150, 101, "N", 20),
+    (1, 48.382850, -4.494838, "BREST", 190, 91, "N", 100),
+    (2, 51.000000, 179.900000, "EAST OF THE DATE LINE", 821, 1, "Y", 50),
+    (3, 51.000000, -179.900000, "WEST OF THE DATE LINE", 821, 2, "N", 50),
+]
+
+
+@pytest.fixture
+def src_dir(tmp_path, monkeypatch):
+    """a source directory with an annual psmsl archive and the main stations"""
+    psmsl_dir = tmp_path / "data" / "psmsl"
+    psmsl_dir.mkdir(parents=True)
+    lines = [
+        f"{id_:5d};{lat:10.6f};{lon:11.6f};{name:40s};{code:4d};{number:5d};{quality}"
+        for id_, lat, lon, name, code, number, quality, _ in STATIONS
+    ]
+    with zipfile.ZipFile(psmsl_dir / "rlr_annual.zip", "w") as zf:
+        zf.writestr("rlr_annual/filelist.txt", "\n".join(lines))
+        for id_, *_, n_years in STATIONS:
+            data = [f"{year};  7000;N;000" for year in range(2020 - n_years, 2020)]
+            # a missing value
+            data[0] = f"{2020 - n_years};-99999;N;000"
+            zf.writestr(f"rlr_annual/data/{id_}.rlrdata", "\n".join(data))
+
+    deltares_dir = tmp_path / "data" / "deltares"
+    deltares_dir.mkdir(parents=True)
+    main_stations = [
+        {"id": 20, "name": "Vlissingen", "ddl_id": "VLISSGN", "nap-rlr": 6930},
+        {"id": 22, "name": "Hoek van Holland", "ddl_id": "HOEKVHLD", "nap-rlr": 6873},
+    ]
+    (deltares_dir / "main_stations.json").write_text(json.dumps(main_stations))
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    monkeypatch.setattr(slr.catalogue, "_catalogues", {})
+    return tmp_path
+
+
+def test_station_list_urls(src_dir):
+    """test that the vectorized urls are the same as formatting them per station"""
+    with zipfile.ZipFile(src_dir / "data" / "psmsl" / "rlr_annual.zip") as zf:
+        stations = slr.psmsl.get_station_list(zf)
+    assert stations.loc[22, "name"] == "HOEK VAN HOLLAND"
+    assert stations.loc[2, "quality"] == "Y"
+    url_names = slr.psmsl.get_url_names()
+    for dataset_name in ["rlr_annual", "rlr_monthly", "met_monthly"]:
+        expected = [
+            url_names["url"].format(dataset_name=dataset_name, id=id_)
+            for id_ in stations.index
+        ]
+        assert list(stations[dataset_name + "_url"]) == expected
+    urls = slr.psmsl.format_urls(
+        url_names["datum"], [20, 1], dataset_name="rlr_annual"
+    )
+    assert list(urls) == ["rlr_annual/RLR_info/20.txt", "rlr_annual/RLR_info/1.txt"]
+
+
+def test_catalogue(src_dir):
+    """test the joined metadata, the record length and that the catalogue is cached"""
+    catalogue = slr.catalogue.get_station_catalogue()
+    assert slr.catalogue.get_station_catalogue() is catalogue
+    table = catalogue.table
+    assert len(catalogue) == 6
+    assert table.loc[20, "ddl_id"] == "VLISSGN"
+    assert table.loc[20, "name_main"] == "Vlissingen"
+    assert pd.isna(table.loc[24, "ddl_id"])
+    assert table.loc[22, "record_length"] == 119
+    assert table.loc[24, "record_length"] == 19
+
+
+def test_catalogue_queries(src_dir):
+    """test the spatial queries and the filters"""
+    catalogue = slr.catalogue.get_station_catalogue()
+
+    nearest = catalogue.nearest(51.9, 4.0, k=2)
+    assert list(nearest.index) == [22, 20]
+    assert nearest["distance_km"].iloc[0] < 15
+
+    # across the date line the stations are 14 km apart
+    within = catalogue.within_radius(51.0, 179.95, radius_km=20)
+    assert list(within.index) == [2, 3]
+    np.testing.assert_allclose(within["distance_km"], [3.5, 10.5], rtol=0.01)
+
+    assert list(catalogue.within_bbox(50, 54, 0, 10).index) == [20, 22, 24]
+    assert list(catalogue.within_bbox(50, 52, 179, -179).index) == [2, 3]
+
+    dutch = catalogue.filter(coastline_code=150, min_record_length=100)
+    assert list(dutch.table.index) == [20, 22]
+    assert list(dutch.nearest(53.3, 6.9).index) == [22]
+    assert list(catalogue.filter(quality="Y").table.index) == [2]
+    assert len(catalogue.filter(coastline_code=[150, 190])) == 4
+
+    # filtered catalogues are not kept in the grid index cache
+    n_indices = len(slr.grid._grid_indices)
+    for code in [150, 190, 150]:
+        catalogue.filter(coastline_code=code).nearest(52, 4)
+    assert len(slr.grid._grid_indices) == n_indices
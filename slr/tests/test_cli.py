@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+from click.testing import CliRunner
+
+import slr
+import slr.cli
+import slr.psmsl
+
+from .test_regions import selected_stations  # noqa: F401
+from .test_update import make_archive, server  # noqa: F401
+
+
+@pytest.fixture
+def selection(selected_stations, monkeypatch):  # noqa: F811
+    """the synthetic stations of test_regions instead of the local datasets"""
+    calls = []
+
+    def select_stations(**options):
+        calls.append(options)
+        return slr.psmsl.add_aggregated_stations(selected_stations.copy())
+
+    monkeypatch.setattr(slr.cli, "select_stations", select_stations)
+    return calls
+
+
+def test_fit(selection, tmp_path):
+    """test that all stations and regions are fitted with the selected models"""
+    output = tmp_path / "fits.parquet"
+    runner = CliRunner()
+    result = runner.invoke(
+        slr.cli.main,
+        ["fit", "--model", "linear", "--model", "quadratic", "--jobs", "0"],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    assert "Trend" in result.output
+    assert selection[-1]["jobs"] is None
+
+    result = runner.invoke(slr.cli.main, ["fit", "--without-wind", "-o", str(output)])
+    assert result.exit_code == 0
+    fits = pd.read_parquet(output)
+    assert set(fits["station"]) == {20, 22, 23, 24, 25, 32, 10000, 10001}
+    assert set(fits["variant"]) == set(slr.cli.MODELS)
+    assert "wind_u2" not in set(fits["key"])
+    # the heights rise 0.2 mm per year (the regions mix stations with different offsets)
+    trend = fits.query("variant == 'linear' and key == 'trend' and station < 10000")
+    np.testing.assert_allclose(trend["estimate"], 0.2, atol=0.02)
+    assert fits[["se", "aic", "rho"]].notna().all().all()
+
+
+def test_export(selection, tmp_path):
+    """test that the fitted values are the sum of the components"""
+    output = tmp_path / "export.json"
+    result = CliRunner().invoke(
+        slr.cli.main,
+        ["export", "--model", "broken_linear", "--station", "20", "-o", str(output)],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    assert selection[-1]["stations"] == (20,)
+    series = pd.DataFrame(json.loads(output.read_text()))
+    assert series["t"].str.startswith("1890").any()
+    components = ["constant", "trend", "nodal", "wind"]
+    expected = series[[f"{c}_broken_linear" for c in components]].sum(axis=1)
+    valid = series["height"].notna()
+    np.testing.assert_allclose(
+        series["predicted_broken_linear"][valid], expected[valid]
+    )
+    assert "surge_broken_linear" not in series
+
+
+def test_fetch_psmsl(tmp_path, server, monkeypatch):  # noqa: F811
+    """test that fetch updates the psmsl archives"""
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    server.content = make_archive({20: 7000, 22: 6900})
+    url = f"http://127.0.0.1:{server.server_port}/rlr_annual.zip"
+    get_psmsl_urls = slr.psmsl.get_psmsl_urls
+    monkeypatch.setattr(
+        slr.psmsl,
+        "get_psmsl_urls",
+        lambda local: get_psmsl_urls(local) if local else {"rlr_annual": url},
+    )
+    runner = CliRunner()
+    arguments = ["fetch", "--source", "psmsl", "--dataset", "rlr_annual"]
+    result = runner.invoke(slr.cli.main, arguments, catch_exceptions=False)
+    assert result.output == "psmsl rlr_annual: downloaded, 2 changed, 0 removed\n"
+    result = runner.invoke(slr.cli.main, arguments, catch_exceptions=False)
+    assert result.output == "psmsl rlr_annual: not_modified, 0 changed, 0 removed\n"
+    with zipfile.ZipFile(tmp_path / "data" / "psmsl" / "rlr_annual.zip") as zf:
+        assert "rlr_annual/data/22.rlrdata" in zf.namelist()
+
+
+def test_unknown_station(tmp_path, monkeypatch):
+    """test that stations that are not in the archive are reported"""
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    psmsl_dir = tmp_path / "data" / "psmsl"
+    psmsl_dir.mkdir(parents=True)
+    with zipfile.ZipFile(psmsl_dir / "rlr_annual.zip", "w") as zf:
+        zf.writestr("rlr_annual/filelist.txt", "20;51.44;3.60;VLISSINGEN;150;1;N")
+    deltares_dir = tmp_path / "data" / "deltares"
+    deltares_dir.mkdir(parents=True)
+    (deltares_dir / "main_stations.json").write_text(
+        json.dumps([{"id": 20, "name": "Vlissingen", "ddl_id": "VLISSGN"}])
+    )
+    result = CliRunner().invoke(slr.cli.main, ["fit", "--station", "1"])
+    assert result.exit_code == 2
+    assert "stations [1] not in rlr_annual" in result.output
+
+
+def test_select_stations(tmp_path, monkeypatch):
+    """test that only stations without a ddl_id use gtsm points, with coastline regions"""
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    psmsl_dir = tmp_path / "data" / "psmsl"
+    psmsl_dir.mkdir(parents=True)
+    with zipfile.ZipFile(psmsl_dir / "rlr_annual.zip", "w") as zf:
+        zf.writestr(
+            "rlr_annual/filelist.txt",
+            "20;51.44;3.60;VLISSINGEN;150;1;N\n1037;53.60;-1.60;IMMINGHAM;170;1;N",
+        )
+    deltares_dir = tmp_path / "data" / "deltares"
+    deltares_dir.mkdir(parents=True)
+    main_stations = [{"id": 20, "name": "Vlissingen", "ddl_id": "VLISSGN", "nap-rlr": 0}]
+    (deltares_dir / "main_stations.json").write_text(json.dumps(main_stations))
+    regions = [
+        {"id": 20150, "ddl_id": "C150", "name": "Coast 150", "coastline_code": 150},
+        {"id": 20999, "ddl_id": "C999", "name": "Coast 999", "coastline_code": 999},
+    ]
+    monkeypatch.setattr(slr.regions, "load_regions", lambda: regions)
+    calls = {}
+
+    def add_series_to_stations(selected, gtsm_points=None, **kwargs):
+        calls["gtsm_points"] = gtsm_points
+        return selected
+
+    def add_aggregated_stations(selected, regions=None):
+        calls["regions"] = regions
+        return selected
+
+    monkeypatch.setattr(slr.psmsl, "add_series_to_stations", add_series_to_stations)
+    monkeypatch.setattr(slr.psmsl, "add_aggregated_stations", add_aggregated_stations)
+    selected = slr.cli.select_stations(stations=(20, 1037))
+    assert list(selected.index) == [20, 1037]
+    assert list(calls["gtsm_points"].index) == [1037]
+    # the empty coastline is left out
+    assert [region["id"] for region in calls["regions"]] == [20150]
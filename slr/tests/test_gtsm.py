@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+import datetime
+
+import netCDF4
+import numpy as np
+import pandas as pd
+
+import pytest
+
+import slr
+import slr.grid
+import slr.gtsm
+import slr.psmsl
+import slr.utils
+
+
+@pytest.fixture
+def gtsm_dir(tmp_path, monkeypatch):
+    """a source directory with small gtsm files (2022 and 2023) for two stations"""
+    gtsm_dir = tmp_path / "data" / "deltares" / "gtsm"
+    gtsm_dir.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    stations = [("Vlissingen", "VLISSGN", 20), ("Delfzijl", "DELFZL", 24)]
+    for suffix, start in [("", "1979"), ("_2023", "1950")]:
+        t = pd.date_range(f"{start}-01-01", "1990-12-01", freq="MS")
+        monthly_frames = []
+        for name, ddl_id, psmsl_id in stations:
+            monthly_frames.append(
+                pd.DataFrame(
+                    {
+                        "t": t.strftime("%Y-%m-%d"),
+                        "name": name,
+                        "psmsl_id": float(psmsl_id),
+                        "ddl_id": ddl_id,
+                        "latitude": 51.4,
+                        "longitude": 3.6,
+                        "station_name": f"b'NWS_NO_TS_MO_{name}'",
+                        "surge": rng.normal(scale=0.05, size=len(t)),
+                    }
+                )
+            )
+        # the files are sorted by t, not by station
+        monthly = pd.concat(monthly_frames).sort_values("t", kind="stable")
+        monthly.to_csv(gtsm_dir / f"gtsm_surge_monthly_mean_main_stations{suffix}.csv")
+        annual = (
+            monthly.assign(t=monthly["t"].str[:4] + "-01-01")
+            .groupby(["t", "name", "ddl_id"], as_index=False)["surge"]
+            .mean()
+        )
+        annual.to_csv(gtsm_dir / f"gtsm_surge_annual_mean_main_stations{suffix}.csv")
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    monkeypatch.setattr(slr.gtsm, "_gtsm_stores", {})
+    return gtsm_dir
+
+
+def legacy_gtsm_dfs(gtsm_dir, version):
+    """the gtsm frames as they were parsed with a per cell converter"""
+    suffix = "_2023" if version == "2023" else ""
+    dfs = []
+    for frequency in ["monthly", "annual"]:
+        df = pd.read_csv(
+            gtsm_dir / f"gtsm_surge_{frequency}_mean_main_stations{suffix}.csv",
+            converters={"t": pd.to_datetime},
+        )
+        df = df.drop(columns=["Unnamed: 0"])
+        if frequency == "annual":
+            df["year"] = df.t.dt.year
+        else:
+            df["year"] = slr.utils.date2year(df["t"])
+        df["surge_mm"] = df["surge"] * 1000
+        df = df.drop(columns=["surge"])
+        if version == "2023":
+            df = df[df["t"] >= datetime.datetime(1951, 1, 1)]
+        dfs.append(df)
+    return dfs
+
+
+@pytest.mark.parametrize("version", ["2022", "2023"])
+def test_gtsm_dfs_same_as_legacy(gtsm_dir, version):
+    """test that the vectorized parser gives the same frames, sorted by station"""
+    dfs = slr.gtsm.get_gtsm_dfs(version=version)
+    for df, expected in zip(dfs, legacy_gtsm_dfs(gtsm_dir, version)):
+        expected = expected.sort_values(["ddl_id", "t"], kind="stable")
+        pd.testing.assert_frame_equal(df, expected.reset_index(drop=True))
+
+
+def test_gtsm_store_cache(gtsm_dir, monkeypatch):
+    """test that the store is parsed once and read from the parquet cache"""
+    store = slr.gtsm.get_gtsm_store()
+    assert slr.gtsm.get_gtsm_store() is store
+    assert len(list((gtsm_dir.parents[2] / ".cache" / "gtsm").glob("*.parquet"))) == 2
+
+    # a new process reads the cache, not the csv files
+    monkeypatch.setattr(slr.gtsm, "_gtsm_stores", {})
+
+    def read_gtsm_csv(*args, **kwargs):
+        raise AssertionError("csv file parsed again")
+
+    monkeypatch.setattr(slr.gtsm, "read_gtsm_csv", read_gtsm_csv)
+    cached = slr.gtsm.get_gtsm_store()
+    for frequency in ["monthly", "annual"]:
+        pd.testing.assert_frame_equal(
+            cached.tables[frequency], store.tables[frequency]
+        )
+
+
+def test_gtsm_store_station(gtsm_dir):
+    """test the per station views of the store"""
+    store = slr.gtsm.get_gtsm_store()
+    assert store.ddl_ids == ["DELFZL", "VLISSGN"]
+    assert "VLISSGN" in store
+    assert "HOEKVHLD" not in store
+
+    df = store.station("VLISSGN")
+    assert df.index.name == "t"
+    assert (df["ddl_id"] == "VLISSGN").all()
+    assert df.index.is_monotonic_increasing
+    assert np.shares_memory(
+        df["surge_mm"].to_numpy(), store.monthly["surge_mm"].to_numpy()
+    )
+    annual = store.station("VLISSGN", frequency="annual")
+    assert list(annual["year"]) == list(range(1979, 1991))
+    np.testing.assert_allclose(
+        annual["surge_mm"], df.groupby(df.index.year)["surge_mm"].mean()
+    )
+
+
+def test_merge_surge(gtsm_dir):
+    """test that the surge is looked up per station and filled with the station mean"""
+    store = slr.gtsm.get_gtsm_store()
+    t = pd.date_range("1978-01-01", "1990-12-01", freq="MS")
+    long_df = pd.DataFrame(
+        {"height": 1.0},
+        index=pd.MultiIndex.from_product([[20, 24], t], names=["station", "t"]),
+    )
+    ddl_ids = pd.Series({20: "VLISSGN", 24: "DELFZL"})
+    merged = slr.psmsl.merge_surge(long_df, store.monthly, ddl_ids, on="t")
+    vlissingen = store.station("VLISSGN")
+    np.testing.assert_allclose(
+        merged.loc[20, "surge_mm"].loc["1979":], vlissingen["surge_mm"]
+    )
+    # 1978 is not in gtsm
+    np.testing.assert_allclose(
+        merged.loc[20, "surge_mm"].loc["1978"], vlissingen["surge_mm"].mean()
+    )
+
+
+def write_gtsm_netcdf(path, t, lat, lon, surge, names=None, time_first=True):
+    """write a gtsm like netcdf file, with output stations (1d lat, lon) or a grid.
+    Without time_first the stations are stored as (stations, time), as in his files."""
+    with netCDF4.Dataset(path, "w") as ds:
+        ds.createDimension("time", None)
+        time = ds.createVariable("time", "f8", ("time",))
+        time.units = "minutes since 1979-01-01 00:00:00"
+        time[:] = (t - pd.Timestamp("1979-01-01")) / pd.Timedelta("1min")
+        if names is None:
+            ds.createDimension("lat", len(lat))
+            ds.createDimension("lon", len(lon))
+            ds.createVariable("lat", "f8", ("lat",))[:] = lat
+            ds.createVariable("lon", "f8", ("lon",))[:] = lon
+            dimensions = ("time", "lat", "lon")
+        else:
+            ds.createDimension("stations", len(lat))
+            ds.createDimension("name_length", 32)
+            ds.createVariable("station_y_coordinate", "f8", ("stations",))[:] = lat
+            ds.createVariable("station_x_coordinate", "f8", ("stations",))[:] = lon
+            station_id = ds.createVariable(
+                "station_id", "S1", ("stations", "name_length")
+            )
+            station_id[:] = np.array(names, dtype="S32").view("S1").reshape(-1, 32)
+            dimensions = ("time", "stations")
+            if not time_first:
+                dimensions, surge = ("stations", "time"), surge.T
+        variable = ds.createVariable("surge", "f4", dimensions, fill_value=-999.0)
+        variable[:] = surge
+
+
+@pytest.fixture
+def gtsm_netcdf_dir(tmp_path, monkeypatch):
+    """hourly gtsm output of 3 stations, in two files (december and january)"""
+    netcdf_dir = tmp_path / "data" / "deltares" / "gtsm" / "netcdf"
+    netcdf_dir.mkdir(parents=True)
+    rng = np.random.default_rng(1)
+    lat = np.array([51.44, 53.33, 40.0])
+    lon = np.array([3.60, 6.93, -70.0])
+    names = ["NWS_NO_TS_MO_Vlissingen", "NWS_NO_TS_MO_Delfzijl", "id_coast_glob_1"]
+    for month in ["1979-12", "1980-01"]:
+        t = pd.date_range(month, periods=31 * 24, freq="h")
+        surge = rng.normal(scale=0.1, size=(len(t), 3))
+        # a missing value
+        surge[0, 1] = -999.0
+        write_gtsm_netcdf(
+            netcdf_dir / f"reanalysis_surge_hourly_{month}_v1.nc",
+            t,
+            lat,
+            lon,
+            surge,
+            names=names,
+        )
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    monkeypatch.setattr(slr.gtsm, "_gtsm_stores", {})
+    return netcdf_dir
+
+
+def expected_means(netcdf_dir, column):
+    """the monthly means of a station column, read without chunks"""
+    frames = []
+    for path in sorted(netcdf_dir.glob("*.nc")):
+        with netCDF4.Dataset(path) as ds:
+            t = slr.grid.read_times(ds.variables["time"])
+            surge = np.ma.filled(ds.variables["surge"][:, column].astype(float), np.nan)
+            frames.append(pd.Series(surge, index=t))
+    return pd.concat(frames)
+
+
+def test_gtsm_points_store(gtsm_netcdf_dir):
+    """test the monthly and annual surge at the nearest output points of psmsl stations"""
+    points = pd.DataFrame(
+        {"lat": [53.3, 51.5], "lon": [6.9, 3.6]},
+        index=pd.Index([24, 20], name="station"),
+    )
+    store = slr.gtsm.read_gtsm_points(points, time_chunk=100)
+    store = slr.gtsm.GtsmStore(*store)
+    assert store.ddl_ids == [20, 24]
+
+    delfzijl = store.station(24)
+    assert (delfzijl["name"] == "NWS_NO_TS_MO_Delfzijl").all()
+    assert delfzijl["distance_km"].iloc[0] < 5
+    expected = expected_means(gtsm_netcdf_dir, 1)
+    np.testing.assert_allclose(
+        delfzijl["surge"], expected.resample("MS").mean(), rtol=1e-6
+    )
+    annual = store.station(24, frequency="annual")
+    assert list(annual["year"]) == [1979, 1980]
+    np.testing.assert_allclose(
+        annual["surge_mm"], 1000 * expected.resample("YS").mean(), rtol=1e-6
+    )
+
+
+def test_gtsm_points_stations_by_time(gtsm_netcdf_dir, tmp_path):
+    """test that series stored as (stations, time) are read along the time axis"""
+    points = pd.DataFrame({"lat": [53.3, 51.5], "lon": [6.9, 3.6]}, index=[24, 20])
+    files = sorted(gtsm_netcdf_dir.glob("*.nc"))
+    expected, _ = slr.gtsm.read_gtsm_points(points, files=files, time_chunk=100)
+
+    transposed = []
+    for path in files:
+        with netCDF4.Dataset(path) as ds:
+            t = slr.grid.read_times(ds.variables["time"])
+            surge = ds.variables["surge"][:]
+            names = netCDF4.chartostring(ds.variables["station_id"][:])
+            lat = ds.variables["station_y_coordinate"][:]
+            lon = ds.variables["station_x_coordinate"][:]
+        transposed.append(tmp_path / path.name)
+        write_gtsm_netcdf(
+            transposed[-1], t, lat, lon, surge, names=names, time_first=False
+        )
+    monthly, _ = slr.gtsm.read_gtsm_points(points, files=transposed, time_chunk=100)
+    pd.testing.assert_frame_equal(monthly, expected)
+
+    # a variable without the time dimension
+    spec = dict(slr.gtsm.GTSM_NETCDF, variable="station_id")
+    with pytest.raises(ValueError, match="no time dimension"):
+        slr.gtsm.read_gtsm_points(points, files=transposed, spec=spec)
+
+
+def test_gtsm_points_store_cache(gtsm_netcdf_dir, monkeypatch):
+    """test that the reduced surge is cached per set of points"""
+    points = pd.DataFrame({"lat": [51.5], "lon": [3.6]}, index=[20])
+    store = slr.gtsm.get_gtsm_points_store(points)
+    assert slr.gtsm.get_gtsm_points_store(points) is store
+
+    monkeypatch.setattr(slr.gtsm, "_gtsm_stores", {})
+
+    def read_gtsm_points(*args, **kwargs):
+        raise AssertionError("netcdf files read again")
+
+    monkeypatch.setattr(slr.gtsm, "read_gtsm_points", read_gtsm_points)
+    cached = slr.gtsm.get_gtsm_points_store(points)
+    pd.testing.assert_frame_equal(cached.monthly, store.monthly)
+
+
+def test_gtsm_grid(tmp_path):
+    """test the nearest grid cell of gridded gtsm output, across the date line"""
+    t = pd.date_range("2000-01-01", periods=48, freq="h")
+    lat = np.array([50.0, 51.0, 52.0])
+    lon = np.array([-179.5, 0.0, 179.5])
+    surge = np.broadcast_to(np.arange(9.0).reshape(3, 3), (len(t), 3, 3))
+    path = tmp_path / "gtsm_grid.nc"
+    write_gtsm_netcdf(path, t, lat, lon, surge)
+    spec = dict(slr.gtsm.GTSM_NETCDF, lat="lat", lon="lon")
+    points = pd.DataFrame({"lat": [51.9, 50.2], "lon": [-179.9, 0.1]}, index=[1, 2])
+    monthly, annual = slr.gtsm.read_gtsm_points(points, files=[path], spec=spec)
+    assert list(monthly["surge"]) == [6.0, 1.0]
+    assert list(monthly["latitude"]) == [52.0, 50.0]
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import functools
+
 import pandas as pd
 import numpy as np
 
@@ -105,3 +107,248 @@ def test_quadratic_model_acceleration_1960_data(df_acceleration_1960):
     np.testing.assert_almost_equal(fit.params["const"], -1, decimal=5)
     np.testing.assert_almost_equal(fit.params["x1"], 0.1, decimal=0.5)
     np.testing.assert_almost_equal(fit.params["x2"], 0.5, decimal=0.5)
+
+
+@pytest.fixture
+def station_dfs():
+    """create dataframes for 3 stations with a trend, wind, AR(1) noise and missing values"""
+    rng = np.random.default_rng(0)
+    dfs = {}
+    for station in [20, 22, 23]:
+        year = np.arange(1890, 2020).astype("float64")
+        noise = np.zeros_like(year)
+        for i in range(1, len(year)):
+            noise[i] = 0.5 * noise[i - 1] + rng.normal(scale=5)
+        df = pd.DataFrame(
+            {
+                "year": year,
+                "height": 0.1 * (year - 1970) + noise,
+                "u2": rng.normal(size=len(year)),
+                "v2": rng.normal(size=len(year)),
+            }
+        )
+        df.loc[[5, 17, 40], "height"] = np.nan
+        dfs[station] = df
+    return dfs
+
+
+@pytest.mark.parametrize("with_ar", [True, False])
+def test_fit_models_same_as_fit_model(station_dfs, with_ar):
+    """test that the batched fits give the same results as the statsmodels fits"""
+    models = {
+        "linear": slr.models.linear_design,
+        "linear_without_wind": functools.partial(
+            slr.models.linear_design, with_wind=False
+        ),
+        "broken_linear": slr.models.broken_linear_design,
+        "quadratic": slr.models.quadratic_design,
+        "broken_quadratic": slr.models.broken_quadratic_design,
+    }
+    results = slr.models.fit_models(station_dfs, models, with_ar=with_ar)
+    assert len(results) == 3 * 5
+
+    for station, df in station_dfs.items():
+        for variant, design in models.items():
+            X, names = design(df)
+            fit = slr.models.fit_model(df["height"], X, with_ar=with_ar)
+            label = (station, variant)
+            params = results.params.loc[label].dropna()
+            assert list(params.index) == list(fit.params.index)
+            assert results.names[label] == names
+            np.testing.assert_allclose(params, fit.params, rtol=1e-8)
+            np.testing.assert_allclose(
+                results.bse.loc[label].dropna(), fit.bse, rtol=1e-8
+            )
+            np.testing.assert_allclose(results.aic[label], fit.aic, rtol=1e-10)
+            assert results.nobs[label] == fit.nobs
+            if with_ar:
+                np.testing.assert_allclose(
+                    results.rho[label], fit.model.rho[0], rtol=1e-8
+                )
+
+
+@pytest.mark.parametrize(
+    "model, model_function",
+    [
+        ("broken_linear", slr.models.broken_linear_model),
+        ("broken_quadratic", slr.models.broken_quadratic_model),
+    ],
+)
+def test_scan_breakpoints_same_as_model(station_dfs, model, model_function):
+    """test that each candidate in the scan gives the same fit as the model function"""
+    df = station_dfs[20]
+    scan_df = slr.models.scan_breakpoints(df, range(1950, 2001), model=model)
+    assert len(scan_df) == 51
+
+    for start_acceleration in [1950, 1960, 1993]:
+        fit, names = model_function(df, start_acceleration=start_acceleration)
+        row = scan_df.loc[start_acceleration]
+        np.testing.assert_allclose(row["acceleration"], fit.params["x2"], rtol=1e-8)
+        np.testing.assert_allclose(row["acceleration_se"], fit.bse["x2"], rtol=1e-8)
+        np.testing.assert_allclose(row["aic"], fit.aic, rtol=1e-10)
+
+
+@pytest.mark.parametrize("with_ar", [True, False])
+@pytest.mark.parametrize(
+    "model, model_function",
+    [
+        ("broken_linear", slr.models.broken_linear_model),
+        ("broken_quadratic", slr.models.broken_quadratic_model),
+    ],
+)
+def test_scan_breakpoints_all_stations(station_dfs, model, model_function, with_ar):
+    """test that a scan over all stations gives the same fits as the model function"""
+    # some stations start later, the batches have several stations
+    dfs = {
+        station: df.iloc[5 * i :] for i, (station, df) in enumerate(station_dfs.items())
+    }
+    scan_df = slr.models.scan_breakpoints(
+        dfs, range(1950, 2021), model=model, with_ar=with_ar, batch_size=150
+    )
+    assert scan_df.index.names == ["station", "start_acceleration"]
+    assert len(scan_df) == 3 * 71
+
+    for station, df in dfs.items():
+        for start_acceleration in [1950, 1993, 2015]:
+            fit, _ = model_function(
+                df, start_acceleration=start_acceleration, with_ar=with_ar
+            )
+            row = scan_df.loc[(station, start_acceleration)]
+            np.testing.assert_allclose(
+                row["acceleration"], fit.params["x2"], rtol=1e-7
+            )
+            np.testing.assert_allclose(
+                row["acceleration_se"], fit.bse["x2"], rtol=1e-7
+            )
+            np.testing.assert_allclose(row["aic"], fit.aic, rtol=1e-10)
+            assert row["nobs"] == fit.nobs
+    # after the last year there is no acceleration to fit
+    np.testing.assert_allclose(scan_df.loc[(20, 2020), "acceleration"], 0, atol=1e-10)
+
+
+def test_scan_breakpoints_finds_start(df_acceleration_1960):
+    """test that the most likely start of the acceleration is found"""
+    rng = np.random.default_rng(0)
+    df = df_acceleration_1960.copy()
+    df["height"] += rng.normal(scale=0.5, size=len(df))
+    scan_df = slr.models.scan_breakpoints(
+        df, range(1930, 1991), model="broken_quadratic", with_wind=False, with_ar=False
+    )
+    assert scan_df["aic"].idxmin() == 1960
+    np.testing.assert_almost_equal(scan_df.loc[1960, "acceleration"], 0.5, decimal=2)
+
+
+def test_build_design_columns(df_acceleration_1960):
+    """test that the columns of a design can be found by term key in every model"""
+    df = df_acceleration_1960
+    X, names = slr.models.broken_quadratic_design(
+        df, with_wind=False, start_acceleration=1960
+    )
+    assert names[0] == "Constant (in year 1960)"
+    assert names[names.columns["acceleration"]] == "Acceleration from 1960"
+    np.testing.assert_array_equal(
+        X[:, names.columns["nodal_u"]],
+        np.cos(2 * np.pi * (df["year"] - 1970) / 18.613),
+    )
+
+    X, names = slr.models.broken_linear_design(df, with_wind=False)
+    assert names.keys == ["constant", "trend", "broken_trend", "nodal_u", "nodal_v"]
+    assert names[names.columns["broken_trend"]] == "+trend (1993)"
+    # year columns are shared between designs, but the design is a fresh copy
+    X[:, 0] = 0
+    X_again, _ = slr.models.broken_linear_design(df, with_wind=False)
+    assert (X_again[:, 0] == 1).all()
+
+
+@pytest.mark.parametrize("with_ar", [False, True])
+def test_predict_variants_same_as_get_prediction(station_dfs, with_ar):
+    """test that the closed form prediction variants match statsmodels get_prediction"""
+    df = station_dfs[20]
+    fit, names = slr.models.linear_model(df, with_wind=True, with_ar=with_ar)
+    predictions = slr.models.predict_variants(fit, names)
+    assert set(predictions) == set(slr.models.PREDICTION_VARIANTS)
+
+    exog_df = pd.DataFrame(fit.model.exog, columns=names)
+    for name, replace in slr.models.PREDICTION_VARIANTS.items():
+        variant_df = exog_df.copy()
+        for column, value in replace.items():
+            variant_df[column] = variant_df[column].mean() if value == "mean" else value
+        expected = fit.get_prediction(exog=variant_df)
+        prediction = predictions[name]
+        np.testing.assert_allclose(prediction.predicted_mean, expected.predicted_mean)
+        for obs in [False, True]:
+            np.testing.assert_allclose(
+                prediction.conf_int(obs=obs), expected.conf_int(obs=obs)
+            )
+        pd.testing.assert_frame_equal(
+            prediction.summary_frame(alpha=0.1), expected.summary_frame(alpha=0.1)
+        )
+
+    # without wind, only the tide variants are computed
+    fit, names = slr.models.linear_model(df, with_wind=False, with_ar=with_ar)
+    predictions = slr.models.predict_variants(fit, names)
+    assert set(predictions) == {"prediction", "prediction_mean_tide"}
+
+
+def test_decomposition_same_as_legacy(station_dfs):
+    """test that the batch components match the per fit tide and wind effects"""
+    models = {
+        "linear": slr.models.linear_design,
+        "broken_quadratic": functools.partial(
+            slr.models.broken_quadratic_design,
+            with_wind=False,
+            start_acceleration=1960,
+        ),
+    }
+    results = slr.models.fit_models(station_dfs, models)
+    decomposition = results.decomposition
+    assert results.decomposition is decomposition
+    assert set(decomposition) == set(slr.models.COMPONENTS) | {"residual"}
+
+    for station, df in station_dfs.items():
+        for variant, design in models.items():
+            X, names = design(df)
+            fit = slr.models.fit_model(df["height"], X)
+            i = decomposition.index.get_loc((station, variant))
+            valid = ~np.isnan(decomposition["residual"][i])
+            assert valid.sum() == len(fit.model.endog)
+
+            # the legacy computation, by display name
+            u = names.index("Nodal U")
+            v = names.index("Nodal V")
+            tide = X[valid, u] * fit.params[f"x{u}"] + X[valid, v] * fit.params[f"x{v}"]
+            np.testing.assert_allclose(decomposition["nodal"][i][valid], tide)
+            np.testing.assert_allclose(
+                slr.models.tide_effect(fit, list(names)), tide, rtol=1e-8
+            )
+            np.testing.assert_allclose(
+                slr.models.tide_effect(fit, names), tide, rtol=1e-8
+            )
+
+            # all components add up to the observations
+            components = decomposition.frame((station, variant)).loc[valid]
+            np.testing.assert_allclose(
+                components.sum(axis=1), df["height"][valid], rtol=1e-10
+            )
+            np.testing.assert_allclose(
+                fit.fittedvalues,
+                components.drop(columns=["residual"]).sum(axis=1),
+                rtol=1e-8,
+            )
+            if variant == "broken_quadratic":
+                np.testing.assert_array_equal(components["wind"], 0)
+                assert (components["acceleration"][df["year"] <= 1960] == 0).all()
+            else:
+                assert not (components["wind"] == 0).any()
+
+
+def test_decompose_fit_cached(station_dfs):
+    """test that the wind effect of a fit is computed once"""
+    fit, names = slr.models.linear_model(station_dfs[22], with_wind=True)
+    decomposition = slr.models.decompose_fit(fit, names)
+    assert slr.models.decompose_fit(fit, names) is decomposition
+    wind = decomposition["wind"][0]
+    np.testing.assert_allclose(
+        wind, fit.model.exog[:, 4:6] @ fit.params[["x4", "x5"]], rtol=1e-8
+    )
+    np.testing.assert_allclose(decomposition.anomaly("wind")[0], wind - wind.mean())
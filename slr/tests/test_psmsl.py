@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+import io
+import datetime
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+import slr.gtsm
+import slr.psmsl
+import slr.utils
+
+
+@pytest.fixture
+def monthly_bytes():
+    """the contents of a monthly psmsl data file, with one missing value"""
+    lines = [
+        "  1890.0417;  7012;  0;000",
+        "  1890.1250;-99999; 10;001",
+        "  1890.2083;  7000;  3;000",
+    ]
+    return "\n".join(lines).encode()
+
+
+@pytest.fixture
+def annual_bytes():
+    """the contents of an annual psmsl data file"""
+    lines = [
+        "  1890;  7001;N;000",
+        "  1891;-99999;Y;010",
+        "  1892;  6990;N;000",
+    ]
+    return "\n".join(lines).encode()
+
+
+@pytest.fixture
+def src_dir(tmp_path, monkeypatch):
+    """a source directory with small psmsl archives for stations 20 and 22"""
+    psmsl_dir = tmp_path / "data" / "psmsl"
+    psmsl_dir.mkdir(parents=True)
+    for dataset_name, extension in [
+        ("rlr_annual", "rlrdata"),
+        ("rlr_monthly", "rlrdata"),
+        ("met_monthly", "metdata"),
+    ]:
+        with zipfile.ZipFile(psmsl_dir / f"{dataset_name}.zip", "w") as zf:
+            for station, offset in [(20, 7000), (22, 6900)]:
+                if "annual" in dataset_name:
+                    years = np.arange(1890, 2020)
+                else:
+                    years = np.arange(1890, 2020, 1 / 12) + 1 / 24
+                heights = offset + (years - 1890).astype(int)
+                heights[3] = -99999
+                lines = [
+                    f"{year:.4f};{height:6d};  0;000"
+                    if "monthly" in dataset_name
+                    else f"{year:.0f};{height:6d};N;000"
+                    for year, height in zip(years, heights)
+                ]
+                zf.writestr(
+                    f"{dataset_name}/data/{station}.{extension}", "\n".join(lines)
+                )
+            zf.writestr(f"{dataset_name}/filelist.txt", "")
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    return tmp_path
+
+
+def test_parse_monthly(monthly_bytes):
+    """test that missing values become nan and flags become integers"""
+    df = slr.psmsl.parse_psmsl_data(monthly_bytes)
+
+    np.testing.assert_allclose(df["year"], [1890.0417, 1890.125, 1890.2083])
+    np.testing.assert_array_equal(df["height"], [7012, np.nan, 7000])
+    assert list(df["interpolated"]) == ["0", "10", "3"]
+    assert list(df["flags"]) == [0, 1, 0]
+
+
+def test_parse_annual_with_datum_offset(annual_bytes):
+    """test that the datum offset is subtracted from the heights"""
+    df = slr.psmsl.parse_psmsl_data(annual_bytes, datum_offset=6930)
+
+    np.testing.assert_array_equal(df["height"], [71, np.nan, 60])
+    assert list(df["interpolated"]) == ["N", "Y", "N"]
+    assert list(df["flags"]) == [0, 10, 0]
+
+
+def legacy_year2date(year_fraction, dtype="datetime64[s]"):
+    """the original implementation of year2date, with one datetime per row"""
+    startpoints = np.linspace(0, 1, num=12, endpoint=False)
+    remainder = np.mod(year_fraction, 1)
+    year = np.floor_divide(year_fraction, 1).astype("int")
+    month = np.searchsorted(startpoints, remainder)
+    if (month == 0).all():
+        month = np.ones_like(month)
+    dates = [
+        datetime.datetime(year_i, month_i, 1) for year_i, month_i in zip(year, month)
+    ]
+    return np.asarray(dates, dtype=dtype)
+
+
+@pytest.mark.parametrize(
+    "year_fraction",
+    [
+        # monthly data, as in rlr_monthly
+        np.arange(1850, 2025, 1 / 12) + 1 / 24,
+        # annual data, as integers and as floats
+        np.arange(1850, 2025),
+        np.arange(1850, 2025).astype("float64"),
+        pd.Series(np.arange(1890, 1900, 1 / 12) + 1 / 24),
+        [1993.0417, 1993.125, 1993.2083],
+    ],
+)
+@pytest.mark.parametrize("dtype", ["datetime64[s]", "<M8[ns]", "datetime64[D]"])
+def test_year2date_same_as_legacy(year_fraction, dtype):
+    """test that the vectorized year2date gives the same results as the original"""
+    dates = slr.psmsl.year2date(year_fraction, dtype=dtype)
+    expected = legacy_year2date(year_fraction, dtype=dtype)
+    assert dates.dtype == expected.dtype
+    np.testing.assert_array_equal(dates, expected)
+
+
+def test_year2date_mixed_raises():
+    """a mix of whole years and fractions can not be converted"""
+    with pytest.raises(ValueError):
+        slr.psmsl.year2date(np.array([1993.0, 1993.5]))
+
+
+def test_date2year_same_as_datetime2year():
+    """test that the vectorized date2year gives the same results as datetime2year"""
+    dates = pd.date_range("1979-01-01", "2022-12-01", freq="MS")
+    years = slr.utils.date2year(dates)
+    expected = [slr.utils.datetime2year(dt) for dt in dates.to_pydatetime()]
+    np.testing.assert_array_equal(years, expected)
+
+
+def test_get_psmsl_table_cached(src_dir):
+    """test that the archive is parsed once and filtered on station and time"""
+    table = slr.psmsl.get_psmsl_table("rlr_annual")
+    assert set(table["station"]) == {20, 22}
+    assert len(table) == 2 * 130
+    assert np.isnan(table["height"].iloc[3])
+
+    cached = list((src_dir / ".cache" / "psmsl").glob("rlr_annual-*.parquet"))
+    assert len(cached) == 1
+
+    subset = slr.psmsl.get_psmsl_table(
+        "rlr_monthly", stations=[22], start="2000-01-01", end="2001-01-01"
+    )
+    assert set(subset["station"]) == {22}
+    assert len(subset) == 12
+    assert subset["t"].iloc[0] == pd.Timestamp("2000-01-01")
+
+
+def test_get_psmsl_table_new_release(src_dir):
+    """test that a new release of the archive invalidates the cache"""
+    slr.psmsl.get_psmsl_table("rlr_annual")
+    zip_path = src_dir / "data" / "psmsl" / "rlr_annual.zip"
+    with zipfile.ZipFile(zip_path, "a") as zf:
+        zf.writestr("rlr_annual/data/23.rlrdata", "2000;  7000;N;000")
+
+    table = slr.psmsl.get_psmsl_table("rlr_annual")
+    assert set(table["station"]) == {20, 22, 23}
+    cached = list((src_dir / ".cache" / "psmsl").glob("rlr_annual-*.parquet"))
+    assert len(cached) == 1
+
+
+@pytest.fixture
+def selected_stations():
+    """the main station table, for two stations"""
+    return pd.DataFrame(
+        {
+            "name": ["Vlissingen", "Hoek van Holland"],
+            "nap-rlr": [6930, 6873],
+            "alpha": [118, 117],
+            "ddl_id": ["VLISSGN", "HOEKVHLD"],
+        },
+        index=pd.Index([20, 22], name="id"),
+    )
+
+
+@pytest.fixture
+def wind_and_surge(monkeypatch):
+    """replace the wind products and gtsm surge by small synthetic datasets"""
+    t = pd.date_range("1948-01-01", "2019-12-01", freq="MS")
+    rng = np.random.default_rng(0)
+    monthly_wind_df = pd.DataFrame(
+        {"u": rng.normal(size=len(t)), "v": rng.normal(size=len(t))},
+        index=pd.Index(t, name="t"),
+    )
+    monthly_wind_df["year"] = monthly_wind_df.index.year
+    monthly_wind_df = slr.wind.add_u2v2(monthly_wind_df)
+    annual_wind_df = slr.wind.make_annual_wind_df(monthly_wind_df)
+
+    def get_wind_products(reference_point_wind=None):
+        return {"NCEP1": monthly_wind_df}, {"NCEP1": annual_wind_df}
+
+    rows = []
+    for ddl_id in ["VLISSGN", "HOEKVHLD"]:
+        for t_i in pd.date_range("1979-01-01", "2017-12-01", freq="MS"):
+            rows.append({"t": t_i, "ddl_id": ddl_id, "surge_mm": t_i.month * 1.0})
+    monthly_gtsm_df = pd.DataFrame(rows)
+    monthly_gtsm_df["year"] = slr.utils.date2year(monthly_gtsm_df["t"])
+    annual_gtsm_df = (
+        monthly_gtsm_df.assign(year=monthly_gtsm_df["t"].dt.year)
+        .groupby(["ddl_id", "year"], as_index=False)["surge_mm"]
+        .mean()
+    )
+    annual_gtsm_df["t"] = pd.to_datetime(annual_gtsm_df["year"].astype(str))
+
+    def get_gtsm_store(version="2022"):
+        return slr.gtsm.GtsmStore(monthly_gtsm_df, annual_gtsm_df)
+
+    monkeypatch.setattr(slr.wind, "get_wind_products", get_wind_products)
+    monkeypatch.setattr(slr.gtsm, "get_gtsm_store", get_gtsm_store)
+
+
+def test_load_stations(src_dir, selected_stations):
+    """test that all stations are loaded in one frame, relative to NAP"""
+    long_df = slr.psmsl.load_stations("rlr_annual", selected_stations)
+    assert long_df.index.names == ["station", "t"]
+    assert long_df.loc[(20, pd.Timestamp("1890-01-01")), "height"] == 70
+    assert long_df.loc[(22, pd.Timestamp("1890-01-01")), "height"] == 27
+
+    views = dict(slr.psmsl.iter_stations(long_df))
+    assert list(views) == [20, 22]
+    assert len(views[22]) == 130
+    # the views share memory with the long frame
+    assert np.shares_memory(views[22]["height"].to_numpy(), long_df["height"].to_numpy())
+
+
+def test_add_series_to_stations(src_dir, selected_stations, wind_and_surge):
+    """test that the per station frames contain wind and surge"""
+    stations = slr.psmsl.add_series_to_stations(selected_stations)
+    for dataset_name in ["rlr_annual", "rlr_monthly", "met_monthly"]:
+        for id_, df in zip(stations.index, stations[dataset_name]):
+            assert df.index.name == "t"
+            assert (df["station"] == id_).all()
+            assert not df[["u2", "v2", "surge_mm"]].isna().any().any()
+            np.testing.assert_allclose(
+                df["height - surge"], df["height"] - df["surge_mm"]
+            )
+    annual_df = stations.loc[20, "rlr_annual"]
+    assert annual_df.loc["2000-01-01", "surge_mm"] == 6.5
+    monthly_df = stations.loc[22, "rlr_monthly"]
+    assert monthly_df.loc["2000-03-01", "surge_mm"] == 3
+
+
+def test_add_series_to_stations_failed(src_dir, selected_stations, wind_and_surge):
+    """test that a station that failed to parse is left out instead of aborting"""
+    zip_path = src_dir / "data" / "psmsl" / "rlr_monthly.zip"
+    with zipfile.ZipFile(zip_path) as zf:
+        members = {name: zf.read(name) for name in zf.namelist()}
+    members["rlr_monthly/data/22.rlrdata"] = b"not;a;station"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    table = slr.psmsl.get_psmsl_table("rlr_monthly")
+    assert list(table.attrs["failed"]) == [22]
+
+    with pytest.warns(UserWarning, match=r"stations \[22\]"):
+        stations = slr.psmsl.add_series_to_stations(selected_stations)
+    assert list(stations.index) == [20]
+    assert stations.attrs["failed"] == [22]
+    assert stations.loc[20, "rlr_monthly"]["height"].notna().any()
+
+
+def test_add_series_to_stations_gtsm_points(
+    src_dir, selected_stations, wind_and_surge, monkeypatch
+):
+    """test that stations without a ddl_id get the surge of the nearest gtsm point"""
+    selected_stations["ddl_id"] = ["VLISSGN", "UNKNOWN"]
+    with pytest.raises(ValueError, match="UNKNOWN"):
+        slr.psmsl.add_series_to_stations(selected_stations)
+
+    def get_gtsm_points_store(points):
+        # the surge in mm is the station id
+        t = pd.date_range("1979-01-01", "2017-12-01", freq="MS")
+        monthly = pd.DataFrame(
+            {
+                "t": np.tile(t, len(points)),
+                "ddl_id": np.repeat(points.index, len(t)),
+                "surge_mm": np.repeat(points.index, len(t)).astype(float),
+            }
+        )
+        monthly["year"] = slr.utils.date2year(monthly["t"])
+        annual = monthly[monthly["t"].dt.month == 1].assign(
+            year=lambda df: df["t"].dt.year
+        )
+        return slr.gtsm.GtsmStore(monthly, annual)
+
+    monkeypatch.setattr(slr.gtsm, "get_gtsm_points_store", get_gtsm_points_store)
+    gtsm_points = pd.DataFrame({"lat": [51.4, 52.0], "lon": [3.6, 4.1]}, index=[20, 22])
+    stations = slr.psmsl.add_series_to_stations(
+        selected_stations, gtsm_points=gtsm_points
+    )
+    assert (stations.loc[22, "rlr_monthly"]["surge_mm"] == 22).all()
+    assert (stations.loc[20, "rlr_annual"]["surge_mm"] == 20).all()
+
+    # only the station without a ddl_id uses the gtsm points
+    stations = slr.psmsl.add_series_to_stations(
+        selected_stations, gtsm_points=gtsm_points.loc[[22]]
+    )
+    assert (stations.loc[22, "rlr_monthly"]["surge_mm"] == 22).all()
+    monthly_df = stations.loc[20, "rlr_monthly"]
+    assert monthly_df.loc["2000-03-01", "surge_mm"] == 3
+
+
+def test_merge_wind_per_station(src_dir, selected_stations):
+    """test that wind indexed by (station, t) is merged with the data of each station"""
+    long_df = slr.psmsl.load_stations("rlr_annual", selected_stations)
+    t = pd.date_range("1950-01-01", "2019-01-01", freq="AS")
+    u = np.r_[np.ones(len(t)), -np.ones(len(t))]
+    wind_df = pd.DataFrame(
+        {"u": u, "v": 0.0, "u2": 0.0, "v2": 0.0},
+        index=pd.MultiIndex.from_product([[20, 22], t], names=["station", "t"]),
+    )
+    merged = slr.psmsl.merge_wind(long_df, wind_df)
+    assert merged.index.equals(long_df.index)
+    assert merged.loc[(20, pd.Timestamp("2000-01-01")), "u"] == 1
+    assert merged.loc[(22, pd.Timestamp("2000-01-01")), "u"] == -1
+    # before 1950 the wind is filled with the mean of the station
+    assert merged.loc[(22, pd.Timestamp("1900-01-01")), "u"] == -1
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_read_archive_table_parallel(src_dir, in_memory):
+    """test that parsing in a pool gives the same table as parsing serially"""
+    zip_path = src_dir / "data" / "psmsl" / "rlr_monthly.zip"
+    archive = zip_path.read_bytes() if in_memory else zip_path
+    with zipfile.ZipFile(io.BytesIO(archive) if in_memory else archive) as zf:
+        serial = slr.psmsl.read_archive_table(zf, "rlr_monthly")
+        parallel = slr.psmsl.read_archive_table(zf, "rlr_monthly", jobs=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_read_archive_table_failure(src_dir):
+    """test that a station that can not be parsed does not stop the others"""
+    zip_path = src_dir / "data" / "psmsl" / "rlr_annual.zip"
+    with zipfile.ZipFile(zip_path, "a") as zf:
+        zf.writestr("rlr_annual/data/23.rlrdata", "not;a;psmsl;file;at;all")
+    with zipfile.ZipFile(zip_path) as zf:
+        with pytest.warns(UserWarning, match="could not parse 1 stations"):
+            table = slr.psmsl.read_archive_table(zf, "rlr_annual", jobs=2)
+    assert set(table["station"]) == {20, 22}
+    assert list(table.attrs["failed"]) == [23]
+
+
+def test_failed_table_not_cached(src_dir):
+    """test that a table with failed stations is parsed and reported again"""
+    zip_path = src_dir / "data" / "psmsl" / "rlr_annual.zip"
+    with zipfile.ZipFile(zip_path, "a") as zf:
+        zf.writestr("rlr_annual/data/23.rlrdata", "not;a;psmsl;file;at;all")
+    for _ in range(2):
+        with pytest.warns(UserWarning, match="could not parse 1 stations"):
+            table = slr.psmsl.get_psmsl_table("rlr_annual", stations=[22, 23])
+        assert set(table["station"]) == {22}
+        assert list(table.attrs["failed"]) == [23]
+    assert not list((src_dir / ".cache" / "psmsl").glob("*.parquet"))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+import slr.psmsl
+import slr.regions
+
+
+@pytest.fixture
+def selected_stations():
+    """the main stations with annual and monthly frames, with missing values and gaps"""
+    rng = np.random.default_rng(0)
+    ids = [20, 22, 23, 24, 25, 32]
+    rows = []
+    for i, id_ in enumerate(ids):
+        row = {"name": f"station {id_}", "ddl_id": f"ID{id_}", "coastline_code": 150}
+        for dataset_name, freq in [
+            ("rlr_annual", "AS"),
+            ("rlr_monthly", "MS"),
+            ("met_monthly", "MS"),
+        ]:
+            # the stations start in different years
+            t = pd.date_range(f"{1880 + 5 * i}-01-01", "2019-12-01", freq=freq)
+            df = pd.DataFrame(
+                {
+                    "year": t.year + (t.month - 1) / 12,
+                    "height": 10 * i + 0.2 * (t.year - 1900) + rng.normal(size=len(t)),
+                    "flags": 0,
+                    "station": id_,
+                    "u2": rng.normal(size=len(t)),
+                    "v2": rng.normal(size=len(t)),
+                    "surge_mm": rng.normal(size=len(t)),
+                },
+                index=pd.Index(t, name="t"),
+            )
+            df.iloc[rng.integers(0, len(df), 10), 1] = np.nan
+            df.loc[df.index.year < 1950, "surge_mm"] = np.nan
+            row[dataset_name] = df
+        rows.append(row)
+    return pd.DataFrame(rows, index=pd.Index(ids, name="id"))
+
+
+def legacy_aggregate(selected_stations, idx, psmsl_id, dataset_name):
+    """the mean of a set of stations, as computed by add_aggregated_stations before"""
+    sub_selection = selected_stations.loc[idx]
+    data_per_station = pd.concat(sub_selection[dataset_name].tolist())
+    grouped = data_per_station[["year", "height", "u2", "v2", "surge_mm"]].groupby("t")
+    mean_df = grouped.mean().reset_index()
+    mean_df = mean_df[mean_df["year"] >= 1890].copy()
+    surge = mean_df["surge_mm"]
+    mean_df["station"] = psmsl_id
+    surge = surge.fillna(surge.mean())
+    mean_df["height - surge"] = mean_df["height"] - surge
+    mean_df["height - surge anomaly"] = mean_df["height"] - (surge - surge.mean())
+    return mean_df.set_index("t")
+
+
+def test_add_aggregated_stations_same_as_legacy(selected_stations):
+    """test that the regions file gives the same aggregated stations as before"""
+    stations = slr.psmsl.add_aggregated_stations(selected_stations)
+    assert list(stations.index) == [20, 22, 23, 24, 25, 32, 10000, 10001]
+    assert stations.loc[10001, "ddl_id"] == "NL-DELFZL"
+    for region_id, idx in [
+        (10000, [20, 22, 23, 24, 25, 32]),
+        (10001, [20, 22, 23, 25, 32]),
+    ]:
+        for dataset_name in ["rlr_annual", "rlr_monthly", "met_monthly"]:
+            expected = legacy_aggregate(
+                selected_stations, idx, region_id, dataset_name
+            )
+            pd.testing.assert_frame_equal(
+                stations.loc[region_id, dataset_name], expected
+            )
+
+
+def test_aggregate_regions_weights_and_coverage(selected_stations):
+    """test weighted means, minimum coverage and regions by coastline code"""
+    long_df = pd.concat(
+        selected_stations["rlr_annual"].tolist(),
+        keys=selected_stations.index,
+        names=["station", "t"],
+    )
+    regions = [
+        {"id": 1, "stations": [20, 22], "weights": {"20": 3, "22": 1}},
+        {"id": 2, "stations": [20, 32], "min_coverage": 1},
+        {"id": 3, "stations": [20, 22, 23], "weights": "inverse_variance"},
+    ]
+    regions += slr.regions.coastline_regions(selected_stations, start_year=1900)
+    aggregated = slr.regions.aggregate_regions(
+        long_df, regions, stations=selected_stations
+    )
+    heights = long_df["height"].unstack("station")
+
+    expected = (3 * heights[20] + heights[22]) / 4
+    valid = heights[[20, 22]].notna().all(axis=1)
+    np.testing.assert_allclose(aggregated.loc[1, "height"][valid], expected[valid])
+
+    # station 32 starts in 1905, both stations need a height
+    region = aggregated.loc[2]
+    assert region.index[0].year == 1905
+    valid = heights[[20, 32]].notna().all(axis=1)
+    assert list(region.index) == list(heights.index[valid])
+
+    # the weights are 1 / the variance of the noise
+    weights = slr.regions.inverse_variance(long_df)
+    assert len(weights) == 6
+    np.testing.assert_allclose(1 / weights, 1, rtol=0.3)
+
+    coastline = aggregated.loc[20000]
+    assert coastline.index[0].year == 1900
+    np.testing.assert_allclose(
+        coastline["height"], heights.loc["1900":].mean(axis=1), rtol=1e-10
+    )
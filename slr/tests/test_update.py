@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import hashlib
+import http.server
+import io
+import threading
+import zipfile
+
+import pandas as pd
+
+import pytest
+
+import slr
+import slr.psmsl
+import slr.update
+
+
+def make_archive(stations):
+    """an annual psmsl archive with an offset per station"""
+    stream = io.BytesIO()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("rlr_annual/filelist.txt", "")
+        for station, offset in stations.items():
+            lines = [
+                f"{year};{offset + year - 1900:6d};N;000" for year in range(1900, 2020)
+            ]
+            zf.writestr(f"rlr_annual/data/{station}.rlrdata", "\n".join(lines))
+    return stream.getvalue()
+
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    """serves server.content with an etag, supports conditional and range requests"""
+
+    def do_GET(self):
+        content = self.server.content
+        etag = '"' + hashlib.sha256(content).hexdigest()[:16] + '"'
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        range_ = self.headers.get("Range")
+        if range_ and self.headers.get("If-Range") == etag:
+            start = int(range_.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """a local http server for the psmsl archive"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def src_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    return tmp_path
+
+
+def test_update_psmsl(src_dir, server, monkeypatch):
+    """test that only new releases are downloaded and only changed stations are parsed"""
+    url = f"http://127.0.0.1:{server.server_port}/rlr_annual.zip"
+    urls = {"rlr_annual": url}
+    server.content = make_archive({20: 7000, 22: 6900, 23: 6800})
+
+    parsed = []
+    read_archive_table = slr.psmsl.read_archive_table
+
+    def recording_read_archive_table(zf, dataset_name, stations=None, jobs=1):
+        parsed.append(stations)
+        return read_archive_table(zf, dataset_name, stations=stations, jobs=jobs)
+
+    monkeypatch.setattr(slr.psmsl, "read_archive_table", recording_read_archive_table)
+
+    summary = slr.update.update_psmsl(["rlr_annual"], urls=urls)
+    assert summary["rlr_annual"]["status"] == "downloaded"
+    assert summary["rlr_annual"]["changed"] == [20, 22, 23]
+    assert parsed == [None]
+
+    # nothing changed
+    summary = slr.update.update_psmsl(["rlr_annual"], urls=urls)
+    assert summary["rlr_annual"]["status"] == "not_modified"
+    assert "If-None-Match" in server.requests[-1]
+
+    # a new release: station 22 is updated, 23 is removed and 24 is added
+    server.content = make_archive({20: 7000, 22: 6901, 24: 6700})
+    summary = slr.update.update_psmsl(["rlr_annual"], urls=urls)
+    assert summary["rlr_annual"] == {
+        "status": "downloaded",
+        "changed": [22, 24],
+        "removed": [23],
+        "failed": [],
+    }
+    assert parsed[-1] == [22, 24]
+
+    table = slr.psmsl.get_psmsl_table("rlr_annual")
+    with zipfile.ZipFile(src_dir / "data" / "psmsl" / "rlr_annual.zip") as zf:
+        expected = read_archive_table(zf, "rlr_annual")
+    pd.testing.assert_frame_equal(table, expected)
+    # only the table of the last release is cached
+    assert len(list((src_dir / ".cache" / "psmsl").glob("*.parquet"))) == 1
+
+
+def test_download_resumes(src_dir, server):
+    """test that an interrupted download continues where it stopped"""
+    url = f"http://127.0.0.1:{server.server_port}/rlr_annual.zip"
+    path = src_dir / "rlr_annual.zip"
+    server.content = make_archive({20: 7000, 22: 6900})
+    assert slr.update.download_archive(url, path) == "downloaded"
+    assert path.read_bytes() == server.content
+
+    # a new release, the first part was downloaded before the connection dropped
+    server.content = make_archive({20: 7000, 22: 6950})
+    assert slr.update.download_archive(url, path) == "downloaded"
+    partial_path = src_dir / "rlr_annual.zip.partial"
+    partial_path.write_bytes(server.content[:100])
+    state_path = src_dir / ".cache" / "http" / "rlr_annual.zip.json"
+    state = state_path.read_text().replace('"complete"', '"partial"')
+    state_path.write_text(state)
+
+    assert slr.update.download_archive(url, path) == "downloaded"
+    assert server.requests[-1]["Range"] == "bytes=100-"
+    assert path.read_bytes() == server.content
+    assert not partial_path.exists()
+
+    # a stale partial download of an older release is downloaded again
+    partial_path.write_bytes(b"old")
+    state_path.write_text('{"partial": {"etag": "\\"old\\"", "last_modified": null}}')
+    assert slr.update.download_archive(url, path) == "downloaded"
+    assert path.read_bytes() == server.content
+    assert sorted(slr.update.central_directory(path)) == [
+        "rlr_annual/data/20.rlrdata",
+        "rlr_annual/data/22.rlrdata",
+        "rlr_annual/filelist.txt",
+    ]
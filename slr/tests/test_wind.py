@@ -1,7 +1,536 @@
 #!/usr/bin/env python3
+import collections
+import os
+
+import netCDF4
+import numpy as np
+import pandas as pd
 import pytest
+import scipy.stats
+
+import slr
+import slr.grid
+import slr.models
+import slr.wind
 
 
 @pytest.fixture
 def wind_df():
     pass
+
+
+def write_wind_file(path, name, values, lat, lon):
+    """write a NCEP1 like monthly wind file, values has shape (time, lat, lon)"""
+    with netCDF4.Dataset(path, "w") as ds:
+        ds.createDimension("time", None)
+        ds.createDimension("lat", len(lat))
+        ds.createDimension("lon", len(lon))
+        ds.createVariable("lat", "f4", ("lat",))[:] = lat
+        ds.createVariable("lon", "f4", ("lon",))[:] = lon
+        var = ds.createVariable("time", "f8", ("time",))
+        var.units = "days since 1948-01-01 00:00:00"
+        var[:] = np.arange(len(values)) * 30.44
+        ds.createVariable(name, "f4", ("time", "lat", "lon"))[:] = values
+
+
+@pytest.fixture
+def noaa_dir(tmp_path, monkeypatch):
+    """a source directory with small NCEP1 and 20CR like u and v files (2.5 degree grid)"""
+    noaa_dir = tmp_path / "data" / "noaa"
+    noaa_dir.mkdir(parents=True)
+    lat = np.arange(90, -90.1, -2.5)
+    lon = np.arange(0, 360, 2.5)
+    files = [("", "uwnd"), ("", "vwnd"), ("20cr.", "uwnd"), ("20cr.", "vwnd")]
+    for prefix, name in files:
+        # encode the location in the value: lat + lon / 1000 + month * 1000
+        values = lat[:, np.newaxis] + lon[np.newaxis, :] / 1000
+        months = np.arange(24)[:, np.newaxis, np.newaxis]
+        path = noaa_dir / f"{prefix}{name}.10m.mon.mean.nc"
+        write_wind_file(path, name, values[np.newaxis] + months * 1000, lat, lon)
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    return noaa_dir
+
+
+def test_grid_index_wraps_around():
+    """test that the nearest point uses distances on the sphere"""
+    lat = np.arange(90, -90.1, -2.5)
+    lon = np.arange(0, 360, 2.5)
+    index = slr.grid.get_grid_index(lat, lon)
+    assert slr.grid.get_grid_index(lat, lon) is index
+    (i, j), distance = index.query([53, 52, 89.9], [-1.6, 359.2, 100])
+    # -1.6 E is closest to 357.5 E, not to 0 E
+    np.testing.assert_array_equal(lat[i], [52.5, 52.5, 90])
+    np.testing.assert_array_equal(lon[j[:2]], [357.5, 0])
+    np.testing.assert_allclose(distance[0], 82.2, atol=0.5)
+
+
+def test_make_wind_df(noaa_dir):
+    """test that the nearest point is read for all months"""
+    wind_df = slr.wind.make_wind_df(lat_i=53.6, lon_i=-1.6)
+    assert len(wind_df) == 24
+    assert wind_df.index[0] == pd.Timestamp("1948-01-01")
+    np.testing.assert_allclose(
+        wind_df["u"], 52.5 + 357.5 / 1000 + np.arange(24) * 1000, rtol=1e-6
+    )
+    # the files are opened once
+    assert slr.wind.get_wind_grid() is slr.wind.get_wind_grid()
+
+
+def test_read_points(noaa_dir):
+    """test that reading many points in chunks is the same as reading them one by one"""
+    grid = slr.wind.get_wind_grid()
+    indices = (np.array([10, 3, 10, 50]), np.array([7, 100, 2, 7]))
+    values = slr.wind.read_grid_points(grid, "u", indices, time_chunk=5)
+    assert values.shape == (24, 4)
+    with netCDF4.Dataset(noaa_dir / "uwnd.10m.mon.mean.nc") as ds:
+        for k, (i, j) in enumerate(zip(*indices)):
+            np.testing.assert_array_equal(values[:, k], ds.variables["uwnd"][:, i, j])
+
+
+class RecordingVariable:
+    """a variable that records the number of values of each read"""
+
+    def __init__(self, variable):
+        self.variable = variable
+        self.shape = variable.shape
+        self.sizes = []
+
+    def __getitem__(self, key):
+        block = self.variable[key]
+        self.sizes.append(block.size)
+        return block
+
+
+def test_read_scattered_points(noaa_dir):
+    """test that points scattered over the grid do not read the whole grid"""
+    rows = np.array([0, 10, 20, 30, 40, 50, 60, 70, 10])
+    columns = np.array([0, 15, 30, 45, 60, 75, 90, 105, 120])
+    with netCDF4.Dataset(noaa_dir / "uwnd.10m.mon.mean.nc") as ds:
+        variable = RecordingVariable(ds.variables["uwnd"])
+        values = slr.grid.read_points(variable, (rows, columns), time_chunk=5)
+        for k, (i, j) in enumerate(zip(rows, columns)):
+            np.testing.assert_array_equal(values[:, k], ds.variables["uwnd"][:, i, j])
+    # per row of points instead of the 8 x 9 rows and columns
+    assert max(variable.sizes) <= 5 * 2
+    assert sum(variable.sizes) == 24 * len(rows)
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_wind_grid_files_closed(noaa_dir):
+    """test that the cached grids do not keep the files open"""
+    slr.wind.get_wind_grid()
+    slr.wind.make_wind_df(lat_i=53.6, lon_i=-1.6)
+    open_files = [
+        os.path.realpath(f"/proc/self/fd/{fd}") for fd in os.listdir("/proc/self/fd")
+    ]
+    noaa_path = os.path.realpath(noaa_dir)
+    assert not [path for path in open_files if path.startswith(noaa_path)]
+
+
+def test_points_wind_same_as_reference_point(noaa_dir):
+    """test that the wind per station is the same as the wind of each point separately"""
+    points = pd.DataFrame(
+        {"lat": [51.44, 53.6, -33.9], "lon": [3.6, -1.6, 151.2]},
+        index=pd.Index([20, 22, 196], name="station"),
+    )
+    monthly_products, annual_products = slr.wind.get_wind_products(points=points)
+    for product in ["NCEP1", "20CR", "Combined"]:
+        monthly_df = monthly_products[product]
+        annual_df = annual_products[product]
+        assert monthly_df.index.names == ["station", "t"]
+        for station, point in points.iterrows():
+            monthly_expected, annual_expected = slr.wind.get_wind_products(
+                reference_point_wind=dict(point)
+            )
+            pd.testing.assert_frame_equal(
+                monthly_df.loc[station], monthly_expected[product], check_freq=False
+            )
+            pd.testing.assert_frame_equal(
+                annual_df.loc[station], annual_expected[product], check_freq=False
+            )
+
+
+def test_wind_products_cached(noaa_dir, monkeypatch):
+    """test that the wind products are read from memory or disk until a file changes"""
+    products = slr.wind.get_wind_products()
+    # monthly and annual NCEP1, 20CR and Combined, and the blend coefficients
+    cached = list((noaa_dir.parents[1] / ".cache" / "wind").glob("*.parquet"))
+    assert len(cached) == 7
+
+    def compute_wind_products(*args, **kwargs):
+        raise AssertionError("wind products should be cached")
+
+    with monkeypatch.context() as context:
+        context.setattr(slr.wind, "compute_wind_products", compute_wind_products)
+        from_memory = slr.wind.get_wind_products()
+        memory = collections.OrderedDict()
+        context.setattr(slr.wind, "_wind_products_memory", memory)
+        from_disk = slr.wind.get_wind_products()
+    for expected, result in [(products, from_memory), (products, from_disk)]:
+        for expected_i, result_i in zip(expected, result):
+            assert list(expected_i) == list(result_i)
+            for product in expected_i:
+                pd.testing.assert_frame_equal(
+                    expected_i[product], result_i[product], check_freq=False
+                )
+
+    # a new version of a reanalysis file replaces the cached products
+    path = noaa_dir / "uwnd.10m.mon.mean.nc"
+    new_path = noaa_dir / "new.nc"
+    new_path.write_bytes(path.read_bytes())
+    with netCDF4.Dataset(new_path, "a") as ds:
+        ds.variables["uwnd"][0] = 0
+    os.replace(new_path, path)
+    monthly_products, _ = slr.wind.get_wind_products()
+    assert monthly_products["NCEP1"]["u"].iloc[0] == 0
+    cached = list((noaa_dir.parents[1] / ".cache" / "wind").glob("*.parquet"))
+    assert len(cached) == 7
+
+
+def test_blend_coefficients_cached(noaa_dir, monkeypatch):
+    """test that the blend coefficients are reused while the reanalysis files are the same"""
+    points = pd.DataFrame(
+        {"lat": [51.44, 53.6], "lon": [3.6, -1.6]},
+        index=pd.Index([20, 22], name="station"),
+    )
+    products, _ = slr.wind.get_wind_products(points=points)
+    passed = []
+    blend_wind_products = slr.wind.blend_wind_products
+
+    def recording_blend_wind_products(products, coefficients=None, **kwargs):
+        passed.append(coefficients)
+        return blend_wind_products(products, coefficients=coefficients, **kwargs)
+
+    monkeypatch.setattr(slr.wind, "blend_wind_products", recording_blend_wind_products)
+    monkeypatch.setattr(slr.wind, "_wind_products_memory", collections.OrderedDict())
+    # a newer modification time recomputes the products, but not the coefficients
+    path = noaa_dir / "uwnd.10m.mon.mean.nc"
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    recomputed, _ = slr.wind.get_wind_products(points=points)
+    assert passed[-1] is not None
+    assert passed[-1].index.names == ["product", "column", "station", "month"]
+    pd.testing.assert_frame_equal(
+        recomputed["Combined"], products["Combined"], check_freq=False
+    )
+
+    # other contents fit new coefficients
+    with netCDF4.Dataset(path, "a") as ds:
+        ds.variables["uwnd"][0] = 0
+    slr.wind.get_wind_products(points=points)
+    assert passed[-1] is None
+
+
+@pytest.fixture
+def wind_field_dir(tmp_path, monkeypatch):
+    """NCEP1 like files with 30 years of random wind, with a trend in u"""
+    noaa_dir = tmp_path / "data" / "noaa"
+    noaa_dir.mkdir(parents=True)
+    lat = np.arange(90, -90.1, -2.5)
+    lon = np.arange(0, 360, 2.5)
+    rng = np.random.default_rng(0)
+    shape = (30 * 12, len(lat), len(lon))
+    months = np.arange(shape[0])[:, np.newaxis, np.newaxis]
+    u = rng.normal(size=shape) + 0.01 * months
+    v = rng.normal(size=shape)
+    v[3, 10, 0] = np.nan
+    write_wind_file(noaa_dir / "uwnd.10m.mon.mean.nc", "uwnd", u, lat, lon)
+    write_wind_file(noaa_dir / "vwnd.10m.mon.mean.nc", "vwnd", v, lat, lon)
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    return noaa_dir
+
+
+def test_compute_wind_field(wind_field_dir, tmp_path):
+    """test that the gridded annual means and trends match the point wind products"""
+    path = tmp_path / "wind_field.nc"
+    field = slr.wind.compute_wind_field(years_per_chunk=7, jobs=1, path=path)
+    assert list(field["year"]) == list(range(1948, 1978))
+    # west to east, across the 0 meridian, in the 0..360 convention of the grid
+    assert field["lon"][0] == 340 and field["lon"][-1] == 30
+    np.testing.assert_allclose(np.mod(np.diff(field["lon"]), 360), 2.5)
+    assert field["u2"].shape == (30, len(field["lat"]), len(field["lon"]))
+
+    # compare with the annual wind of one point
+    i, j = 3, 10
+    lat_i, lon_i = field["lat"][i], field["lon"][j]
+    wind_df = slr.wind.add_u2v2(slr.wind.make_wind_df(lat_i=lat_i, lon_i=lon_i))
+    annual_wind_df = slr.wind.make_annual_wind_df(wind_df)
+    for name in slr.wind.WIND_FIELD_VARIABLES:
+        np.testing.assert_allclose(
+            field[name][:, i, j], annual_wind_df[name], rtol=1e-5
+        )
+    result = scipy.stats.linregress(annual_wind_df["year"], annual_wind_df["u"])
+    np.testing.assert_allclose(field["u_trend"][i, j], result.slope, rtol=1e-5)
+    np.testing.assert_allclose(field["u_trend_se"][i, j], result.stderr, rtol=1e-5)
+    np.testing.assert_allclose(field["u_trend_p_value"][i, j], result.pvalue, rtol=1e-4)
+    assert (field["u_trend_p_value"] < 0.001).all()
+
+    # the same in worker processes, and in the NetCDF file
+    parallel = slr.wind.compute_wind_field(years_per_chunk=4)
+    with netCDF4.Dataset(path) as ds:
+        for name, values in parallel.items():
+            np.testing.assert_allclose(values, field[name])
+            np.testing.assert_allclose(ds.variables[name][:], field[name], rtol=1e-6)
+
+
+def test_wind_field_window(wind_field_dir):
+    """test that windows are normalised to the longitudes of the grid"""
+    europe = slr.wind.compute_wind_field(window=(40, 70, 340, 30), start_year=1970)
+    expected = slr.wind.compute_wind_field(window=(40, 70, -20, 30), start_year=1970)
+    for name, values in expected.items():
+        np.testing.assert_allclose(europe[name], values)
+
+    # across the date line, and the whole globe
+    pacific = slr.wind.compute_wind_field(window=(-10, 10, 170, -170), start_year=1970)
+    assert list(pacific["lon"]) == list(np.arange(170, 190.1, 2.5))
+    world = slr.wind.compute_wind_field(window=(-90, 90, -180, 180), start_year=1970)
+    assert world["u"].shape == (8, 73, 144)
+
+    # between the grid points, or outside the years
+    with pytest.raises(ValueError, match="No grid cells"):
+        slr.wind.compute_wind_field(window=(41, 42, -20, 30))
+    with pytest.raises(ValueError, match="No grid cells"):
+        slr.wind.compute_wind_field(window=(40, 70, 1, 2))
+    with pytest.raises(ValueError, match="No years"):
+        slr.wind.compute_wind_field(start_year=2000)
+
+
+@pytest.fixture
+def coastal_long_df():
+    """wind and heights for 2 stations, height responds to the wind along alpha"""
+    rng = np.random.default_rng(2)
+    t = pd.date_range("1950-01-01", "2019-01-01", freq="AS")
+    frames = {}
+    for station, alpha in [(20, 118), (22, 40)]:
+        df = pd.DataFrame(
+            {
+                "year": t.year.astype("float64"),
+                "u": rng.normal(scale=2, size=len(t)),
+                "v": rng.normal(scale=2, size=len(t)),
+                "alpha": alpha,
+            },
+            index=pd.Index(t, name="t"),
+        )
+        df["speed"] = np.sqrt(df["u"] ** 2 + df["v"] ** 2)
+        df.loc[df.index[5], ["u", "v", "speed"]] = np.nan
+        u2main, _ = slr.wind.project_coastal(df["u"], df["v"], alpha)
+        df["height"] = 2 * (df["year"] - 1970) + 3 * u2main.fillna(0)
+        df["height"] += rng.normal(scale=1, size=len(t))
+        frames[station] = df
+    return pd.concat(frames, names=["station"])
+
+
+def legacy_compute_coastal_directions(df, wind_df):
+    """the original compute_coastal_directions"""
+    alpha_in_rad = np.deg2rad(90 - df["alpha"])
+    direction_in_rad = np.arctan2(df["v"], df["u"])
+    df["u2main"] = (wind_df["speed"] ** 2) * np.cos(direction_in_rad - alpha_in_rad)
+    df["u2perp"] = (wind_df["speed"] ** 2) * np.sin(direction_in_rad - alpha_in_rad)
+    df["u2main"] = df["u2main"].fillna(df["u2main"].mean())
+    df["u2perp"] = df["u2perp"].fillna(df["u2perp"].mean())
+    return df
+
+
+def test_add_coastal_directions(coastal_long_df):
+    """test that all stations at once give the same as one station at a time"""
+    long_df = slr.wind.add_coastal_directions(coastal_long_df)
+    for station in [20, 22]:
+        df = coastal_long_df.loc[station].copy()
+        expected = legacy_compute_coastal_directions(df.copy(), df)
+        result = slr.wind.compute_coastal_directions(df.copy(), df)
+        pd.testing.assert_frame_equal(result, expected)
+        pd.testing.assert_frame_equal(long_df.loc[station], expected)
+
+    # the coastal wind can be used as a term of the design matrices
+    terms = [slr.models.Term("constant"), slr.models.Term("coastal_wind")]
+    X, names = slr.models.build_design(long_df.loc[20], terms)
+    u2main = X[:, names.columns["wind_main"]]
+    np.testing.assert_array_equal(u2main, long_df.loc[20, "u2main"])
+
+
+def test_scan_coastal_angles(coastal_long_df):
+    """test that the angle of the coastline is found"""
+    # the merged speed (of the monthly wind) is not the speed of the annual u and v
+    coastal_long_df = coastal_long_df.assign(speed=1.1 * coastal_long_df["speed"])
+    dfs = {
+        station: df.droplevel("station")
+        for station, df in coastal_long_df.groupby(level="station")
+    }
+    scan = slr.wind.scan_coastal_angles(dfs, angles=range(0, 180, 2))
+    assert len(scan) == 2 * 90
+    best = scan.groupby(level="station")["aic"].idxmin()
+    assert [angle for _, angle in best] == [118, 40]
+    np.testing.assert_allclose(
+        scan.loc[(20, 118), "wind_effect"], 3 / 1.1**2, rtol=0.05
+    )
+
+    # in batches of less than a station
+    batched = slr.wind.scan_coastal_angles(dfs, angles=range(0, 180, 2), batch_size=10)
+    pd.testing.assert_frame_equal(batched, scan)
+
+    # the same as the linear model with u2main as the only wind term
+    df = slr.wind.add_coastal_directions(coastal_long_df.assign(alpha=118.0)).loc[20]
+    df = df.assign(u2=df["u2main"], v2=0.0)
+    fit, _ = slr.models.linear_model(df, with_wind=True)
+    np.testing.assert_allclose(
+        scan.loc[(20, 118), "wind_effect"], fit.params["x4"], rtol=1e-6
+    )
+
+
+@pytest.fixture
+def era5_dir(tmp_path, monkeypatch):
+    """two hourly ERA5 like files with u10 and v10, split in the middle of February 2000"""
+    era5_dir = tmp_path / "data" / "ecmwf" / "era5"
+    era5_dir.mkdir(parents=True)
+    lat = np.arange(60, 49.9, -0.25)
+    lon = np.arange(-5, 10.01, 0.25)
+    hours = np.arange(0, 24 * (31 + 29 + 31))
+    rng = np.random.default_rng(3)
+    u = rng.normal(size=(len(hours), len(lat), len(lon)))
+    v = rng.normal(size=(len(hours), len(lat), len(lon)))
+    # hours since 2000-01-01 as in the climate data store files
+    split = 24 * 45
+    parts = [("2000a.nc", slice(None, split)), ("2000b.nc", slice(split, None))]
+    for name, part in parts:
+        with netCDF4.Dataset(era5_dir / name, "w") as ds:
+            ds.createDimension("time", None)
+            ds.createDimension("latitude", len(lat))
+            ds.createDimension("longitude", len(lon))
+            ds.createVariable("latitude", "f4", ("latitude",))[:] = lat
+            ds.createVariable("longitude", "f4", ("longitude",))[:] = lon
+            var = ds.createVariable("time", "i4", ("time",))
+            var.units = "hours since 2000-01-01 00:00:00.0"
+            var.calendar = "gregorian"
+            var[:] = hours[part]
+            dims = ("time", "latitude", "longitude")
+            ds.createVariable("u10", "f4", dims)[:] = u[part]
+            ds.createVariable("v10", "f4", dims)[:] = v[part]
+    monkeypatch.setattr(slr, "get_src_dir", lambda: tmp_path)
+    t = pd.Timestamp("2000-01-01") + pd.to_timedelta(hours, unit="h")
+    return {"lat": lat, "lon": lon, "t": t, "u": u, "v": v}
+
+
+def test_hourly_product_monthly_means(era5_dir):
+    """test that hourly files are reduced to monthly means while reading"""
+    wind_df = slr.wind.make_wind_df(lat_i=53, lon_i=3, product="ERA5")
+    months = pd.date_range("2000-01-01", periods=3, freq="MS")
+    assert list(wind_df.index) == list(months)
+    i = np.flatnonzero(era5_dir["lat"] == 53)[0]
+    j = np.flatnonzero(era5_dir["lon"] == 3)[0]
+    hourly = pd.Series(era5_dir["u"][:, i, j], index=era5_dir["t"])
+    np.testing.assert_allclose(wind_df["u"], hourly.resample("MS").mean(), rtol=1e-6)
+
+    # in small chunks, for many points
+    indices = (np.array([i, 0]), np.array([j, 5]))
+    t, u, v = slr.wind.read_monthly_points("ERA5", indices, time_chunk=100)
+    np.testing.assert_allclose(u[:, 0], wind_df["u"], rtol=1e-6)
+    assert u.shape == v.shape == (3, 2)
+
+
+def test_hourly_product_in_chunks(era5_dir):
+    """test that u and v of several files read in chunks are on the same months"""
+    indices = (np.array([3, 0, 20]), np.array([7, 5, 60]))
+    # chunks that do not line up with the months or the files
+    t, u, v = slr.wind.read_monthly_points("ERA5", indices, time_chunk=50)
+    assert list(t) == list(pd.date_range("2000-01-01", periods=3, freq="MS"))
+    for k, (i, j) in enumerate(zip(*indices)):
+        for component, values in [("u", u), ("v", v)]:
+            hourly = pd.Series(era5_dir[component][:, i, j], index=era5_dir["t"])
+            expected = hourly.resample("MS").mean()
+            np.testing.assert_allclose(values[:, k], expected, rtol=1e-5)
+
+    # the v files stop halfway february
+    spec = dict(slr.wind.REANALYSIS_PRODUCTS["ERA5"])
+    spec["files"] = dict(spec["files"], v="data/ecmwf/era5/2000a.nc")
+    slr.wind.register_reanalysis("ERA5a", **spec)
+    try:
+        with pytest.raises(ValueError, match="same months"):
+            slr.wind.read_monthly_points("ERA5a", indices, time_chunk=50)
+    finally:
+        del slr.wind.REANALYSIS_PRODUCTS["ERA5a"]
+
+
+def test_register_reanalysis(noaa_dir):
+    """test that a product can be registered and blended with the others"""
+    spec = dict(slr.wind.REANALYSIS_PRODUCTS["NCEP1"])
+    spec["files"] = dict(spec["files"], u="data/noaa/20cr.uwnd.10m.mon.mean.nc")
+    slr.wind.register_reanalysis("mixed", **spec)
+    try:
+        monthly_products, annual_products = slr.wind.get_wind_products(
+            products=["NCEP1", "mixed"], blend=("mixed", "NCEP1"), use_cache=False
+        )
+    finally:
+        del slr.wind.REANALYSIS_PRODUCTS["mixed"]
+    assert list(monthly_products) == ["NCEP1", "mixed", "Combined"]
+    assert list(annual_products) == ["NCEP1", "mixed", "Combined"]
+
+    with pytest.raises(ValueError, match="not available"):
+        slr.wind.make_wind_df(product="unknown")
+
+
+def make_product(start, end, offset, scale, seed):
+    """a monthly wind product with a seasonal cycle, with its own offset and scale"""
+    t = pd.date_range(start, end, freq="MS", name="t")
+    rng = np.random.default_rng(seed)
+    season = np.cos(2 * np.pi * t.month / 12)
+    df = pd.DataFrame(
+        {
+            "u": offset + scale * (season + rng.normal(size=len(t))),
+            "v": offset + scale * rng.normal(size=len(t)),
+        },
+        index=t,
+    )
+    df["year"] = df.index.year
+    return df
+
+
+def test_blend_same_as_combine_linear_scaling():
+    """test that blending two products gives the same as combine_linear_scaling"""
+    older = make_product("1836-01-01", "2015-12-01", offset=1, scale=2, seed=0)
+    newer = make_product("1948-01-01", "2023-12-01", offset=0, scale=1, seed=1)
+    expected = slr.wind.combine_linear_scaling(older, newer)
+    blended, coefficients = slr.wind.blend_wind_products(
+        {"NCEP1": newer, "20CR": older}
+    )
+    pd.testing.assert_frame_equal(blended, expected, check_dtype=False, check_freq=False)
+    diagnostics = coefficients.loc[("20CR", "u", 0)]
+    assert diagnostics["n_overlap"] == 68 * 12
+    assert diagnostics["rmse_scaled"] < diagnostics["rmse"]
+
+
+def test_blend_per_month_and_coefficients():
+    """test the scaling per calendar month and reusing the coefficients"""
+    oldest = make_product("1836-01-01", "1960-12-01", offset=2, scale=3, seed=2)
+    older = make_product("1900-01-01", "2015-12-01", offset=1, scale=2, seed=0)
+    newer = make_product("1948-01-01", "2023-12-01", offset=0, scale=1, seed=1)
+    products = {"NCEP1": newer, "20CR": older, "oldest": oldest}
+    blended, coefficients = slr.wind.blend_wind_products(products, per_month=True)
+    assert blended.index[0] == oldest.index[0]
+    assert blended.index[-1] == newer.index[-1]
+    # the reference is unchanged, the others are scaled to the same monthly statistics
+    pd.testing.assert_frame_equal(blended.loc["1948":], newer, check_freq=False)
+    january = blended.index.month == 1
+    early = blended[january & (blended.index.year < 1948)]
+    late = blended[january & (blended.index.year >= 1948)]
+    np.testing.assert_allclose(early["u"].mean(), late["u"].mean(), atol=0.5)
+    assert set(coefficients.index.get_level_values("month")) == set(range(1, 13))
+    assert set(coefficients.index.get_level_values("product")) == {"20CR", "oldest"}
+
+    again, _ = slr.wind.blend_wind_products(
+        products, per_month=True, coefficients=coefficients
+    )
+    pd.testing.assert_frame_equal(again, blended)
+
+
+def test_add_u2v2_fills_per_point():
+    """test that missing wind is filled with the mean of the same point"""
+    t = pd.date_range("2000-01-01", periods=3, freq="MS", name="t")
+    wind_df = pd.DataFrame(
+        {"u": [1.0, np.nan, 3.0, 10.0, 20.0, 30.0], "v": 1.0},
+        index=pd.MultiIndex.from_product([[20, 22], t], names=["station", "t"]),
+    )
+    wind_df = slr.wind.add_u2v2(wind_df)
+    assert wind_df.loc[(20, t[1]), "u2"] == 5
+    assert not wind_df["u2"].isna().any()
+    pd.testing.assert_frame_equal(
+        wind_df.loc[20], slr.wind.add_u2v2(wind_df.loc[20, ["u", "v"]].copy())
+    )